@@ -0,0 +1,110 @@
+"""Statements issued and wall time to refresh synthetic quotes against SQLite.
+
+Compares the previous one UPDATE per symbol loop with the bulk writer:
+
+    poetry run python benchmarks/bench_bulk_write.py --symbols 1000
+"""
+
+import asyncio
+from datetime import datetime
+from os import environ
+from random import uniform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+
+from santaka.db import create_schema, currency, database, stocks  # noqa: E402
+from santaka.stock.utils import update_stock_prices  # noqa: E402
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+        self._execute = database.execute
+
+    async def execute(self, *args, **kwargs):
+        self.statements += 1
+        return await self._execute(*args, **kwargs)
+
+
+def seed(symbols: int):
+    create_schema()
+    now = datetime.utcnow()
+    database.engine.execute(
+        currency.insert(),
+        [
+            {
+                "currency_id": 1,
+                "iso_currency": "USD",
+                "last_rate": 1,
+                "symbol": "EURUSD=X",
+                "last_update": now,
+            }
+        ],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": i,
+                "market": "NYSE",
+                "symbol": f"SYM{i}",
+                "short_name": f"synthetic {i}",
+                "last_price": 100,
+                "last_update": now,
+                "currency_id": 1,
+            }
+            for i in range(symbols)
+        ],
+    )
+
+
+async def update_one_by_one(prices, now):
+    for symbol in prices:
+        query = (
+            stocks.update()
+            .values(last_price=prices[symbol], last_update=now)
+            .where(stocks.c.symbol == symbol)
+        )
+        await database.execute(query)
+
+
+async def run(update, prices):
+    counter = StatementCounter()
+    database.execute = counter.execute
+    try:
+        start = perf_counter()
+        async with database.transaction():
+            await update(prices, datetime.utcnow())
+        elapsed = perf_counter() - start
+    finally:
+        del database.execute
+    return counter.statements, elapsed
+
+
+async def main(symbols: int):
+    seed(symbols)
+    prices = {f"SYM{i}": round(uniform(1, 500), 4) for i in range(symbols)}
+    await database.connect()
+    try:
+        loop_statements, loop_time = await run(update_one_by_one, prices)
+        bulk_statements, bulk_time = await run(update_stock_prices, prices)
+    finally:
+        await database.disconnect()
+    print(f"symbols refreshed: {symbols}")
+    print(f"one update per symbol: {loop_statements:6d} statements {loop_time:8.3f}s")
+    print(f"bulk writer:           {bulk_statements:6d} statements {bulk_time:8.3f}s")
+
+
+@click.command()
+@click.option("--symbols", type=int, default=1000)
+def bench(symbols: int):
+    asyncio.run(main(symbols))
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,155 @@
+"""Peak memory and time to export the transaction history of an owner.
+
+Compares materializing the history like get_stock_transaction_history, with
+fetch_all and a response model validating every row, with the streamed
+export consumed chunk by chunk:
+
+    poetry run python benchmarks/bench_export.py --transactions 200000
+"""
+
+import asyncio
+import tracemalloc
+from datetime import datetime, timedelta
+from os import environ
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+
+from santaka.account.models import Bank  # noqa: E402
+from santaka.db import (  # noqa: E402
+    accounts,
+    create_schema,
+    currency,
+    database,
+    owners,
+    stock_transactions,
+    stocks,
+)
+from santaka.stock.exports import build_export_query, iterate_statement  # noqa: E402
+from santaka.stock.models import (  # noqa: E402
+    StatementFormat,
+    StockTransactionHistory,
+)
+
+STOCK_COUNT = 200
+
+
+def seed(transactions: int):
+    create_schema()
+    random = Random(0)
+    now = datetime.utcnow()
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": 1,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": "1",
+            }
+        ],
+    )
+    database.engine.execute(
+        owners.insert(), [{"owner_id": 1, "account_id": 1, "fullname": "owner"}]
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": i,
+                "market": "Milan",
+                "symbol": f"SYM{i}.MI",
+                "short_name": str(i),
+                "last_price": 10,
+                "last_update": now,
+                "currency_id": 1,
+            }
+            for i in range(1, STOCK_COUNT + 1)
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": i,
+                "stock_id": random.randint(1, STOCK_COUNT),
+                "owner_id": 1,
+                "price": random.uniform(1, 100),
+                "quantity": random.randint(1, 100),
+                "tax": 0,
+                "commission": 1.5,
+                "date": now - timedelta(minutes=i),
+                "transaction_type": "buy",
+                "transaction_note": f"order {i}",
+                "transaction_ex_rate": 1,
+            }
+            for i in range(1, transactions + 1)
+        ],
+    )
+
+
+async def materialized() -> int:
+    records = await database.fetch_all(build_export_query(1))
+    history = StockTransactionHistory(
+        transactions=[
+            {
+                "price": record.price,
+                "quantity": record.quantity,
+                "tax": record.tax,
+                "commission": record.commission,
+                "date": record.date,
+                "transaction_type": record.transaction_type,
+                "stock_id": 1,
+                "stock_transaction_id": record.stock_transaction_id,
+                "transaction_note": record.transaction_note,
+                "transaction_ex_rate": record.transaction_ex_rate,
+            }
+            for record in records
+        ]
+    )
+    return len(history.json())
+
+
+async def streamed() -> int:
+    size = 0
+    async for chunk in iterate_statement(1, StatementFormat.NDJSON):
+        size += len(chunk)
+    return size
+
+
+async def main(transactions: int):
+    seed(transactions)
+    print(f"transactions: {transactions}")
+    async with database:
+        for name, export in (("materialized", materialized), ("streamed", streamed)):
+            start = perf_counter()
+            size = await export()
+            elapsed = perf_counter() - start
+            # tracing slows allocations down, the peak is taken on a second run
+            tracemalloc.start()
+            await export()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name:12} peak: {peak / 1024 / 1024:7.1f}MB "
+                f"time: {elapsed:6.2f}s output: {size / 1024 / 1024:6.1f}MB"
+            )
+
+
+@click.command()
+@click.option("--transactions", type=int, default=200_000)
+def bench(transactions: int):
+    asyncio.run(main(transactions))
+
+
+if __name__ == "__main__":
+    bench()
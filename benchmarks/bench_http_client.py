@@ -0,0 +1,94 @@
+"""Yahoo quote calls per second: new session per call vs the shared client.
+
+Starts a local stub of the quote endpoint and hammers it with both strategies:
+
+    poetry run python benchmarks/bench_http_client.py --calls 2000 --concurrency 20
+"""
+
+import asyncio
+from os import environ
+from time import perf_counter
+
+import click
+from aiohttp import ClientSession, web
+
+environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from santaka.stock import providers  # noqa: E402
+from santaka.http_client import http_client  # noqa: E402
+
+
+async def quote_handler(request: web.Request) -> web.Response:
+    result = []
+    for symbol in request.query["symbols"].split(","):
+        result.append(
+            {
+                "symbol": symbol,
+                providers.YAHOO_FIELD_PRICE: 100.0,
+                providers.YAHOO_FIELD_CURRENCY: "USD",
+                providers.YAHOO_FIELD_MARKET: providers.YahooMarket.USA_NASDAQ.value,
+                providers.YAHOO_FIELD_NAME: symbol.lower(),
+                providers.YAHOO_FIELD_FINANCIAL_CURRENCY: "USD",
+            }
+        )
+    return web.json_response({"quoteResponse": {"result": result, "error": None}})
+
+
+async def start_stub_server() -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/v7/finance/quote", quote_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner
+
+
+async def run_calls(get_quote, calls: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            await get_quote(["AAPL"])
+
+    start = perf_counter()
+    await asyncio.gather(*[call() for _ in range(calls)])
+    return calls / (perf_counter() - start)
+
+
+async def main(calls: int, concurrency: int):
+    runner = await start_stub_server()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/v7/finance/quote"
+    provider = providers.YahooProvider(url)
+
+    async def get_quote_new_session(symbols):
+        # the implementation before the shared client: one session per call
+        async with ClientSession() as session:
+            async with session.get(url, params={"symbols": ",".join(symbols)}) as resp:
+                return providers.parse_yahoo_response(await resp.json())
+
+    try:
+        before = await run_calls(get_quote_new_session, calls, concurrency)
+        await http_client.connect()
+        try:
+            after = await run_calls(provider.get_quotes, calls, concurrency)
+        finally:
+            await http_client.disconnect()
+    finally:
+        await runner.cleanup()
+    print(f"calls: {calls}, concurrency: {concurrency}")
+    print(f"new session per call: {before:10.1f} calls/s")
+    print(f"shared pooled client: {after:10.1f} calls/s")
+    print(f"speedup:              {after / before:10.2f}x")
+
+
+@click.command()
+@click.option("--calls", type=int, default=2000)
+@click.option("--concurrency", type=int, default=20)
+def bench(calls: int, concurrency: int):
+    asyncio.run(main(calls, concurrency))
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,74 @@
+"""Insert throughput of stock transactions keyed by random and by time ordered ids.
+
+Each run inserts the rows in batches into a fresh SQLite file, with the
+indexes of the stock_transactions table in place:
+
+    poetry run python benchmarks/bench_ids.py --rows 1000000 --batch 10000
+"""
+
+from datetime import datetime, timedelta
+from os import path
+from random import Random, randint
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+import click
+
+from santaka.db import create_engine, create_schema, stock_transactions
+from santaka.ids import IdGenerator
+
+
+def create_random_id(length: int = 15):
+    # the generator used before the time ordered ids
+    return randint(10 ** (length - 1), (10 ** (length) - 1))
+
+
+def run(name: str, create_id: Callable[[], int], rows: int, batch: int):
+    random = Random(0)
+    start_date = datetime(2021, 1, 1)
+    with TemporaryDirectory() as tmp_dir:
+        db_path = path.join(tmp_dir, "bench.db")
+        engine = create_engine(f"sqlite:///{db_path}")
+        create_schema(engine)
+        start = perf_counter()
+        last_batch = 0.0
+        for offset in range(0, rows, batch):
+            values = [
+                {
+                    "stock_transaction_id": create_id(),
+                    "stock_id": random.randint(1, 500),
+                    "owner_id": random.randint(1, 1000),
+                    "price": 10,
+                    "quantity": 1,
+                    "date": start_date + timedelta(minutes=offset + i),
+                    "transaction_type": "buy",
+                    "transaction_ex_rate": 1,
+                }
+                for i in range(min(batch, rows - offset))
+            ]
+            batch_start = perf_counter()
+            with engine.begin() as connection:
+                connection.execute(stock_transactions.insert(), values)
+            last_batch = perf_counter() - batch_start
+        elapsed = perf_counter() - start
+        engine.dispose()
+        size = path.getsize(db_path)
+    print(
+        f"{name:12} rows/s: {rows / elapsed:9.0f} "
+        f"last batch rows/s: {batch / last_batch:9.0f} "
+        f"file: {size / 1024 / 1024:6.1f}MB"
+    )
+
+
+@click.command()
+@click.option("--rows", type=int, default=1_000_000)
+@click.option("--batch", type=int, default=10_000)
+def bench(rows: int, batch: int):
+    print(f"rows: {rows}, batch: {batch}")
+    run("random", create_random_id, rows, batch)
+    run("time ordered", IdGenerator(0), rows, batch)
+
+
+if __name__ == "__main__":
+    bench()
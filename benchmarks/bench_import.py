@@ -0,0 +1,173 @@
+"""Loading a broker statement with the import endpoint and one call per transaction.
+
+The statement is a csv of buys and sells spread over the known stocks. The
+import parses it in chunks like a streamed request body, the per transaction
+path calls the PUT /stock/transaction/{owner_id}/ view for each row:
+
+    poetry run python benchmarks/bench_import.py --rows 100000 --single-rows 2000
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from os import environ
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+environ["ID_WORKER_ID"] = "0"
+
+from santaka.account.models import Bank  # noqa: E402
+from santaka.db import (  # noqa: E402
+    accounts,
+    create_schema,
+    currency,
+    database,
+    owners,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock.imports import import_stock_transactions  # noqa: E402
+from santaka.stock.models import NewStockTransaction, StatementFormat  # noqa: E402
+from santaka.stock.views import create_stock_transaction  # noqa: E402
+from santaka.user import User  # noqa: E402
+
+STOCK_COUNT = 200
+CHUNK_SIZE = 64 * 1024
+USER = User(username="user", user_id=1, base_currency="EUR")
+
+
+def seed():
+    create_schema()
+    now = datetime.utcnow()
+    database.engine.execute(
+        users.insert(),
+        [{"user_id": 1, "username": "user", "password": "", "base_currency": "EUR"}],
+    )
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": 1,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": "1",
+            }
+        ],
+    )
+    database.engine.execute(
+        owners.insert(),
+        [
+            {"owner_id": owner_id, "account_id": 1, "fullname": str(owner_id)}
+            for owner_id in (1, 2)
+        ],
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": i,
+                "market": "Milan",
+                "symbol": f"SYM{i}.MI",
+                "short_name": str(i),
+                "last_price": 10,
+                "last_update": now,
+                "currency_id": 1,
+            }
+            for i in range(1, STOCK_COUNT + 1)
+        ],
+    )
+
+
+def generate_statement(rows: int):
+    # buys twice as often as sells, a sell never exceeds what is held
+    random = Random(0)
+    held = {}
+    date = datetime(2000, 1, 1)
+    for i in range(rows):
+        date += timedelta(minutes=random.randint(1, 60))
+        symbol = f"SYM{random.randint(1, STOCK_COUNT)}.MI"
+        quantity = random.randint(1, 100)
+        transaction_type = "buy"
+        if held.get(symbol, 0) >= quantity and random.random() < 1 / 3:
+            transaction_type = "sell"
+            held[symbol] -= quantity
+        else:
+            held[symbol] = held.get(symbol, 0) + quantity
+        yield {
+            "symbol": symbol,
+            "price": f"{random.uniform(1, 100):.4f}",
+            "quantity": quantity,
+            "commission": "1.5",
+            "date": date.isoformat(),
+            "transaction_type": transaction_type,
+            "transaction_note": f"order {i}",
+        }
+
+
+async def iterate_chunks(body: bytes):
+    for start in range(0, len(body), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        yield body[start:end]
+
+
+async def run_import(rows: int) -> float:
+    fields = list(next(generate_statement(1)))
+    lines = [",".join(fields)]
+    for row in generate_statement(rows):
+        lines.append(",".join(str(row[field]) for field in fields))
+    body = "\n".join(lines).encode()
+    start = perf_counter()
+    result = await import_stock_transactions(
+        1, USER.base_currency, iterate_chunks(body), StatementFormat.CSV
+    )
+    assert result["imported"] == rows
+    return perf_counter() - start
+
+
+async def run_single(rows: int) -> float:
+    stock_ids = {
+        record.symbol: record.stock_id
+        for record in await database.fetch_all(stocks.select())
+    }
+    start = perf_counter()
+    for row in generate_statement(rows):
+        transaction = NewStockTransaction(stock_id=stock_ids[row["symbol"]], **row)
+        await create_stock_transaction(2, transaction, USER)
+    return perf_counter() - start
+
+
+async def main(rows: int, single_rows: int):
+    seed()
+    async with database:
+        elapsed = await run_import(rows)
+        print(
+            f"import:          {rows:7} rows {elapsed:8.2f}s "
+            f"{rows / elapsed:9.0f} rows/s"
+        )
+        elapsed = await run_single(single_rows)
+        print(
+            f"one call per row: {single_rows:6} rows {elapsed:8.2f}s "
+            f"{single_rows / elapsed:9.0f} rows/s"
+        )
+        count = await database.fetch_val(stock_transactions.count())
+        assert count == rows + single_rows
+
+
+@click.command()
+@click.option("--rows", type=int, default=100_000)
+@click.option("--single-rows", type=int, default=2000)
+def bench(rows: int, single_rows: int):
+    asyncio.run(main(rows, single_rows))
+
+
+if __name__ == "__main__":
+    bench()
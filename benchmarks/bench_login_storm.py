@@ -0,0 +1,111 @@
+"""Latency of a cheap endpoint during a login storm.
+
+Serves the app on a local port, then keeps polling /user/me/ while a burst of
+logins runs, once with bcrypt inline in the event loop (the implementation before
+the thread pool) and once with the password hasher thread pool:
+
+    poetry run python benchmarks/bench_login_storm.py --logins 50 --concurrency 10
+"""
+
+import asyncio
+from os import environ
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List
+
+import click
+from aiohttp import ClientSession
+from uvicorn import Config, Server
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+
+from santaka import user  # noqa: E402
+from santaka.app import app  # noqa: E402
+from santaka.password import PasswordHasher  # noqa: E402
+
+PORT = 8765
+URL = f"http://127.0.0.1:{PORT}"
+
+
+class InlineHasher(PasswordHasher):
+    async def _run(self, function, *args):
+        return function(*args)
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+async def storm(session: ClientSession, logins: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            async with session.post(
+                f"{URL}/user/token/", data={"username": "user", "password": "secret"}
+            ) as resp:
+                assert resp.status == 200
+
+    async with session.post(
+        f"{URL}/user/token/", data={"username": "user", "password": "secret"}
+    ) as resp:
+        headers = {"Authorization": f"Bearer {(await resp.json())['access_token']}"}
+    storm_task = asyncio.ensure_future(
+        asyncio.gather(*[login() for _ in range(logins)])
+    )
+    latencies = []
+    while not storm_task.done():
+        start = perf_counter()
+        async with session.get(f"{URL}/user/me/", headers=headers) as resp:
+            assert resp.status == 200
+        latencies.append(perf_counter() - start)
+        await asyncio.sleep(0.005)
+    await storm_task
+    return latencies
+
+
+async def main(logins: int, concurrency: int, workers: int):
+    server = Server(Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    serve_task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        await user.create_user("user", "secret", "EUR")
+        results = {}
+        async with ClientSession() as session:
+            for name, hasher in (
+                ("bcrypt in the event loop", InlineHasher(user.pwd_context, workers)),
+                (
+                    "bcrypt in the thread pool",
+                    PasswordHasher(user.pwd_context, workers),
+                ),
+            ):
+                user.password_hasher = hasher
+                start = perf_counter()
+                latencies = await storm(session, logins, concurrency)
+                results[name] = (latencies, perf_counter() - start)
+                hasher.shutdown()
+    finally:
+        server.should_exit = True
+        await serve_task
+    print(f"logins: {logins}, concurrency: {concurrency}, pool workers: {workers}")
+    for name, (latencies, elapsed) in results.items():
+        print(
+            f"{name:26} /user/me/ p50: {percentile(latencies, 50) * 1000:7.1f}ms "
+            f"p99: {percentile(latencies, 99) * 1000:7.1f}ms "
+            f"samples: {len(latencies):4} storm: {elapsed:5.2f}s"
+        )
+
+
+@click.command()
+@click.option("--logins", type=int, default=50)
+@click.option("--concurrency", type=int, default=10)
+@click.option("--workers", type=int, default=4)
+def bench(logins: int, concurrency: int, workers: int):
+    asyncio.run(main(logins, concurrency, workers))
+
+
+if __name__ == "__main__":
+    bench()
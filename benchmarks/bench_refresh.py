@@ -0,0 +1,116 @@
+"""Offline throughput of the background refresh pipeline.
+
+Quotes come from the seeded random walk provider, so runs are reproducible and
+need no network. Every tick marks all stocks as stale and runs update_stocks:
+
+    poetry run python benchmarks/bench_refresh.py --stocks 2000 --latency 0.05
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from os import environ
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+environ.setdefault("QUOTE_PROVIDER", "random_walk")
+
+from santaka.db import (  # noqa: E402
+    database,
+    create_schema,
+    currency,
+    stocks,
+    stock_transactions,
+)
+from santaka.stock import utils  # noqa: E402
+from santaka.stock.providers import SYMBOL_SUFFIX_MARKETS  # noqa: E402
+
+MARKETS = [(market, suffix) for suffix, (market, _) in SYMBOL_SUFFIX_MARKETS.items()]
+
+
+def seed(stock_count: int):
+    create_schema()
+    stale = datetime.utcnow() - timedelta(days=1)
+    currencies = [("EUR", None), ("USD", "EURUSD=X"), ("GBP", "EURGBP=X")]
+    database.engine.execute(
+        currency.insert(),
+        [
+            {
+                "currency_id": i,
+                "iso_currency": iso_currency,
+                "last_rate": 1,
+                "symbol": symbol,
+                "last_update": stale,
+            }
+            for i, (iso_currency, symbol) in enumerate(currencies)
+        ],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": i,
+                "market": MARKETS[i % len(MARKETS)][0],
+                "symbol": f"SYM{i}{MARKETS[i % len(MARKETS)][1]}",
+                "short_name": f"synthetic {i}",
+                "last_price": 100,
+                "last_update": stale,
+                "currency_id": i % len(currencies),
+            }
+            for i in range(stock_count)
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": i,
+                "stock_id": i,
+                "owner_id": 1,
+                "price": 100,
+                "quantity": 10,
+                "date": stale,
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+            for i in range(stock_count)
+        ],
+    )
+
+
+async def main(stock_count: int, ticks: int, latency: float):
+    seed(stock_count)
+    utils.quote_provider.latency = latency
+    utils.get_active_markets = lambda _: [market for market, _ in MARKETS]
+    await database.connect()
+    try:
+        elapsed = 0.0
+        for _ in range(ticks):
+            await database.execute(
+                stocks.update().values(
+                    last_update=datetime.utcnow() - timedelta(days=1)
+                )
+            )
+            start = perf_counter()
+            await utils.update_stocks()
+            elapsed += perf_counter() - start
+    finally:
+        await database.disconnect()
+    print(f"stocks: {stock_count}, ticks: {ticks}, provider latency: {latency}s")
+    print(f"refresh time per tick: {elapsed / ticks:8.3f}s")
+    print(f"refreshed stocks/s:    {stock_count * ticks / elapsed:8.1f}")
+
+
+@click.command()
+@click.option("--stocks", "stock_count", type=int, default=2000)
+@click.option("--ticks", type=int, default=5)
+@click.option("--latency", type=float, default=0.05)
+def bench(stock_count: int, ticks: int, latency: float):
+    asyncio.run(main(stock_count, ticks, latency))
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,47 @@
+"""Serialization time of the get_traded_stocks response.
+
+Compares the default path, validating the content against TradedStocks and
+encoding it with the stdlib json, with the orjson response returned when
+FAST_RESPONSES is set:
+
+    poetry run python benchmarks/bench_responses.py --stocks 2000
+"""
+
+import asyncio
+from time import perf_counter
+
+import click
+
+from santaka.responses import DecimalORJSONResponse
+from tests.helpers import build_traded_stocks, render_with_response_model
+
+
+async def main(stock_count: int, repeat: int):
+    content = build_traded_stocks(stock_count)
+    print(f"positions: {len(content['stocks'])}, best of {repeat}")
+    for name, render in (
+        ("response model", render_with_response_model),
+        ("orjson", lambda content: DecimalORJSONResponse(content).body),
+    ):
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            body = render(content)
+            if asyncio.iscoroutine(body):
+                body = await body
+            timings.append(perf_counter() - start)
+        print(
+            f"{name:>14}: {min(timings) * 1000:8.2f}ms "
+            f"body: {len(body) / 1024:7.1f}KB"
+        )
+
+
+@click.command()
+@click.option("--stocks", "stock_count", type=int, default=2000)
+@click.option("--repeat", type=int, default=10)
+def bench(stock_count: int, repeat: int):
+    asyncio.run(main(stock_count, repeat))
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,54 @@
+"""Queries per second through SQLiteDatabase, with and without connection reuse.
+
+Every task acquires a connection per query, like a request outside of a
+transaction; max idle 0 opens a connection, with its thread and pragmas, each
+time:
+
+    poetry run python benchmarks/bench_sqlite_pool.py --tasks 8 --queries 2000
+"""
+
+import asyncio
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+
+from santaka.db import StorageProfile, get_connect_args
+from santaka.sqlite import SQLiteDatabase
+
+TMP_DIR = TemporaryDirectory()
+
+
+async def run(
+    url: str, profile: StorageProfile, max_idle: int, tasks: int, queries: int
+):
+    database = SQLiteDatabase(url, max_idle, **get_connect_args(url, profile))
+
+    async def query():
+        for _ in range(queries // tasks):
+            await database.fetch_one("SELECT 1")
+
+    async with database:
+        start = perf_counter()
+        await asyncio.gather(*[query() for _ in range(tasks)])
+        elapsed = perf_counter() - start
+    print(
+        f"{profile.value:8} max idle: {max_idle:3} "
+        f"queries/s: {queries // tasks * tasks / elapsed:8.1f}"
+    )
+
+
+@click.command()
+@click.option("--tasks", type=int, default=8)
+@click.option("--queries", type=int, default=2000)
+@click.option("--max-idle", type=int, default=10)
+def bench(tasks: int, queries: int, max_idle: int):
+    url = f"sqlite:///{TMP_DIR.name}/bench.db"
+    print(f"tasks: {tasks}, queries: {queries}")
+    for profile in StorageProfile:
+        for size in (0, max_idle):
+            asyncio.run(run(url, profile, size, tasks, queries))
+
+
+if __name__ == "__main__":
+    bench()
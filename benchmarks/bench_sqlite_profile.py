@@ -0,0 +1,175 @@
+"""API reads while the updater writes, with the default and the tuned profile.
+
+Reader tasks fetch the transaction records of random owners while a writer
+thread, with its own connection like the task process, keeps updating every
+stock price inside a transaction:
+
+    poetry run python benchmarks/bench_sqlite_profile.py --readers 20 --seconds 5
+"""
+
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+from os import environ
+from random import Random
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from typing import List
+
+import click
+import sqlalchemy
+
+TMP_DIR = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR.name}/bench.db"
+
+from santaka.account.models import Bank  # noqa: E402
+from santaka.db import (  # noqa: E402
+    StorageProfile,
+    accounts,
+    create_database,
+    currency,
+    get_connect_args,
+    metadata,
+    owners,
+    stock_transactions,
+    stocks,
+)
+from santaka.stock.utils import build_transaction_records_query  # noqa: E402
+
+OWNER_COUNT = 100
+STOCK_COUNT = 500
+TRANSACTIONS_PER_OWNER = 200
+
+
+def seed(url: str):
+    random = Random(0)
+    now = datetime.utcnow()
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": i,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": str(i),
+            }
+            for i in range(1, OWNER_COUNT + 1)
+        ],
+    )
+    engine.execute(
+        owners.insert(),
+        [
+            {"owner_id": i, "account_id": i, "fullname": str(i)}
+            for i in range(1, OWNER_COUNT + 1)
+        ],
+    )
+    engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": i,
+                "market": "Milan",
+                "symbol": f"SYM{i}.MI",
+                "short_name": str(i),
+                "last_price": 10,
+                "last_update": now,
+                "currency_id": 1,
+            }
+            for i in range(1, STOCK_COUNT + 1)
+        ],
+    )
+    engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": owner_id * TRANSACTIONS_PER_OWNER + i,
+                "stock_id": random.randint(1, STOCK_COUNT),
+                "owner_id": owner_id,
+                "price": 5,
+                "quantity": 1,
+                "date": now - timedelta(days=random.randint(1, 3000)),
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+            for owner_id in range(1, OWNER_COUNT + 1)
+            for i in range(TRANSACTIONS_PER_OWNER)
+        ],
+    )
+    engine.dispose()
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+async def run(url: str, profile: StorageProfile, readers: int, seconds: float):
+    # the journal mode is stored in the file: reset it, the connections of the
+    # tuned profile switch it to WAL
+    engine = sqlalchemy.create_engine(url)
+    engine.execute("PRAGMA journal_mode = delete")
+    engine.dispose()
+    api_database = create_database(url, profile)
+    random = Random(1)
+    latencies = []
+    writes = 0
+    deadline = perf_counter() + seconds
+
+    async def read():
+        while perf_counter() < deadline:
+            query = build_transaction_records_query([random.randint(1, OWNER_COUNT)])
+            start = perf_counter()
+            await api_database.fetch_all(query)
+            latencies.append(perf_counter() - start)
+
+    def write():
+        nonlocal writes
+        connection = sqlite3.connect(
+            url.replace("sqlite:///", ""),
+            isolation_level=None,
+            **get_connect_args(url, profile),
+        )
+        while perf_counter() < deadline:
+            connection.execute("BEGIN IMMEDIATE")
+            for stock_id in range(1, STOCK_COUNT + 1):
+                connection.execute(
+                    "UPDATE stocks SET last_price = ? WHERE stock_id = ?",
+                    (random.uniform(1, 100), stock_id),
+                )
+            connection.execute("COMMIT")
+            writes += 1
+        connection.close()
+
+    writer = Thread(target=write)
+    writer.start()
+    async with api_database:
+        await asyncio.gather(*[read() for _ in range(readers)])
+    writer.join()
+    print(
+        f"{profile.value:8} reads/s: {len(latencies) / seconds:8.1f} "
+        f"p50: {percentile(latencies, 50) * 1000:7.1f}ms "
+        f"p99: {percentile(latencies, 99) * 1000:7.1f}ms "
+        f"writes/s: {writes / seconds:6.1f}"
+    )
+
+
+@click.command()
+@click.option("--readers", type=int, default=20)
+@click.option("--seconds", type=float, default=5)
+def bench(readers: int, seconds: float):
+    url = environ["DATABASE_URL"]
+    seed(url)
+    print(f"readers: {readers}, seconds: {seconds}")
+    for profile in (StorageProfile.DEFAULT, StorageProfile.TUNED):
+        asyncio.run(run(url, profile, readers, seconds))
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,267 @@
+"""Replays a mix of the dashboard endpoints against a running app.
+
+Seed a database with benchmarks/seed_data.py, then serve it with the random
+walk quote provider so that no request reaches yahoo:
+
+    DATABASE_URL=sqlite:///load.db poetry run python benchmarks/seed_data.py
+    QUOTE_PROVIDER=random_walk DATABASE_URL=sqlite:///load.db \\
+        poetry run uvicorn santaka.app:app
+    poetry run python benchmarks/load_test.py --concurrency 50 --duration 60
+
+Every virtual user logs in as a random seeded user, then keeps choosing an
+action from --mix until the end of the run. Like the dashboards, the reads send
+back the last ETag of each path unless --no-etags is given.
+"""
+
+import asyncio
+from datetime import datetime
+from random import Random
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+import click
+from aiohttp import ClientSession
+
+LOGIN = "POST /user/token/"
+ACCOUNTS = "GET /account/"
+TRADED = "GET /stock/traded/{owner_id}/"
+ALERTS = "GET /stock/alert/{owner_id}/"
+INSERT = "PUT /stock/transaction/{owner_id}/"
+ACTIONS = {
+    "login": LOGIN,
+    "account": ACCOUNTS,
+    "traded": TRADED,
+    "alerts": ALERTS,
+    "insert": INSERT,
+}
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        action, weight = item.split("=")
+        if action not in ACTIONS:
+            raise click.BadParameter(f"unknown action {action}")
+        weights[action] = int(weight)
+    return weights
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {
+            route: [] for route in ACTIONS.values()
+        }
+        self.errors: Dict[str, int] = dict.fromkeys(ACTIONS.values(), 0)
+
+
+class VirtualUser:
+    def __init__(
+        self,
+        session: ClientSession,
+        url: str,
+        username: str,
+        password: str,
+        stats: Stats,
+        random: Random,
+        etags: bool,
+    ):
+        self.session = session
+        self.url = url
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.random = random
+        self.etags: Optional[Dict[str, str]] = {} if etags else None
+        self.headers: Dict[str, str] = {}
+        self.owner_ids: List[int] = []
+        self.stock_ids: Dict[int, List[int]] = {}
+
+    async def request(self, route: str, method: str, path: str, **kwargs: Any) -> Any:
+        # the latency is recorded under the route template, 304 is a success
+        headers = dict(self.headers)
+        if method == "GET" and self.etags is not None and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        start = perf_counter()
+        async with self.session.request(
+            method, self.url + path, headers=headers, **kwargs
+        ) as response:
+            body = None
+            if response.status == 200:
+                body = await response.json()
+            else:
+                await response.read()
+        self.stats.latencies[route].append(perf_counter() - start)
+        if response.status >= 400:
+            self.stats.errors[route] += 1
+        elif self.etags is not None and "ETag" in response.headers:
+            self.etags[path] = response.headers["ETag"]
+        return body
+
+    async def login(self):
+        body = await self.request(
+            LOGIN,
+            "POST",
+            "/user/token/",
+            data={"username": self.username, "password": self.password},
+        )
+        if body is not None:
+            self.headers = {"Authorization": f"Bearer {body['access_token']}"}
+
+    async def get_accounts(self):
+        body = await self.request(ACCOUNTS, "GET", "/account/")
+        if body is not None:
+            self.owner_ids = [
+                owner["owner_id"]
+                for account in body["accounts"]
+                for owner in account["owners"]
+            ]
+
+    async def get_traded_stocks(self, owner_id: int):
+        body = await self.request(TRADED, "GET", f"/stock/traded/{owner_id}/")
+        if body is not None:
+            self.stock_ids[owner_id] = [stock["stock_id"] for stock in body["stocks"]]
+
+    async def get_alerts(self, owner_id: int):
+        await self.request(ALERTS, "GET", f"/stock/alert/{owner_id}/")
+
+    async def insert_transaction(self, owner_id: int):
+        # a buy of a stock the owner already holds is always valid
+        stock_ids = self.stock_ids.get(owner_id)
+        if not stock_ids:
+            await self.get_traded_stocks(owner_id)
+            stock_ids = self.stock_ids.get(owner_id)
+            if not stock_ids:
+                return
+        await self.request(
+            INSERT,
+            "PUT",
+            f"/stock/transaction/{owner_id}/",
+            json={
+                "stock_id": self.random.choice(stock_ids),
+                "price": round(self.random.uniform(5, 500), 4),
+                "quantity": self.random.randint(1, 100),
+                "commission": 1.5,
+                "date": datetime.utcnow().isoformat(),
+                "transaction_type": "buy",
+            },
+        )
+
+    async def run(self, deadline: float, weights: Dict[str, int]):
+        await self.login()
+        await self.get_accounts()
+        actions = list(weights)
+        action_weights = [weights[action] for action in actions]
+        while perf_counter() < deadline:
+            action = self.random.choices(actions, action_weights)[0]
+            if action == "login":
+                await self.login()
+            elif action == "account" or not self.owner_ids:
+                await self.get_accounts()
+            else:
+                owner_id = self.random.choice(self.owner_ids)
+                if action == "traded":
+                    await self.get_traded_stocks(owner_id)
+                elif action == "alerts":
+                    await self.get_alerts(owner_id)
+                else:
+                    await self.insert_transaction(owner_id)
+
+
+def report(stats: Stats, elapsed: float):
+    print(
+        f"{'route':36} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    total = 0
+    for route, latencies in stats.latencies.items():
+        if not latencies:
+            continue
+        total += len(latencies)
+        print(
+            f"{route:36} {len(latencies):9} {stats.errors[route]:7} "
+            f"{len(latencies) / elapsed:8.1f} "
+            f"{percentile(latencies, 50) * 1000:8.1f} "
+            f"{percentile(latencies, 95) * 1000:8.1f} "
+            f"{percentile(latencies, 99) * 1000:8.1f}"
+        )
+    print(
+        f"{'total':36} {total:9} {sum(stats.errors.values()):7} {total / elapsed:8.1f}"
+    )
+
+
+async def main(
+    url: str,
+    user_count: int,
+    password: str,
+    concurrency: int,
+    duration: float,
+    weights: Dict[str, int],
+    etags: bool,
+    seed: int,
+):
+    random = Random(seed)
+    stats = Stats()
+    usernames = [
+        f"user{n}" for n in random.sample(range(1, user_count + 1), concurrency)
+    ]
+    async with ClientSession() as session:
+        virtual_users = [
+            VirtualUser(
+                session, url, username, password, stats, Random(random.random()), etags
+            )
+            for username in usernames
+        ]
+        start = perf_counter()
+        deadline = start + duration
+        await asyncio.gather(
+            *[virtual_user.run(deadline, weights) for virtual_user in virtual_users]
+        )
+        elapsed = perf_counter() - start
+    print(f"virtual users: {concurrency}, duration: {elapsed:.1f}s")
+    report(stats, elapsed)
+
+
+@click.command()
+@click.option("--url", default="http://127.0.0.1:8000")
+@click.option("--users", "user_count", type=int, default=10_000, help="seeded users")
+@click.option("--password", default="password")
+@click.option("--concurrency", type=int, default=50)
+@click.option("--duration", type=float, default=60)
+@click.option(
+    "--mix",
+    default="login=1,account=20,traded=40,alerts=20,insert=5",
+    help="relative weights of the actions",
+)
+@click.option("--etags/--no-etags", default=True)
+@click.option("--seed", type=int, default=0)
+def load_test(
+    url: str,
+    user_count: int,
+    password: str,
+    concurrency: int,
+    duration: float,
+    mix: str,
+    etags: bool,
+    seed: int,
+):
+    asyncio.run(
+        main(
+            url.rstrip("/"),
+            user_count,
+            password,
+            min(concurrency, user_count),
+            duration,
+            parse_mix(mix),
+            etags,
+            seed,
+        )
+    )
+
+
+if __name__ == "__main__":
+    load_test()
@@ -0,0 +1,281 @@
+"""Fills a database with synthetic users, portfolios and alerts for load tests.
+
+Every user has the same password and the username user{n}, starting from 1, so
+that benchmarks/load_test.py can log in as any of them. Ids are sequential and
+the run is reproducible for a given --seed. The database must be empty:
+
+    DATABASE_URL=sqlite:///load.db poetry run python benchmarks/seed_data.py \\
+        --users 10000 --accounts 2 --owners 5 --stocks 2000 --transactions 20
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional
+
+import click
+from sqlalchemy.sql import func, select
+
+from santaka.account.models import Bank
+from santaka.db import (
+    accounts,
+    create_schema,
+    currency,
+    database,
+    owners,
+    stock_alerts,
+    stock_positions,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock.providers import SYMBOL_SUFFIX_MARKETS, YahooMarket
+from santaka.stock.utils import rebuild_positions
+from santaka.user import pwd_context
+
+INSERT_BATCH_SIZE = 10_000
+# iso currency, yahoo symbol of the rate, the base currency has none
+CURRENCIES = [
+    ("EUR", None),
+    ("USD", "EURUSD=X"),
+    ("GBP", "EURGBP=X"),
+    ("CAD", "EURCAD=X"),
+]
+MARKETS = [
+    (market, suffix, iso) for suffix, (market, iso) in SYMBOL_SUFFIX_MARKETS.items()
+]
+MARKETS.append((YahooMarket.USA_NASDAQ.value, "", "USD"))
+FIRST_TRANSACTION_DATE = datetime(2015, 1, 1)
+
+
+def insert_in_batches(table: Any, rows: Iterator[Dict[str, Any]]) -> int:
+    # each batch is one executemany in its own transaction
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            database.engine.execute(table.insert(), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        database.engine.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def generate_stocks(random: Random, stock_count: int, now: datetime):
+    currency_ids = {iso: i for i, (iso, _) in enumerate(CURRENCIES, 1)}
+    for stock_id in range(1, stock_count + 1):
+        market, suffix, iso_currency = random.choice(MARKETS)
+        yield {
+            "stock_id": stock_id,
+            "market": market,
+            "symbol": f"SYN{stock_id}{suffix}",
+            "financial_currency": iso_currency,
+            "short_name": f"synthetic {stock_id}",
+            "last_price": round(random.uniform(5, 500), 4),
+            "last_update": now - timedelta(seconds=random.randint(0, 3600)),
+            "currency_id": currency_ids.get(iso_currency, 1),
+        }
+
+
+def generate_transactions(
+    random: Random,
+    owner_count: int,
+    stock_count: int,
+    transaction_count: int,
+    stocks_per_owner: int,
+    now: datetime,
+    held: Dict[int, List[int]],
+):
+    # buys and sells spread over a few stocks per owner, a sell never exceeds
+    # the held quantity; held collects the stocks of every owner
+    stock_transaction_id = 0
+    days = (now - FIRST_TRANSACTION_DATE).days
+    for owner_id in range(1, owner_count + 1):
+        owner_stocks = random.sample(
+            range(1, stock_count + 1), min(stocks_per_owner, stock_count)
+        )
+        held[owner_id] = owner_stocks
+        quantities = dict.fromkeys(owner_stocks, 0)
+        dates = sorted(random.randint(0, days) for _ in range(transaction_count))
+        for day in dates:
+            stock_id = random.choice(owner_stocks)
+            quantity = random.randint(1, 100)
+            transaction_type = "buy"
+            if quantities[stock_id] >= quantity and random.random() < 0.3:
+                transaction_type = "sell"
+                quantities[stock_id] -= quantity
+            else:
+                quantities[stock_id] += quantity
+            stock_transaction_id += 1
+            yield {
+                "stock_transaction_id": stock_transaction_id,
+                "stock_id": stock_id,
+                "owner_id": owner_id,
+                "price": round(random.uniform(5, 500), 4),
+                "quantity": quantity,
+                "tax": 0,
+                "commission": round(random.uniform(0, 20), 2),
+                "date": FIRST_TRANSACTION_DATE
+                + timedelta(days=day, seconds=random.randint(0, 86399)),
+                "transaction_type": transaction_type,
+                "transaction_note": None,
+                "transaction_ex_rate": round(random.uniform(0.8, 1.3), 5),
+            }
+
+
+def generate_alerts(random: Random, held: Dict[int, List[int]], alert_count: int):
+    stock_alert_id = 0
+    for owner_id, owner_stocks in held.items():
+        for stock_id in owner_stocks[:alert_count]:
+            stock_alert_id += 1
+            yield {
+                "stock_alert_id": stock_alert_id,
+                "stock_id": stock_id,
+                "owner_id": owner_id,
+                "lower_limit_price": round(random.uniform(5, 250), 2),
+                "upper_limit_price": round(random.uniform(250, 500), 2),
+            }
+
+
+async def run_rebuild_positions():
+    async with database:
+        await rebuild_positions()
+
+
+def report(name: str, count: int, start: float):
+    elapsed = perf_counter() - start
+    print(f"{name:>13}: {count:9} rows {elapsed:8.2f}s")
+
+
+@click.command()
+@click.option("--database-url", default=None, help="defaults to DATABASE_URL")
+@click.option("--users", "user_count", type=int, default=10_000)
+@click.option("--accounts", "accounts_per_user", type=int, default=2)
+@click.option("--owners", "owners_per_account", type=int, default=5)
+@click.option("--stocks", "stock_count", type=int, default=2000)
+@click.option("--stocks-per-owner", type=int, default=5)
+@click.option("--transactions", "transactions_per_owner", type=int, default=20)
+@click.option("--alerts", "alerts_per_owner", type=int, default=2)
+@click.option("--password", default="password")
+@click.option("--seed", type=int, default=0)
+def seed(
+    database_url: Optional[str],
+    user_count: int,
+    accounts_per_user: int,
+    owners_per_account: int,
+    stock_count: int,
+    stocks_per_owner: int,
+    transactions_per_owner: int,
+    alerts_per_owner: int,
+    password: str,
+    seed: int,
+):
+    if database_url is not None:
+        database.configure(database_url)
+    create_schema()
+    random = Random(seed)
+    now = datetime.utcnow()
+    # bcrypt is slow on purpose, all the users share the same hash
+    hashed_password = pwd_context.hash(password)
+    account_count = user_count * accounts_per_user
+    owner_count = account_count * owners_per_account
+    banks = [bank.value for bank in Bank]
+
+    start = perf_counter()
+    count = insert_in_batches(
+        users,
+        (
+            {
+                "user_id": user_id,
+                "username": f"user{user_id}",
+                "password": hashed_password,
+                "base_currency": "EUR",
+            }
+            for user_id in range(1, user_count + 1)
+        ),
+    )
+    report("users", count, start)
+    start = perf_counter()
+    count = insert_in_batches(
+        accounts,
+        (
+            {
+                "account_id": account_id,
+                "user_id": (account_id - 1) // accounts_per_user + 1,
+                "bank": random.choice(banks),
+                "account_number": f"{account_id:012}",
+            }
+            for account_id in range(1, account_count + 1)
+        ),
+    )
+    report("accounts", count, start)
+    start = perf_counter()
+    count = insert_in_batches(
+        owners,
+        (
+            {
+                "owner_id": owner_id,
+                "account_id": (owner_id - 1) // owners_per_account + 1,
+                "fullname": f"owner {owner_id}",
+                "revision": 0,
+            }
+            for owner_id in range(1, owner_count + 1)
+        ),
+    )
+    report("owners", count, start)
+    start = perf_counter()
+    count = insert_in_batches(
+        currency,
+        (
+            {
+                "currency_id": currency_id,
+                "iso_currency": iso_currency,
+                "symbol": symbol,
+                "last_rate": (
+                    1 if symbol is None else round(random.uniform(0.7, 1.5), 5)
+                ),
+                "last_update": now,
+            }
+            for currency_id, (iso_currency, symbol) in enumerate(CURRENCIES, 1)
+        ),
+    )
+    report("currencies", count, start)
+    start = perf_counter()
+    count = insert_in_batches(stocks, generate_stocks(random, stock_count, now))
+    report("stocks", count, start)
+    start = perf_counter()
+    held = {}
+    count = insert_in_batches(
+        stock_transactions,
+        generate_transactions(
+            random,
+            owner_count,
+            stock_count,
+            transactions_per_owner,
+            stocks_per_owner,
+            now,
+            held,
+        ),
+    )
+    report("transactions", count, start)
+    start = perf_counter()
+    count = insert_in_batches(
+        stock_alerts, generate_alerts(random, held, alerts_per_owner)
+    )
+    report("alerts", count, start)
+    # the positions are built and the alerts evaluated like the rebuild_positions
+    # command does
+    start = perf_counter()
+    asyncio.run(run_rebuild_positions())
+    count = database.engine.execute(
+        select([func.count()]).select_from(stock_positions)
+    ).scalar()
+    report("positions", count, start)
+
+
+if __name__ == "__main__":
+    seed()
@@ -1,18 +1,22 @@
-from typing import Tuple
+from decimal import Decimal
+from typing import Dict, List, Tuple
 
 from fastapi import HTTPException, status
 from sqlalchemy.sql import select
+from sqlalchemy.sql.expression import Select
 
 from santaka.db import (
     database,
     accounts,
     owners,
+    users,
 )
 from santaka.analytics import calculate_stock_totals
 from santaka.stock.utils import (
-    check_stock_alerts,
-    get_transaction_records,
-    prepare_traded_stocks,
+    build_stock_alerts_query,
+    get_position_records,
+    prepare_traded_stocks_from_positions,
+    summarize_stock_alert,
 )
 
 
@@ -44,16 +48,47 @@ async def get_owner(user_id: int, owner_id: int) -> Tuple[int, str, str, int, st
     return record
 
 
-async def calculate_stock_total_ctv(owner_id: int):
-    records = await get_transaction_records([owner_id])
-    traded_stocks = prepare_traded_stocks(records)
-    _, _, current_stock_ctv = calculate_stock_totals(traded_stocks)
-    return current_stock_ctv
+def build_accounts_query(user_id: int) -> Select:
+    # accounts of the user with their owners, one row per owner: the rows of an
+    # account are consecutive
+    return (
+        select(
+            [
+                accounts.c.bank,
+                accounts.c.account_id,
+                accounts.c.account_number,
+                owners.c.fullname,
+                owners.c.owner_id,
+            ]
+        )
+        .select_from(
+            users.join(accounts, users.c.user_id == accounts.c.user_id).outerjoin(
+                owners, accounts.c.account_id == owners.c.account_id
+            ),
+        )
+        .where(users.c.user_id == user_id)
+        .order_by(accounts.c.account_id, owners.c.owner_id)
+    )
 
 
-async def check_for_triggered_alerts(owner_id: int) -> bool:
-    alerts = await check_stock_alerts(owner_id=owner_id)
-    for a in alerts:
-        if len(a["triggered_fields"]) > 0:
-            return True
-    return False
+async def summarize_owners(owner_ids: List[int]) -> Dict[int, Tuple[Decimal, bool]]:
+    # stock ctv and triggered alerts flag of every owner, with one positions query
+    # and one alerts query whatever the number of owners
+    summaries = {owner_id: (0, False) for owner_id in owner_ids}
+    if not owner_ids:
+        return summaries
+    records = await get_position_records(owner_ids)
+    traded_stocks = prepare_traded_stocks_from_positions(records)
+    alert_records = await database.fetch_all(build_stock_alerts_query(owner_ids))
+    owner_stocks = {owner_id: [] for owner_id in owner_ids}
+    for stock in traded_stocks:
+        owner_stocks[stock["owner_id"]].append(stock)
+    triggered_owner_ids = set()
+    for alert_record in alert_records:
+        alert = summarize_stock_alert(alert_record)
+        if len(alert["triggered_fields"]) > 0:
+            triggered_owner_ids.add(alert["owner_id"])
+    for owner_id, stocks_ in owner_stocks.items():
+        _, _, current_stock_ctv = calculate_stock_totals(stocks_)
+        summaries[owner_id] = (current_stock_ctv, owner_id in triggered_owner_ids)
+    return summaries
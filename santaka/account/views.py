@@ -1,19 +1,15 @@
-from fastapi import Depends, APIRouter, HTTPException, status
-from sqlalchemy.sql import select
+from fastapi import Depends, APIRouter, HTTPException, Request, Response, status
 
 from santaka.db import (
     database,
     accounts,
     owners,
-    users,
 )
+from santaka.responses import fast_response, get_not_modified_response, make_etag
 from santaka.user import User, get_current_user
-from santaka.db import create_random_id
-from santaka.account.utils import (
-    calculate_stock_total_ctv,
-    get_owner,
-    check_for_triggered_alerts,
-)
+from santaka.db import create_id
+from santaka.account.utils import build_accounts_query, get_owner, summarize_owners
+from santaka.stock.utils import get_owners_version
 from santaka.account.models import (
     Account,
     Accounts,
@@ -41,12 +37,13 @@ async def create_owner(new_owner: NewOwner, user: User = Depends(get_current_use
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Account {new_owner.account_id} doesn't exist",
         )
+    owner_id = create_id()
     query = owners.insert().values(
-        owner_id=create_random_id(),
+        owner_id=owner_id,
         account_id=new_owner.account_id,
         fullname=new_owner.name,
     )
-    owner_id = await database.execute(query)
+    await database.execute(query)
 
     return {"name": new_owner.name, "owner_id": owner_id}
 
@@ -56,13 +53,14 @@ async def create_owner(new_owner: NewOwner, user: User = Depends(get_current_use
 async def create_account(
     new_account: NewAccount, user: User = Depends(get_current_user)
 ):
+    account_id = create_id()
     query = accounts.insert().values(
-        account_id=create_random_id(),
+        account_id=account_id,
         account_number=new_account.account_number,
         bank=new_account.bank,
         user_id=user.user_id,
     )
-    account_id = await database.execute(query)
+    await database.execute(query)
 
     account = new_account.dict()
     account["account_id"] = account_id
@@ -73,25 +71,21 @@ async def create_account(
 
 
 @router.get("/", response_model=Accounts)
-async def get_accounts(user: User = Depends(get_current_user)):
-    query = (
-        select(
-            [
-                accounts.c.bank,
-                accounts.c.account_id,
-                accounts.c.account_number,
-                owners.c.fullname,
-                owners.c.owner_id,
-            ]
-        )
-        .select_from(
-            users.join(accounts, users.c.user_id == accounts.c.user_id).outerjoin(
-                owners, accounts.c.account_id == owners.c.account_id
-            ),
-        )
-        .where(users.c.user_id == user.user_id)
-    )
-    records = await database.fetch_all(query)
+async def get_accounts(
+    request: Request, response: Response, user: User = Depends(get_current_user)
+):
+    records = await database.fetch_all(build_accounts_query(user.user_id))
+    owner_ids = [record[4] for record in records if record[4] is not None]
+    # the accounts and owners of the user plus the version of the owners
+    version = None
+    if owner_ids:
+        version = await get_owners_version(owner_ids)
+    etag = make_etag([tuple(record.values()) for record in records], version)
+    not_modified = get_not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = etag
+    summaries = await summarize_owners(owner_ids)
     account_models = []
     previous_account_id = None
     for record in records:
@@ -100,16 +94,14 @@ async def get_accounts(user: User = Depends(get_current_user)):
             owners_ = []
             current_stock_ctv = 0
             if record[4] is not None:
+                current_stock_ctv, has_triggered_alerts = summaries[record[4]]
                 owners_ = [
                     {
                         "name": record[3],
                         "owner_id": record[4],
-                        "has_triggered_alerts": await check_for_triggered_alerts(
-                            record[4]
-                        ),
+                        "has_triggered_alerts": has_triggered_alerts,
                     }
                 ]
-                current_stock_ctv = await calculate_stock_total_ctv(record[4])
             account_models.append(
                 {
                     "bank": record[0],
@@ -121,19 +113,18 @@ async def get_accounts(user: User = Depends(get_current_user)):
                 }
             )
         else:
+            current_stock_ctv, has_triggered_alerts = summaries[record[4]]
             account_models[-1]["owners"].append(
                 {
                     "name": record[3],
                     "owner_id": record[4],
-                    "has_triggered_alerts": await check_for_triggered_alerts(record[4]),
+                    "has_triggered_alerts": has_triggered_alerts,
                 }
             )
-            account_models[-1]["current_stock_ctv"] += await calculate_stock_total_ctv(
-                record[4]
-            )
+            account_models[-1]["current_stock_ctv"] += current_stock_ctv
         previous_account_id = record[1]
 
-    return {"accounts": account_models}
+    return fast_response({"accounts": account_models}, response)
 
 
 @router.get("/owner/{owner_id}", response_model=OwnerDetails)
@@ -51,6 +51,31 @@ def calculate_stock_totals(
     return invested_converted, profit_and_loss_converted, current_ctv_converted
 
 
+def calculate_position_change(
+    quantity: int,
+    invested: Decimal,
+    invested_converted: Decimal,
+    transaction_type: str,
+    transaction_quantity: int,
+    price: Decimal,
+    commission: Decimal,
+    transaction_ex_rate: Decimal,
+) -> Tuple[int, Decimal, Decimal]:
+    if transaction_type == TransactionType.buy:
+        quantity = quantity + transaction_quantity
+        invested = invested + (price * transaction_quantity + commission)
+        invested_converted = (
+            invested_converted
+            + (price * transaction_quantity + commission) / transaction_ex_rate
+        )
+    elif transaction_type == TransactionType.sell:
+        new_quantity = quantity - transaction_quantity
+        invested = (invested / quantity) * new_quantity
+        invested_converted = (invested_converted / quantity) * new_quantity
+        quantity = new_quantity
+    return quantity, invested, invested_converted
+
+
 def calculate_fiscal_price(
     transactions: List[Transaction], split_events: Optional[List[SplitEvent]] = None
 ) -> Tuple[Decimal, Decimal]:
@@ -66,21 +91,16 @@ def calculate_fiscal_price(
         ):
             quantity = split_events[split_index].factor * quantity
             split_index += 1
-        if transaction.transaction_type == TransactionType.buy:
-            quantity = quantity + transaction.quantity
-            invested = invested + (
-                transaction.price * transaction.quantity + transaction.commission
-            )
-            invested_converted = (
-                invested_converted
-                + (transaction.price * transaction.quantity + transaction.commission)
-                / transaction.transaction_ex_rate
-            )
-        elif transaction.transaction_type == TransactionType.sell:
-            new_quantity = quantity - transaction.quantity
-            invested = (invested / quantity) * new_quantity
-            invested_converted = (invested_converted / quantity) * new_quantity
-            quantity = new_quantity
+        quantity, invested, invested_converted = calculate_position_change(
+            quantity,
+            invested,
+            invested_converted,
+            transaction.transaction_type,
+            transaction.quantity,
+            transaction.price,
+            transaction.commission,
+            transaction.transaction_ex_rate,
+        )
     while split_events and split_index < len(split_events):
         quantity = split_events[split_index].factor * quantity
         split_index += 1
@@ -1,11 +1,24 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from uvicorn import run
 
-from santaka.db import database
-from santaka.user import router as user_router
+from santaka.db import (
+    acquire_worker_id,
+    create_schema,
+    database,
+    release_worker_id,
+    renew_worker_id,
+)
+from santaka.http_client import http_client
+from santaka.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from santaka.slow_queries import slow_query_log
+from santaka.user import password_hasher, router as user_router
 from santaka.account.views import router as account_router
 from santaka.stock.views import router as stock_router
+from santaka.stock.utils import initialize_alerts, initialize_positions
 
 app = FastAPI()
 
@@ -16,20 +29,38 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, routes=app.routes)
 
 app.include_router(user_router)
 app.include_router(account_router)
 app.include_router(stock_router)
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    # metrics of this process only, the task runner serves its own
+    return PlainTextResponse(await registry.collect(), media_type=CONTENT_TYPE)
+
+
 @app.on_event("startup")
 async def startup():
+    create_schema()
+    acquire_worker_id()
+    app.state.worker_id_renewal = asyncio.create_task(renew_worker_id())
     await database.connect()
+    await initialize_positions()
+    await initialize_alerts()
+    await http_client.connect()
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    password_hasher.shutdown()
+    slow_query_log.log_summary()
+    await http_client.disconnect()
     await database.disconnect()
+    app.state.worker_id_renewal.cancel()
+    release_worker_id()
 
 
 if __name__ == "__main__":
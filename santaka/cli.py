@@ -1,8 +1,28 @@
 import asyncio
+from typing import Any, Awaitable, Callable
 
 import click
 
 from santaka import user
+from santaka.db import acquire_worker_id, create_schema, database, release_worker_id
+from santaka.stock.utils import rebuild_positions as rebuild_stock_positions
+
+
+async def run_connected(func: Callable[..., Awaitable], *args: Any):
+    # an open aiosqlite connection keeps the command from exiting
+    await database.connect()
+    try:
+        await func(*args)
+    finally:
+        await database.disconnect()
+
+
+def run_creating_ids(func: Callable[..., Awaitable], *args: Any):
+    acquire_worker_id()
+    try:
+        asyncio.run(run_connected(func, *args))
+    finally:
+        release_worker_id()
 
 
 @click.command()
@@ -10,4 +30,20 @@ from santaka import user
 @click.option("-p", "--password", "password", type=str, required=True)
 @click.option("-c", "--base-currency", "base_currency", type=str, default="EUR")
 def create_user(username: str, password: str, base_currency: str):
-    asyncio.run(user.create_user(username, password, base_currency))
+    create_schema()
+    run_creating_ids(user.create_user, username, password, base_currency)
+
+
+@click.command()
+@click.option("-u", "--username", "username", type=str, required=True)
+@click.option("-p", "--password", "password", type=str, default=None)
+@click.option("-c", "--base-currency", "base_currency", type=str, default=None)
+def update_user(username: str, password: str, base_currency: str):
+    create_schema()
+    run_creating_ids(user.update_user, username, password, base_currency)
+
+
+@click.command()
+def rebuild_positions():
+    create_schema()
+    asyncio.run(run_connected(rebuild_stock_positions))
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+FetchMany = Callable[[List[str]], Awaitable[Dict[str, Any]]]
+
+
+class Coalescer:
+    # concurrent lookups for a key share the same future (single flight) and keys
+    # requested within window seconds are fetched together with one fetch_many call
+    def __init__(self, fetch_many: FetchMany, window: float):
+        self.fetch_many = fetch_many
+        self.window = window
+        self.fetches = 0
+        self.coalesced = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in dict.fromkeys(keys):
+            future = self._in_flight.get(key) or self._pending.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._pending[key] = future
+            else:
+                self.coalesced += 1
+            futures[key] = future
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        results = {}
+        for key, future in futures.items():
+            # a cancelled caller must not cancel the lookup shared with the others
+            result = await asyncio.shield(future)
+            if result is not None:
+                results[key] = result
+        return results
+
+    def _flush(self):
+        self._flush_handle = None
+        batch = self._pending
+        self._pending = {}
+        self._in_flight.update(batch)
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: Dict[str, asyncio.Future]):
+        self.fetches += 1
+        try:
+            results = await self.fetch_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key, future in batch.items():
+                if not future.done():
+                    future.cancel()
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
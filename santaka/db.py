@@ -1,11 +1,67 @@
-from random import randint
+import asyncio
+from contextvars import ContextVar
+from enum import Enum
+from functools import wraps
+from logging import getLogger
 from os import environ
+from random import shuffle
+from time import perf_counter
+from typing import Any, AsyncGenerator, Callable, Dict, Optional, Tuple
+from uuid import uuid4
 
 import sqlalchemy
 from databases import Database
+from databases.core import Transaction
+
+from santaka.ids import ID_MAX_WORKER, IdGenerator
+from santaka.metrics import DB_QUERY_LATENCY
+from santaka.postgres import PostgresDatabase
+from santaka.slow_queries import slow_query_log
+from santaka.sqlite import Pragmas, SQLiteDatabase, create_connection_factory
+
+logger = getLogger(__name__)
+
+
+class StorageProfile(str, Enum):
+    # default keeps the sqlite defaults (rollback journal, full sync)
+    DEFAULT = "default"
+    TUNED = "tuned"
+
 
 DATABASE_URL = environ.get("DATABASE_URL", "sqlite:///./santaka.db")
-TEST_DATABASE_URL = "sqlite:///:memory:"
+STORAGE_PROFILE = StorageProfile(environ.get("STORAGE_PROFILE", "tuned"))
+DATABASE_POOL_MIN_SIZE = int(environ.get("DATABASE_POOL_MIN_SIZE", 1))
+DATABASE_POOL_MAX_SIZE = int(environ.get("DATABASE_POOL_MAX_SIZE", 10))
+# processes inserting at the same time need different worker ids: without
+# ID_WORKER_ID every process leases one in id_workers, a fixed ID_WORKER_ID must
+# be unique among the processes writing to the database
+ID_WORKER_ID = int(environ["ID_WORKER_ID"]) if "ID_WORKER_ID" in environ else None
+ID_WORKER_LEASE = float(environ.get("ID_WORKER_LEASE", 60))
+# WAL lets the api read while the task process writes, synchronous normal is
+# durable in WAL mode except for the last commits on power loss
+TUNED_PRAGMAS = {
+    "journal_mode": environ.get("SQLITE_JOURNAL_MODE", "wal"),
+    "synchronous": environ.get("SQLITE_SYNCHRONOUS", "normal"),
+    "cache_size": int(environ.get("SQLITE_CACHE_SIZE", -64000)),
+    "mmap_size": int(environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout": int(environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+}
+
+
+class NaiveDateTime(sqlalchemy.types.TypeDecorator):
+    # sqlite stores datetimes without the timezone while asyncpg refuses aware
+    # datetimes for timestamp columns: the timezone is dropped on both
+    impl = sqlalchemy.DateTime
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Any:
+        if value is not None and value.tzinfo is not None:
+            return value.replace(tzinfo=None)
+        return value
+
+
+# the 64 bit ids are stored as INTEGER on sqlite: only an INTEGER primary key
+# is the rowid, a BIGINT one gets a separate unique index
+Id = sqlalchemy.BigInteger().with_variant(sqlalchemy.Integer, "sqlite")
 
 metadata = sqlalchemy.MetaData()
 
@@ -13,53 +69,61 @@ metadata = sqlalchemy.MetaData()
 users = sqlalchemy.Table(
     "users",
     metadata,
-    sqlalchemy.Column("user_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("user_id", Id, primary_key=True),
     sqlalchemy.Column("username", sqlalchemy.String, unique=True, nullable=False),
     sqlalchemy.Column("password", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("base_currency", sqlalchemy.String, nullable=False),
+    # an id created by the last update, polled by the processes caching users
+    sqlalchemy.Column("revision", sqlalchemy.BigInteger, nullable=True),
+    sqlalchemy.Index("ix_users_revision", "revision"),
 )
 
 accounts = sqlalchemy.Table(
     "accounts",
     metadata,
-    sqlalchemy.Column("account_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("account_id", Id, primary_key=True),
     sqlalchemy.Column(
         "user_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("users.user_id"),
         nullable=False,
     ),
     sqlalchemy.Column("bank", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("account_number", sqlalchemy.String, nullable=False),
+    sqlalchemy.Index("ix_accounts_user_id", "user_id"),
 )
 
 owners = sqlalchemy.Table(
     "owners",
     metadata,
-    sqlalchemy.Column("owner_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("owner_id", Id, primary_key=True),
     sqlalchemy.Column(
         "account_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("accounts.account_id"),
         nullable=False,
     ),
     sqlalchemy.Column("fullname", sqlalchemy.String, nullable=False),
+    # bumped by every write to the transactions, positions and alerts of the
+    # owner, it's part of the etag of the owner reads
+    sqlalchemy.Column("revision", sqlalchemy.BigInteger, nullable=True, default=0),
+    sqlalchemy.Index("ix_owners_account_id", "account_id"),
 )
 
 currency = sqlalchemy.Table(
     "currency",
     metadata,
-    sqlalchemy.Column("currency_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("currency_id", Id, primary_key=True),
     sqlalchemy.Column("iso_currency", sqlalchemy.String, nullable=False, unique=True),
     sqlalchemy.Column("last_rate", sqlalchemy.DECIMAL, nullable=False),
     sqlalchemy.Column("symbol", sqlalchemy.String, nullable=True, unique=True),
-    sqlalchemy.Column("last_update", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("last_update", NaiveDateTime, nullable=False),
 )
 
 stocks = sqlalchemy.Table(
     "stocks",
     metadata,
-    sqlalchemy.Column("stock_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("stock_id", Id, primary_key=True),
     sqlalchemy.Column("market", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("symbol", sqlalchemy.String, nullable=False, unique=True),
     sqlalchemy.Column(
@@ -73,28 +137,29 @@ stocks = sqlalchemy.Table(
         nullable=False,
     ),
     sqlalchemy.Column("last_price", sqlalchemy.DECIMAL, nullable=False),
-    sqlalchemy.Column("last_update", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("last_update", NaiveDateTime, nullable=False),
     sqlalchemy.Column(
         "currency_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("currency.currency_id"),
         nullable=False,
     ),
+    sqlalchemy.Index("ix_stocks_market_last_update", "market", "last_update"),
 )
 
 stock_transactions = sqlalchemy.Table(
     "stock_transactions",
     metadata,
-    sqlalchemy.Column("stock_transaction_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("stock_transaction_id", Id, primary_key=True),
     sqlalchemy.Column(
         "stock_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("stocks.stock_id"),
         nullable=False,
     ),
     sqlalchemy.Column(
         "owner_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("owners.owner_id"),
         nullable=False,
     ),
@@ -102,46 +167,81 @@ stock_transactions = sqlalchemy.Table(
     sqlalchemy.Column("quantity", sqlalchemy.Integer, nullable=False),
     sqlalchemy.Column("tax", sqlalchemy.DECIMAL, default=0),
     sqlalchemy.Column("commission", sqlalchemy.DECIMAL, default=0),
-    sqlalchemy.Column("date", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("date", NaiveDateTime, nullable=False),
     sqlalchemy.Column("transaction_type", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("transaction_note", sqlalchemy.String, nullable=True),
     sqlalchemy.Column("transaction_ex_rate", sqlalchemy.DECIMAL, nullable=False),
+    # the id breaks ties between transactions with the same date for the
+    # keyset pagination of the history
+    sqlalchemy.Index(
+        "ix_stock_transactions_owner_id_stock_id_date_id",
+        "owner_id",
+        "stock_id",
+        "date",
+        "stock_transaction_id",
+    ),
+    sqlalchemy.Index("ix_stock_transactions_stock_id", "stock_id"),
+)
+stock_positions = sqlalchemy.Table(
+    "stock_positions",
+    metadata,
+    sqlalchemy.Column(
+        "owner_id",
+        Id,
+        sqlalchemy.ForeignKey("owners.owner_id"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column(
+        "stock_id",
+        Id,
+        sqlalchemy.ForeignKey("stocks.stock_id"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column("quantity", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("invested", sqlalchemy.DECIMAL, nullable=False),
+    sqlalchemy.Column("invested_converted", sqlalchemy.DECIMAL, nullable=False),
+    sqlalchemy.Column("last_transaction_date", NaiveDateTime, nullable=False),
 )
 stock_alerts = sqlalchemy.Table(
     "stock_alerts",
     metadata,
-    sqlalchemy.Column("stock_alert_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("stock_alert_id", Id, primary_key=True),
     sqlalchemy.Column(
         "stock_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("stocks.stock_id"),
         nullable=False,
     ),
     sqlalchemy.Column(
         "owner_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("owners.owner_id"),
         nullable=False,
     ),
-    sqlalchemy.Column("dividend_date", sqlalchemy.DateTime, nullable=True),
+    sqlalchemy.Column("dividend_date", NaiveDateTime, nullable=True),
     sqlalchemy.Column("lower_limit_price", sqlalchemy.DECIMAL, nullable=True),
     sqlalchemy.Column("upper_limit_price", sqlalchemy.DECIMAL, nullable=True),
     sqlalchemy.Column("fiscal_price_lower_than", sqlalchemy.BOOLEAN, nullable=True),
     sqlalchemy.Column("fiscal_price_greater_than", sqlalchemy.BOOLEAN, nullable=True),
     sqlalchemy.Column("profit_and_loss_lower_limit", sqlalchemy.DECIMAL, nullable=True),
     sqlalchemy.Column("profit_and_loss_upper_limit", sqlalchemy.DECIMAL, nullable=True),
+    # comma separated AlertFields, evaluated when prices or positions change
+    sqlalchemy.Column("triggered_fields", sqlalchemy.String, nullable=True),
+    sqlalchemy.Index("ix_stock_alerts_owner_id_stock_id", "owner_id", "stock_id"),
+    # the alerts of the stocks whose price changed
+    sqlalchemy.Index("ix_stock_alerts_stock_id", "stock_id"),
 )
 
 bonds = sqlalchemy.Table(
     "bonds",
     metadata,
-    sqlalchemy.Column("bond_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("bond_id", Id, primary_key=True),
     sqlalchemy.Column("isin", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("market", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("last_price", sqlalchemy.DECIMAL, nullable=False),
     sqlalchemy.Column(
         "currency_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("currency.currency_id"),
         nullable=False,
     ),
@@ -154,16 +254,16 @@ bonds = sqlalchemy.Table(
 bond_transactions = sqlalchemy.Table(
     "bond_transactions",
     metadata,
-    sqlalchemy.Column("bond_transactions_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("bond_transactions_id", Id, primary_key=True),
     sqlalchemy.Column(
         "bond_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("bonds.bond_id"),
         nullable=False,
     ),
     sqlalchemy.Column(
         "owner_id",
-        sqlalchemy.Integer,
+        Id,
         sqlalchemy.ForeignKey("owners.owner_id"),
         nullable=False,
     ),
@@ -179,17 +279,326 @@ bond_transactions = sqlalchemy.Table(
     sqlalchemy.Column("transaction_type", sqlalchemy.String, nullable=False),
 )
 
+id_workers = sqlalchemy.Table(
+    "id_workers",
+    metadata,
+    sqlalchemy.Column(
+        "worker_id", sqlalchemy.Integer, primary_key=True, autoincrement=False
+    ),
+    sqlalchemy.Column("lease_token", sqlalchemy.String, nullable=True),
+    # epoch milliseconds, the id clock
+    sqlalchemy.Column("lease_expires", sqlalchemy.BigInteger, nullable=False),
+)
+
+
+def create_missing_columns(engine: sqlalchemy.engine.Engine):
+    # columns added to existing tables must be nullable
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                engine.execute(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+
+
+def create_missing_indexes(engine: sqlalchemy.engine.Engine):
+    # create_all skips the tables that already exist, indexes included
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+
+
+def create_id_workers(engine: sqlalchemy.engine.Engine):
+    # one row per worker id, leased by the processes creating ids
+    existing = {
+        worker_id
+        for worker_id, in engine.execute(sqlalchemy.select([id_workers.c.worker_id]))
+    }
+    missing = [
+        {"worker_id": worker_id, "lease_token": None, "lease_expires": 0}
+        for worker_id in range(ID_MAX_WORKER + 1)
+        if worker_id not in existing
+    ]
+    if missing:
+        engine.execute(id_workers.insert(), missing)
+
+
+def get_pragmas(profile: StorageProfile) -> Pragmas:
+    if profile == StorageProfile.TUNED:
+        return TUNED_PRAGMAS
+    return {}
+
+
+def get_connect_args(url: str, profile: StorageProfile) -> Dict[str, Any]:
+    # options of the underlying driver connect, shared by the sync engine
+    if not url.startswith("sqlite"):
+        return {}
+    return {
+        "check_same_thread": False,
+        "factory": create_connection_factory(get_pragmas(profile)),
+    }
+
+
+def create_database(url: str, profile: StorageProfile = STORAGE_PROFILE) -> Database:
+    if url.startswith("sqlite"):
+        return SQLiteDatabase(
+            url, DATABASE_POOL_MAX_SIZE, **get_connect_args(url, profile)
+        )
+    return PostgresDatabase(
+        url, min_size=DATABASE_POOL_MIN_SIZE, max_size=DATABASE_POOL_MAX_SIZE
+    )
+
 
-engine = sqlalchemy.create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+def create_engine(
+    url: str, profile: StorageProfile = STORAGE_PROFILE
+) -> sqlalchemy.engine.Engine:
+    return sqlalchemy.create_engine(url, connect_args=get_connect_args(url, profile))
+
+
+class LazyDatabase:
+    # stands in for the Database at import time: the database and the sync
+    # engine are only created on first use, so configure can still point the
+    # process somewhere else and importing santaka.db touches nothing
+    def __init__(self, url: str, profile: StorageProfile):
+        self.url = url
+        self.profile = profile
+        self._database: Optional[Database] = None
+        self._engine: Optional[sqlalchemy.engine.Engine] = None
+
+    def configure(self, url: str, profile: Optional[StorageProfile] = None):
+        if self._database is not None and self._database.is_connected:
+            raise RuntimeError("can't configure a connected database")
+        if self._engine is not None:
+            self._engine.dispose()
+        self.url = url
+        if profile is not None:
+            self.profile = profile
+        self._database = None
+        self._engine = None
+
+    @property
+    def database(self) -> Database:
+        if self._database is None:
+            self._database = create_database(self.url, self.profile)
+        return self._database
+
+    @property
+    def engine(self) -> sqlalchemy.engine.Engine:
+        if self._engine is None:
+            self._engine = create_engine(self.url, self.profile)
+        return self._engine
+
+    def transaction(
+        self, *, force_rollback: bool = False, **kwargs: Any
+    ) -> "LazyTransaction":
+        return LazyTransaction(self, force_rollback=force_rollback, **kwargs)
+
+    async def run_query(
+        self, method: str, query: Any, values: Any = None, **kwargs: Any
+    ) -> Any:
+        # every query is timed, the slow ones go to the slow query log
+        start = perf_counter()
+        try:
+            result = await getattr(self.database, method)(query, values, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            DB_QUERY_LATENCY.observe(elapsed, method)
+        if slow_query_log.is_slow(elapsed):
+            await slow_query_log.record(self.database, method, query, values, elapsed)
+        return result
+
+    async def execute(self, query: Any, values: Any = None) -> Any:
+        return await self.run_query("execute", query, values)
+
+    async def execute_many(self, query: Any, values: Any) -> Any:
+        return await self.run_query("execute_many", query, values)
+
+    async def fetch_all(self, query: Any, values: Any = None) -> Any:
+        return await self.run_query("fetch_all", query, values)
+
+    async def fetch_one(self, query: Any, values: Any = None) -> Any:
+        return await self.run_query("fetch_one", query, values)
+
+    async def fetch_val(self, query: Any, values: Any = None, column: Any = 0) -> Any:
+        return await self.run_query("fetch_val", query, values, column=column)
+
+    async def iterate(self, query: Any, values: Any = None) -> AsyncGenerator:
+        # timed while the rows are fetched, not while the caller handles them
+        rows = self.database.iterate(query, values)
+        elapsed = 0.0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    record = await rows.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += perf_counter() - start
+                yield record
+        finally:
+            await rows.aclose()
+            DB_QUERY_LATENCY.observe(elapsed, "iterate")
+        if slow_query_log.is_slow(elapsed):
+            await slow_query_log.record(
+                self.database, "iterate", query, values, elapsed
+            )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.database, name)
+
+    async def __aenter__(self) -> "LazyDatabase":
+        await self.database.connect()
+        return self
+
+    async def __aexit__(self, *args: Any):
+        await self.database.disconnect()
+
+
+# the transactions started by async with on any LazyTransaction, per task and
+# innermost last: a ContextVar is never freed, one per instance would leak
+entered_transactions: ContextVar[Tuple[Tuple["LazyTransaction", Transaction], ...]] = (
+    ContextVar("entered_transactions", default=())
 )
-metadata.create_all(engine)
 
-if "PYTEST_CURRENT_TEST" in environ:
-    database = Database(TEST_DATABASE_URL, force_rollback=True)
-else:
-    database = Database(DATABASE_URL)
+
+class LazyTransaction:
+    # the views bind their transaction decorators at import: a databases
+    # Transaction keeps its connection on itself, shared by the concurrent calls
+    # of a view, so every call and every async with starts one of its own
+    def __init__(self, database: LazyDatabase, **kwargs: Any):
+        self.database = database
+        self.kwargs = kwargs
+
+    def create_transaction(self) -> Transaction:
+        # the connection is only looked up when the transaction starts
+        return Transaction(lambda: self.database.connection(), **self.kwargs)
+
+    def __call__(self, func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            async with self.create_transaction():
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    async def __aenter__(self) -> Transaction:
+        transaction = await self.create_transaction().start()
+        entered_transactions.set(entered_transactions.get() + ((self, transaction),))
+        return transaction
+
+    async def __aexit__(self, *args: Any):
+        entered = entered_transactions.get()
+        # the innermost transaction entered with this instance
+        index = max(i for i, (owner, _) in enumerate(entered) if owner is self)
+        transaction = entered[index][1]
+        entered_transactions.set(entered[:index] + entered[index:][1:])
+        await transaction.__aexit__(*args)
+
+
+database = LazyDatabase(DATABASE_URL, STORAGE_PROFILE)
+
+
+def create_schema(engine: Optional[sqlalchemy.engine.Engine] = None):
+    # idempotent, run by every entry point before touching the database
+    if engine is None:
+        engine = database.engine
+    metadata.create_all(engine)
+    create_missing_columns(engine)
+    create_missing_indexes(engine)
+    create_id_workers(engine)
+
+
+def build_worker_id_lease_query(
+    worker_id: int, token: str, now: int, expires: int
+) -> sqlalchemy.sql.expression.Update:
+    # only one of the processes updating a free or expired row gets a rowcount
+    return (
+        id_workers.update()
+        .where(
+            sqlalchemy.and_(
+                id_workers.c.worker_id == worker_id,
+                sqlalchemy.or_(
+                    id_workers.c.lease_token == token,
+                    id_workers.c.lease_expires <= now,
+                ),
+            )
+        )
+        .values(lease_token=token, lease_expires=expires)
+    )
+
+
+class WorkerIdLease:
+    # the generator stops at the end of the lease, which another process can
+    # only take over afterwards: the lease is renewed every third of its
+    # duration and the clocks of the hosts are assumed to agree within it
+    def __init__(self, generator: IdGenerator, duration: float):
+        self.generator = generator
+        self.duration = duration
+        self.token = uuid4().hex
+
+    def acquire(self, engine: sqlalchemy.engine.Engine) -> int:
+        # renews the leased worker id or leases a free one
+        now = self.generator.clock()
+        expires = now + int(self.duration * 1000)
+        worker_ids = list(range(ID_MAX_WORKER + 1))
+        shuffle(worker_ids)
+        if self.generator.worker_id is not None:
+            worker_ids.remove(self.generator.worker_id)
+            worker_ids.insert(0, self.generator.worker_id)
+        for worker_id in worker_ids:
+            result = engine.execute(
+                build_worker_id_lease_query(worker_id, self.token, now, expires)
+            )
+            if result.rowcount == 1:
+                self.generator.set_worker_id(worker_id, expires)
+                return worker_id
+        raise RuntimeError("no free worker id, set ID_WORKER_ID or wait for a lease")
+
+    def release(self, engine: sqlalchemy.engine.Engine):
+        if self.generator.worker_id is None:
+            return
+        engine.execute(
+            id_workers.update()
+            .where(
+                sqlalchemy.and_(
+                    id_workers.c.worker_id == self.generator.worker_id,
+                    id_workers.c.lease_token == self.token,
+                )
+            )
+            .values(lease_token=None, lease_expires=0)
+        )
+        self.generator.worker_id = None
+
+
+create_id = IdGenerator(ID_WORKER_ID)
+worker_id_lease = WorkerIdLease(create_id, ID_WORKER_LEASE)
+
+
+def acquire_worker_id():
+    # run by the entry points creating ids, after create_schema
+    if ID_WORKER_ID is None:
+        worker_id_lease.acquire(database.engine)
+
+
+def release_worker_id():
+    if ID_WORKER_ID is None:
+        worker_id_lease.release(database.engine)
 
 
-def create_random_id(length: int = 15):
-    return randint(10 ** (length - 1), (10 ** (length) - 1))
+async def renew_worker_id():
+    # runs with the process, the sync engine stays off the event loop
+    if ID_WORKER_ID is None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(ID_WORKER_LEASE / 3)
+            try:
+                await loop.run_in_executor(None, acquire_worker_id)
+            except Exception as e:
+                logger.error("worker id lease renewal error: %s", e)
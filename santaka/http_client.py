@@ -0,0 +1,67 @@
+from os import environ
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+HTTP_CONNECTION_LIMIT = int(environ.get("HTTP_CONNECTION_LIMIT", 100))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(environ.get("HTTP_CONNECTION_LIMIT_PER_HOST", 10))
+HTTP_KEEPALIVE_TIMEOUT = float(environ.get("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DNS_CACHE_TTL = int(environ.get("HTTP_DNS_CACHE_TTL", 300))
+HTTP_CONNECT_TIMEOUT = float(environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_TOTAL_TIMEOUT = float(environ.get("HTTP_TOTAL_TIMEOUT", 15))
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        limit: int = HTTP_CONNECTION_LIMIT,
+        limit_per_host: int = HTTP_CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+        self._session: Optional[ClientSession] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._session is not None
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None:
+            raise RuntimeError("HTTP client is not connected")
+        return self._session
+
+    async def connect(self):
+        if self._session is not None:
+            return
+        # the connector keeps idle connections alive between calls so the
+        # tcp/tls handshake and the dns lookup are paid once per host
+        connector = TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        self._session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(
+                total=self.total_timeout, connect=self.connect_timeout
+            ),
+        )
+
+    async def disconnect(self):
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+
+
+http_client = HTTPClient()
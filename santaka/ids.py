@@ -0,0 +1,78 @@
+from threading import Lock
+from time import time
+from typing import Callable, Optional
+
+# ids are sent as json numbers, the layout keeps them below 2 ** 53 so that
+# javascript clients read them exactly: 41 bits of milliseconds (69 years from
+# the epoch), 4 bits of worker id, 8 bits of sequence (256 ids per millisecond
+# per worker)
+ID_EPOCH = 1609459200000  # 2021-01-01 UTC in milliseconds
+ID_WORKER_BITS = 4
+ID_SEQUENCE_BITS = 8
+ID_MAX_WORKER = (1 << ID_WORKER_BITS) - 1
+ID_MAX_SEQUENCE = (1 << ID_SEQUENCE_BITS) - 1
+
+
+def current_millis() -> int:
+    return int(time() * 1000)
+
+
+class IdGenerator:
+    # snowflake style ids: time ordered, so new rows are appended to the right
+    # edge of the primary key index; two generators with the same worker id
+    # create the same ids, so the worker id is either leased until expires
+    # (milliseconds) or given for the life of the process
+    def __init__(
+        self,
+        worker_id: Optional[int] = None,
+        clock: Callable[[], int] = current_millis,
+        expires: Optional[int] = None,
+    ):
+        self.clock = clock
+        self.worker_id: Optional[int] = None
+        self.expires: Optional[int] = None
+        self._last_millis = -1
+        self._sequence = 0
+        self._lock = Lock()
+        if worker_id is not None:
+            self.set_worker_id(worker_id, expires)
+
+    def set_worker_id(self, worker_id: int, expires: Optional[int] = None):
+        if not 0 <= worker_id <= ID_MAX_WORKER:
+            raise ValueError(f"worker id must be between 0 and {ID_MAX_WORKER}")
+        # the lease is renewed from another thread
+        with self._lock:
+            self.worker_id = worker_id
+            self.expires = expires
+
+    def __call__(self) -> int:
+        with self._lock:
+            # a clock moving backwards keeps using the last millisecond
+            millis = max(self.clock(), self._last_millis)
+            if self.worker_id is None:
+                raise RuntimeError("no worker id, lease one or set ID_WORKER_ID")
+            if self.expires is not None and millis >= self.expires:
+                raise RuntimeError(f"worker id {self.worker_id} lease expired")
+            if millis == self._last_millis:
+                self._sequence = (self._sequence + 1) & ID_MAX_SEQUENCE
+                if self._sequence == 0:
+                    # sequence exhausted, wait for the next millisecond
+                    while millis <= self._last_millis:
+                        millis = self.clock()
+            else:
+                self._sequence = 0
+            self._last_millis = millis
+            return (
+                (millis - ID_EPOCH) << (ID_WORKER_BITS + ID_SEQUENCE_BITS)
+                | self.worker_id << ID_SEQUENCE_BITS
+                | self._sequence
+            )
+
+
+def get_id_millis(id_: int) -> int:
+    return (id_ >> (ID_WORKER_BITS + ID_SEQUENCE_BITS)) + ID_EPOCH
+
+
+def get_first_id(millis: int) -> int:
+    # the smallest id created at or after millis
+    return max(0, millis - ID_EPOCH) << (ID_WORKER_BITS + ID_SEQUENCE_BITS)
@@ -0,0 +1,320 @@
+import asyncio
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from santaka.cache import TTLCache
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+Labels = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(ABC):
+    # the label values are passed positionally, in labelnames order
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def render_samples(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.render_samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels: str):
+        # for the counts kept by another object, copied on scrape
+        self.values[labels] = value
+
+    def render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def clear(self):
+        self.values.clear()
+
+    def render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # per labels: the count of each bucket (not cumulative), then the sum
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def timed(self, *labels: str) -> Callable[[Callable], Callable]:
+        # decorator for the functions that are timed as a whole
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with Timer(self, labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render_samples(self) -> List[str]:
+        samples = []
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = format_labels(names, labels + (format_value(bound),))
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labelnames, labels)
+            samples.append(f"{self.name}_sum{label_text} {format_value(total[0])}")
+            samples.append(f"{self.name}_count{label_text} {cumulative}")
+        return samples
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args: Any):
+        self.histogram.observe(perf_counter() - self.start, *self.labels)
+
+
+Collector = Callable[[], Awaitable[None]]
+
+
+class Registry:
+    # one per process, the api and the task runner expose their own metrics
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> Any:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Collector):
+        # collectors update the gauges that are read from the database on scrape
+        self.collectors.append(collector)
+
+    async def collect(self) -> str:
+        for collector in self.collectors:
+            await collector()
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(
+    Histogram(
+        "santaka_http_request_duration_seconds",
+        "Time to answer a request, by route",
+        ("method", "route", "status"),
+    )
+)
+DB_QUERY_LATENCY = registry.register(
+    Histogram(
+        "santaka_db_query_duration_seconds",
+        "Time to run a database query, by method",
+        ("method",),
+    )
+)
+CACHE_HITS = registry.register(
+    Counter(
+        "santaka_cache_hits_total",
+        "Lookups answered by an in-process cache, by cache",
+        ("cache",),
+    )
+)
+CACHE_MISSES = registry.register(
+    Counter(
+        "santaka_cache_misses_total",
+        "Lookups missed or expired in an in-process cache, by cache",
+        ("cache",),
+    )
+)
+CACHE_EVICTIONS = registry.register(
+    Counter(
+        "santaka_cache_evictions_total",
+        "Entries evicted from a full in-process cache, by cache",
+        ("cache",),
+    )
+)
+CACHE_HIT_RATIO = registry.register(
+    Gauge(
+        "santaka_cache_hit_ratio",
+        "Hits over lookups of an in-process cache, by cache",
+        ("cache",),
+    )
+)
+CACHE_ENTRIES = registry.register(
+    Gauge(
+        "santaka_cache_entries",
+        "Entries held by an in-process cache, by cache",
+        ("cache",),
+    )
+)
+
+
+def add_cache_collector(name: str, cache: TTLCache):
+    # the caches count their lookups, the counts are copied on scrape
+    async def update_cache_metrics():
+        CACHE_HITS.set(cache.hits, name)
+        CACHE_MISSES.set(cache.misses, name)
+        CACHE_EVICTIONS.set(cache.evictions, name)
+        CACHE_HIT_RATIO.set(cache.hit_rate, name)
+        CACHE_ENTRIES.set(len(cache), name)
+
+    registry.add_collector(update_cache_metrics)
+
+
+class MetricsMiddleware:
+    # plain asgi instead of BaseHTTPMiddleware, which runs the app in a task and
+    # wraps the streamed bodies
+    def __init__(self, app: ASGIApp, routes: Sequence[Any]):
+        self.app = app
+        self.routes = routes
+        self.route_paths: Optional[Dict[Any, str]] = None
+
+    def get_route_path(self, scope: Scope) -> str:
+        # the router stores the matched endpoint in the scope, the routes are
+        # only all registered once the first request comes in
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path
+                for route in self.routes
+                if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Dict[str, Any]):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.observe(
+                perf_counter() - start,
+                scope["method"],
+                self.get_route_path(scope),
+                str(status_code),
+            )
+
+
+async def handle_metrics_connection(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    # any request gets the metrics, the scraper is the only client
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = (await registry.collect()).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + f"Content-Type: {CONTENT_TYPE}\r\n".encode()
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host: str, port: int) -> asyncio.AbstractServer:
+    # for the processes without an api, like the task runner
+    return await asyncio.start_server(handle_metrics_connection, host, port)
@@ -0,0 +1,63 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Optional
+
+from passlib.context import CryptContext
+
+
+class PasswordHasher:
+    # bcrypt takes hundreds of milliseconds, it runs in a thread pool so that it
+    # doesn't block the event loop; at most concurrency hashes run at once, the
+    # others wait in queue
+    def __init__(self, context: CryptContext, concurrency: int):
+        self.context = context
+        self.concurrency = concurrency
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def average_wait(self) -> float:
+        if self.completed == 0:
+            return 0.0
+        return self.total_wait / self.completed
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._semaphore = None
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix="password"
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        start = monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.total_wait += monotonic() - start
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, function, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._semaphore.release()
@@ -0,0 +1,75 @@
+from collections.abc import Mapping
+from typing import Any, AsyncGenerator, Iterator, List, Optional, Tuple
+
+from databases import Database
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+from sqlalchemy.sql import ClauseElement
+
+
+class AttributeRecord:
+    # the code base reads the sqlite rows (sqlalchemy RowProxy) by key, by
+    # position, by attribute and unpacks them: the asyncpg records of databases
+    # are mappings, only read by key or position
+    __slots__ = ("_record",)
+
+    def __init__(self, record: Mapping):
+        self._record = record
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            return tuple(self)[key]
+        return self._record[key]
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._record[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self) -> Iterator:
+        return (self._record[i] for i in range(len(self._record)))
+
+    def __len__(self) -> int:
+        return len(self._record)
+
+    def __eq__(self, other: Any) -> bool:
+        return tuple(self) == tuple(other)
+
+    def keys(self) -> List[str]:
+        return list(self._record)
+
+    def values(self) -> List[Any]:
+        return list(self)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(zip(self.keys(), self))
+
+
+class AttributeRecordConnection(PostgresConnection):
+    async def fetch_all(self, query: ClauseElement) -> List[AttributeRecord]:
+        return [AttributeRecord(record) for record in await super().fetch_all(query)]
+
+    async def fetch_one(self, query: ClauseElement) -> Optional[AttributeRecord]:
+        record = await super().fetch_one(query)
+        if record is None:
+            return None
+        return AttributeRecord(record)
+
+    async def iterate(
+        self, query: ClauseElement
+    ) -> AsyncGenerator[AttributeRecord, None]:
+        async for record in super().iterate(query):
+            yield AttributeRecord(record)
+
+
+class AttributeRecordBackend(PostgresBackend):
+    def connection(self) -> AttributeRecordConnection:
+        return AttributeRecordConnection(self, self._dialect)
+
+
+class PostgresDatabase(Database):
+    SUPPORTED_BACKENDS = {
+        **Database.SUPPORTED_BACKENDS,
+        "postgresql": "santaka.postgres:AttributeRecordBackend",
+        "postgres": "santaka.postgres:AttributeRecordBackend",
+    }
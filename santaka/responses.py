@@ -0,0 +1,61 @@
+from decimal import Decimal
+from hashlib import blake2b
+from os import environ
+from typing import Any, Optional, Union
+
+from fastapi import Request, Response, status
+from fastapi.responses import ORJSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, install the orjson extra to use it
+    orjson = None
+
+FAST_RESPONSES = environ.get("FAST_RESPONSES", "0") == "1"
+
+
+def encode_decimal(value: Any) -> float:
+    # decimals are sent as numbers like the default pydantic encoder does
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class DecimalORJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=encode_decimal)
+
+
+def fast_response(
+    content: Any, response: Optional[Response] = None
+) -> Union[Any, DecimalORJSONResponse]:
+    # the content is built by the server and already matches the response model:
+    # returning a response skips its validation and the stdlib json encoder,
+    # response is the one injected in the view, its headers are kept
+    if not FAST_RESPONSES:
+        return content
+    if orjson is None:
+        raise RuntimeError("fast responses require orjson")
+    fast = DecimalORJSONResponse(content)
+    if response is not None:
+        fast.headers.raw.extend(response.headers.raw)
+    return fast
+
+
+def make_etag(*parts: Any) -> str:
+    # weak, the same content is serialized differently with and without
+    # fast responses
+    digest = blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def get_not_modified_response(request: Request, etag: str) -> Optional[Response]:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    tags = {tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")}
+    if "*" in tags or etag.replace("W/", "", 1) in tags:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    return None
@@ -0,0 +1,128 @@
+import re
+from logging import getLogger
+from os import environ
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import text
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+logger = getLogger(__name__)
+
+# seconds, the slow query log is disabled when it's not set
+SLOW_QUERY_THRESHOLD = environ.get("SLOW_QUERY_THRESHOLD")
+SLOW_QUERY_EXPLAIN = environ.get("SLOW_QUERY_EXPLAIN", "1") == "1"
+
+PLACEHOLDER = r"(?:\?|%\(\w+\)s|:\w+|\$\d+)"
+PLACEHOLDER_LIST = re.compile(rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+# the postgres plans show the bound values as quoted literals
+PLAN_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+class Explain(Executable, ClauseElement):
+    def __init__(self, statement: ClauseElement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element: Explain, compiler: Any, **kwargs: Any) -> str:
+    prefix = "EXPLAIN "
+    if compiler.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    return prefix + compiler.process(element.statement, **kwargs)
+
+
+def get_statement_shape(query: Any, dialect: Any) -> str:
+    # the sql with the placeholders, the in lists and the inserted rows of any
+    # length collapsed, so that the same select is aggregated whatever its
+    # parameters
+    statement = query if isinstance(query, str) else str(query.compile(dialect=dialect))
+    statement = PLACEHOLDER_LIST.sub("(...)", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+def redact_values(query: Any, values: Any) -> Dict[str, str]:
+    # only the names and the types of the bound parameters are logged
+    if isinstance(values, list):
+        values = values[0] if values else {}
+    if not values and isinstance(query, ClauseElement):
+        values = query.compile().params
+    return {name: type(value).__name__ for name, value in (values or {}).items()}
+
+
+class SlowQuery:
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.plan: Optional[List[str]] = None
+
+
+class SlowQueryLog:
+    def __init__(self, threshold: Optional[float], explain: bool = True):
+        self.threshold = threshold
+        self.explain = explain
+        self.queries: Dict[str, SlowQuery] = {}
+
+    def is_slow(self, elapsed: float) -> bool:
+        return self.threshold is not None and elapsed >= self.threshold
+
+    async def get_plan(self, database: Any, query: Any, values: Any) -> List[str]:
+        # database is the wrapped Database, the explain isn't timed itself
+        if isinstance(query, str):
+            query = text(query).bindparams(**(values or {}))
+        elif values:
+            return ["not explained: the values are bound by the driver"]
+        try:
+            records = await database.fetch_all(Explain(query))
+        except Exception as e:
+            return [f"not explained: {e}"]
+        return [
+            PLAN_LITERAL.sub("'?'", str(list(record.values())[-1]))
+            for record in records
+        ]
+
+    async def record(
+        self, database: Any, method: str, query: Any, values: Any, elapsed: float
+    ):
+        shape = get_statement_shape(query, database._backend._dialect)
+        slow_query = self.queries.get(shape)
+        if slow_query is None:
+            slow_query = self.queries[shape] = SlowQuery(shape)
+        slow_query.count += 1
+        slow_query.total += elapsed
+        slow_query.max = max(slow_query.max, elapsed)
+        logger.warning(
+            "slow query %s took %.3fs (%d times, %.3fs in total): %s parameters %s",
+            method,
+            elapsed,
+            slow_query.count,
+            slow_query.total,
+            shape,
+            redact_values(query, values),
+        )
+        # the plan is captured once per shape, when it's first seen
+        if self.explain and slow_query.plan is None and method != "execute_many":
+            slow_query.plan = await self.get_plan(database, query, values)
+            logger.warning("plan of %s:\n%s", shape, "\n".join(slow_query.plan))
+
+    def summary(self) -> List[SlowQuery]:
+        return sorted(self.queries.values(), key=lambda q: q.total, reverse=True)
+
+    def log_summary(self):
+        for slow_query in self.summary():
+            logger.warning(
+                "slow query shape ran %d times, %.3fs in total, %.3fs at most: %s",
+                slow_query.count,
+                slow_query.total,
+                slow_query.max,
+                slow_query.shape,
+            )
+
+
+slow_query_log = SlowQueryLog(
+    float(SLOW_QUERY_THRESHOLD) if SLOW_QUERY_THRESHOLD is not None else None,
+    SLOW_QUERY_EXPLAIN,
+)
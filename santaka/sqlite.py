@@ -0,0 +1,157 @@
+import asyncio
+import sqlite3
+from typing import Any, Dict, List, Optional, Type, Union
+
+import aiosqlite
+from databases import Database
+from databases.backends.sqlite import (
+    SQLiteBackend,
+    SQLiteConnection,
+    SQLitePool,
+    SQLiteTransaction,
+)
+from sqlalchemy.sql import ClauseElement
+
+Pragmas = Dict[str, Any]
+
+
+def create_connection_factory(pragmas: Pragmas) -> Type[sqlite3.Connection]:
+    # sqlite3.connect builds its connections with factory, so the pragmas are set
+    # on every connection, both by the sync engine and by aiosqlite
+    class TunedConnection(sqlite3.Connection):
+        def __init__(self, *args: Any, **kwargs: Any):
+            super().__init__(*args, **kwargs)
+            for name, value in pragmas.items():
+                self.execute(f"PRAGMA {name} = {value}")
+
+    return TunedConnection
+
+
+class SQLiteConnectionPool(SQLitePool):
+    # the databases sqlite backend opens a new connection, with its own thread,
+    # on every acquire: up to max_idle released connections are kept for reuse,
+    # 4 to 5 times the queries per second (benchmarks/bench_sqlite_pool.py)
+    def __init__(self, url: Any, max_idle: int, **options: Any):
+        super().__init__(url, **options)
+        self.max_idle = max_idle
+        self._idle: List[aiosqlite.Connection] = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self._idle:
+            return self._idle.pop()
+        return await super().acquire()
+
+    async def release(self, connection: aiosqlite.Connection):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(connection)
+            return
+        await super().release(connection)
+
+    async def close(self):
+        while self._idle:
+            await super().release(self._idle.pop())
+
+
+class ImmediateSQLiteTransaction(SQLiteTransaction):
+    # a deferred transaction only takes the write lock at its first write, and
+    # fails with "database is locked", without waiting for the busy timeout,
+    # when another connection wrote since its first read: taken at BEGIN, the
+    # writers queue on the busy timeout instead (readers don't block in WAL);
+    # the writers of this process queue in order on write_lock first, polling
+    # in the busy handler let some of them time out under load
+    def __init__(self, connection: SQLiteConnection, write_lock: asyncio.Lock):
+        super().__init__(connection)
+        self._write_lock = write_lock
+
+    async def start(self, is_root: bool, extra_options: Dict[Any, Any]):
+        if not is_root:
+            return await super().start(is_root, extra_options)
+        self._is_root = True
+        await self._write_lock.acquire()
+        try:
+            async with self._connection._connection.execute(
+                "BEGIN IMMEDIATE"
+            ) as cursor:
+                await cursor.close()
+        except BaseException:
+            self._write_lock.release()
+            raise
+
+    async def commit(self):
+        try:
+            await super().commit()
+        finally:
+            if self._is_root:
+                self._write_lock.release()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            if self._is_root:
+                self._write_lock.release()
+
+
+class ImmediateSQLiteConnection(SQLiteConnection):
+    def __init__(self, pool: SQLitePool, dialect: Any, write_lock: asyncio.Lock):
+        super().__init__(pool, dialect)
+        self._write_lock = write_lock
+
+    def transaction(self) -> ImmediateSQLiteTransaction:
+        return ImmediateSQLiteTransaction(self, self._write_lock)
+
+
+class PooledSQLiteBackend(SQLiteBackend):
+    def __init__(self, database_url: Any, max_idle: int = 0, **options: Any):
+        super().__init__(database_url, **options)
+        self._pool = SQLiteConnectionPool(self._database_url, max_idle, **options)
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def connect(self):
+        # created in the running loop, python 3.8 binds the lock to a loop
+        self._write_lock = asyncio.Lock()
+
+    async def disconnect(self):
+        await self._pool.close()
+
+    def connection(self) -> ImmediateSQLiteConnection:
+        return ImmediateSQLiteConnection(self._pool, self._dialect, self._write_lock)
+
+
+class SQLiteDatabase(Database):
+    # the backend internals used here are those of the databases version pinned
+    # in pyproject.toml, tests/test_sqlite.py covers them
+    SUPPORTED_BACKENDS = {
+        **Database.SUPPORTED_BACKENDS,
+        "sqlite": "santaka.sqlite:PooledSQLiteBackend",
+    }
+
+    def __init__(self, url: str, max_idle: int, **options: Any):
+        super().__init__(url, max_idle=max_idle, **options)
+
+    async def execute_many(
+        self, query: Union[ClauseElement, str], values: List[Dict[str, Any]]
+    ):
+        # databases compiles and runs one statement per row: the statement is
+        # compiled once and all the rows go to the driver executemany
+        keys = set(values[0]) if values else set()
+        if isinstance(query, str) or any(set(row) != keys for row in values):
+            return await super().execute_many(query, values)
+        compiled = query.compile(dialect=self._backend._dialect, column_keys=keys)
+        processors = compiled._bind_processors
+        rows = []
+        for row in values:
+            params = compiled.construct_params(row)
+            rows.append(
+                [
+                    (
+                        processors[name](params[name])
+                        if name in processors
+                        else params[name]
+                    )
+                    for name in compiled.positiontup
+                ]
+            )
+        async with self.connection() as connection:
+            async with connection._query_lock:
+                await connection.raw_connection.executemany(compiled.string, rows)
@@ -0,0 +1,92 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+from typing import Any, AsyncIterator, List
+
+from sqlalchemy.sql import select
+from sqlalchemy.sql.expression import Select
+
+from santaka.db import database, stock_transactions, stocks
+from santaka.stock.models import StatementFormat
+
+# same columns accepted by the import, plus the transaction id
+EXPORT_FIELDS = [
+    "stock_transaction_id",
+    "symbol",
+    "price",
+    "quantity",
+    "tax",
+    "commission",
+    "date",
+    "transaction_type",
+    "transaction_note",
+    "transaction_ex_rate",
+]
+# rows buffered before each chunk of the response is sent
+EXPORT_CHUNK_ROWS = 500
+
+
+def build_export_query(owner_id: int) -> Select:
+    # ordered like the owner_id, stock_id, date index so that sqlite doesn't
+    # need to sort the whole history before returning the first row
+    return (
+        select(
+            [
+                stock_transactions.c.stock_transaction_id,
+                stocks.c.symbol,
+                stock_transactions.c.price,
+                stock_transactions.c.quantity,
+                stock_transactions.c.tax,
+                stock_transactions.c.commission,
+                stock_transactions.c.date,
+                stock_transactions.c.transaction_type,
+                stock_transactions.c.transaction_note,
+                stock_transactions.c.transaction_ex_rate,
+            ]
+        )
+        .select_from(
+            stock_transactions.join(
+                stocks, stocks.c.stock_id == stock_transactions.c.stock_id
+            )
+        )
+        .where(stock_transactions.c.owner_id == owner_id)
+        .order_by(stock_transactions.c.stock_id, stock_transactions.c.date)
+    )
+
+
+def format_value(value: Any) -> Any:
+    # decimals are written as strings to keep their precision in json
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def format_rows(rows: List[List[Any]], statement_format: StatementFormat) -> str:
+    if statement_format == StatementFormat.NDJSON:
+        return "".join(
+            json.dumps(dict(zip(EXPORT_FIELDS, row)), separators=(",", ":")) + "\n"
+            for row in rows
+        )
+    buffer = StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+async def iterate_statement(
+    owner_id: int, statement_format: StatementFormat
+) -> AsyncIterator[str]:
+    # the rows are read with a cursor and sent in chunks, memory use doesn't
+    # grow with the history
+    if statement_format == StatementFormat.CSV:
+        yield ",".join(EXPORT_FIELDS) + "\n"
+    rows = []
+    async for record in database.iterate(build_export_query(owner_id)):
+        rows.append([format_value(record[field]) for field in EXPORT_FIELDS])
+        if len(rows) == EXPORT_CHUNK_ROWS:
+            yield format_rows(rows, statement_format)
+            rows = []
+    if rows:
+        yield format_rows(rows, statement_format)
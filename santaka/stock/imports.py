@@ -0,0 +1,390 @@
+import codecs
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy.sql import select
+
+from santaka.db import create_id, currency, database, stock_transactions, stocks
+from santaka.stock.models import (
+    ImportedStockTransaction,
+    StatementFormat,
+    TransactionType,
+)
+from santaka.stock.providers import Quotes
+from santaka.stock.utils import (
+    BULK_UPDATE_BATCH_SIZE,
+    YAHOO_FIELD_CURRENCY,
+    YAHOO_FIELD_FINANCIAL_CURRENCY,
+    YAHOO_FIELD_MARKET,
+    YAHOO_FIELD_NAME,
+    YAHOO_FIELD_PRICE,
+    YahooError,
+    get_yahoo_quote,
+    replay_stock_position,
+    split_in_batches,
+)
+
+# each transaction binds 11 parameters, keep batches below sqlite variables limit
+IMPORT_BATCH_SIZE = 90
+IMPORT_MAX_ERRORS = 20
+
+ImportedRows = List[Tuple[int, ImportedStockTransaction]]
+
+
+async def iterate_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # utf-8-sig drops the byte order mark spreadsheets put in front of csv files
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def iterate_rows(
+    chunks: AsyncIterator[bytes], statement_format: StatementFormat
+) -> AsyncIterator[Tuple[int, Any]]:
+    # one row per line, csv files start with a header and empty cells are
+    # treated as missing values
+    header = None
+    line_number = 0
+    async for line in iterate_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        if statement_format == StatementFormat.NDJSON:
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        if len(values) != len(header):
+            yield line_number, None
+            continue
+        yield line_number, {
+            name: value for name, value in zip(header, values) if value != ""
+        }
+
+
+async def parse_imported_transactions(
+    chunks: AsyncIterator[bytes], statement_format: StatementFormat
+) -> ImportedRows:
+    transactions = []
+    errors = []
+    async for line_number, row in iterate_rows(chunks, statement_format):
+        if not isinstance(row, dict):
+            errors.append(f"line {line_number}: malformed row")
+            continue
+        try:
+            transaction = ImportedStockTransaction(**row)
+        except ValidationError as e:
+            for error in e.errors():
+                field = ".".join(str(location) for location in error["loc"])
+                errors.append(f"line {line_number}: {field} {error['msg']}")
+            continue
+        transaction.symbol = transaction.symbol.upper()
+        # the datetime column doesn't keep the timezone
+        transaction.date = transaction.date.replace(tzinfo=None)
+        transactions.append((line_number, transaction))
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=errors[:IMPORT_MAX_ERRORS],
+        )
+    return transactions
+
+
+async def fetch_quotes(symbols: List[str]) -> Dict[str, Any]:
+    try:
+        return await get_yahoo_quote(symbols)
+    except YahooError:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Call to provider unsuccessful",
+        )
+
+
+async def get_stock_ids(symbols: List[str]) -> Dict[str, int]:
+    stock_ids = {}
+    for batch in split_in_batches(symbols, BULK_UPDATE_BATCH_SIZE):
+        query = select([stocks.c.symbol, stocks.c.stock_id]).where(
+            stocks.c.symbol.in_(batch)
+        )
+        for record in await database.fetch_all(query):
+            stock_ids[record.symbol] = record.stock_id
+    return stock_ids
+
+
+async def get_currency_ids(iso_currencies: List[str]) -> Dict[str, int]:
+    query = select([currency.c.iso_currency, currency.c.currency_id]).where(
+        currency.c.iso_currency.in_(iso_currencies)
+    )
+    return {
+        record.iso_currency: record.currency_id
+        for record in await database.fetch_all(query)
+    }
+
+
+def get_rate_symbols(
+    iso_currencies: List[str], currency_ids: Dict[str, int], base_currency: str
+) -> Dict[str, str]:
+    return {
+        iso_currency: f"{base_currency}{iso_currency}=X".upper()
+        for iso_currency in iso_currencies
+        if iso_currency not in currency_ids and iso_currency != base_currency
+    }
+
+
+async def fetch_new_stock_quotes(
+    symbols: List[str], base_currency: str
+) -> Tuple[Quotes, Quotes]:
+    # the quotes of the symbols missing from the database, with one call, and
+    # the rates of their currencies missing too, with a second one: fetched
+    # before the import transaction, which holds the write lock
+    stock_ids = await get_stock_ids(symbols)
+    new_symbols = [symbol for symbol in symbols if symbol not in stock_ids]
+    if not new_symbols:
+        return {}, {}
+    quotes = await fetch_quotes(new_symbols)
+    unknown_symbols = [symbol for symbol in new_symbols if symbol not in quotes]
+    if unknown_symbols:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Symbols {', '.join(unknown_symbols)} don't exist",
+        )
+    iso_currencies = sorted(
+        {quotes[symbol][YAHOO_FIELD_CURRENCY] for symbol in new_symbols}
+    )
+    currency_ids = await get_currency_ids(iso_currencies)
+    rate_symbols = get_rate_symbols(iso_currencies, currency_ids, base_currency)
+    rates = {}
+    if rate_symbols:
+        rates = await fetch_quotes(list(rate_symbols.values()))
+    return quotes, rates
+
+
+async def create_stocks(
+    symbols: List[str], base_currency: str, quotes: Quotes, rates: Quotes
+) -> Dict[str, int]:
+    # the stocks and currencies are created from the fetched quotes, the ones
+    # created meanwhile by another request are found in the database
+    iso_currencies = sorted(
+        {quotes[symbol][YAHOO_FIELD_CURRENCY] for symbol in symbols}
+    )
+    currency_ids = await get_currency_ids(iso_currencies)
+    rate_symbols = get_rate_symbols(iso_currencies, currency_ids, base_currency)
+    now = datetime.utcnow()
+    new_currencies = []
+    for iso_currency in iso_currencies:
+        if iso_currency in currency_ids:
+            continue
+        last_rate = 1
+        symbol = rate_symbols.get(iso_currency)
+        if symbol is not None:
+            if symbol not in rates:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Symbol {symbol} doesn't exist",
+                )
+            last_rate = rates[symbol][YAHOO_FIELD_PRICE]
+        currency_ids[iso_currency] = create_id()
+        new_currencies.append(
+            {
+                "currency_id": currency_ids[iso_currency],
+                "iso_currency": iso_currency,
+                "last_rate": last_rate,
+                "symbol": symbol,
+                "last_update": now,
+            }
+        )
+    if new_currencies:
+        await database.execute(currency.insert().values(new_currencies))
+    stock_ids = {}
+    new_stocks = []
+    for symbol in symbols:
+        quote = quotes[symbol]
+        stock_ids[symbol] = create_id()
+        new_stocks.append(
+            {
+                "stock_id": stock_ids[symbol],
+                "short_name": quote[YAHOO_FIELD_NAME],
+                "currency_id": currency_ids[quote[YAHOO_FIELD_CURRENCY]],
+                "market": quote[YAHOO_FIELD_MARKET],
+                "symbol": symbol,
+                "last_price": quote[YAHOO_FIELD_PRICE],
+                "last_update": now,
+                "financial_currency": quote.get(YAHOO_FIELD_FINANCIAL_CURRENCY),
+            }
+        )
+    for batch in split_in_batches(new_stocks, IMPORT_BATCH_SIZE):
+        await database.execute(stocks.insert().values(batch))
+    return stock_ids
+
+
+async def resolve_stock_ids(
+    symbols: List[str], base_currency: str, quotes: Quotes, rates: Quotes
+) -> Tuple[Dict[str, int], List[str]]:
+    stock_ids = await get_stock_ids(symbols)
+    created_symbols = [symbol for symbol in symbols if symbol not in stock_ids]
+    if created_symbols:
+        stock_ids.update(
+            await create_stocks(created_symbols, base_currency, quotes, rates)
+        )
+    return stock_ids, created_symbols
+
+
+def get_duplicate_key(transaction: Any) -> Tuple[Any, ...]:
+    # same fields and same day, as in validate_stock_transaction, a missing
+    # exchange rate is stored as 1
+    exchange_rate = transaction.transaction_ex_rate
+    if exchange_rate is None:
+        exchange_rate = Decimal(1)
+    return (
+        transaction.price,
+        transaction.quantity,
+        transaction.tax,
+        transaction.commission,
+        TransactionType(transaction.transaction_type),
+        transaction.date.date(),
+        transaction.transaction_note,
+        exchange_rate,
+    )
+
+
+async def validate_imported_transactions(
+    owner_id: int, transactions: ImportedRows, stock_ids: Dict[str, int]
+):
+    # the existing history and the imported rows of each stock are merged in
+    # date order, then a single pass checks that the running quantity never
+    # goes below zero and that no transaction is duplicated
+    histories: Dict[int, List[Tuple[datetime, int, int, Any]]] = defaultdict(list)
+    for batch in split_in_batches(sorted(set(stock_ids.values())), IMPORT_BATCH_SIZE):
+        query = (
+            select(
+                [
+                    stock_transactions.c.stock_id,
+                    stock_transactions.c.price,
+                    stock_transactions.c.quantity,
+                    stock_transactions.c.tax,
+                    stock_transactions.c.commission,
+                    stock_transactions.c.transaction_type,
+                    stock_transactions.c.date,
+                    stock_transactions.c.transaction_note,
+                    stock_transactions.c.transaction_ex_rate,
+                ]
+            )
+            .where(stock_transactions.c.owner_id == owner_id)
+            .where(stock_transactions.c.stock_id.in_(batch))
+        )
+        for record in await database.fetch_all(query):
+            # within the same date the existing transactions come first
+            histories[record.stock_id].append((record.date, 0, 0, record))
+    for position, (line_number, transaction) in enumerate(transactions):
+        histories[stock_ids[transaction.symbol]].append(
+            (transaction.date, 1, position, (line_number, transaction))
+        )
+    errors = []
+    for history in histories.values():
+        history.sort(key=lambda item: item[:3])
+        quantity = 0
+        seen: Set[Tuple[Any, ...]] = set()
+        for _, imported, _, item in history:
+            if not imported:
+                seen.add(get_duplicate_key(item))
+                if item.transaction_type == TransactionType.sell.value:
+                    quantity -= item.quantity
+                else:
+                    quantity += item.quantity
+                continue
+            line_number, transaction = item
+            key = get_duplicate_key(transaction)
+            if key in seen:
+                errors.append((line_number, "You cannot duplicate a transaction"))
+            seen.add(key)
+            if transaction.transaction_type == TransactionType.sell:
+                if quantity < transaction.quantity:
+                    errors.append(
+                        (line_number, f"Cannot sell more than {quantity} stocks")
+                    )
+                quantity -= transaction.quantity
+            else:
+                quantity += transaction.quantity
+    if errors:
+        errors.sort()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=[
+                f"line {line_number}: {message}"
+                for line_number, message in errors[:IMPORT_MAX_ERRORS]
+            ],
+        )
+
+
+async def insert_imported_transactions(
+    owner_id: int,
+    base_currency: str,
+    transactions: ImportedRows,
+    symbols: List[str],
+    quotes: Quotes,
+    rates: Quotes,
+) -> Dict[str, Any]:
+    stock_ids, created_symbols = await resolve_stock_ids(
+        symbols, base_currency, quotes, rates
+    )
+    await validate_imported_transactions(owner_id, transactions, stock_ids)
+    values = []
+    for _, transaction in transactions:
+        exchange_rate = Decimal(1)
+        if transaction.transaction_ex_rate is not None:
+            exchange_rate = transaction.transaction_ex_rate
+        values.append(
+            {
+                "stock_transaction_id": create_id(),
+                "stock_id": stock_ids[transaction.symbol],
+                "owner_id": owner_id,
+                "price": transaction.price,
+                "quantity": transaction.quantity,
+                "tax": transaction.tax,
+                "commission": transaction.commission,
+                "date": transaction.date,
+                "transaction_type": transaction.transaction_type.value,
+                "transaction_note": transaction.transaction_note,
+                "transaction_ex_rate": exchange_rate,
+            }
+        )
+    await database.execute_many(stock_transactions.insert(), values)
+    for stock_id in sorted({value["stock_id"] for value in values}):
+        await replay_stock_position(owner_id, stock_id)
+    return {"imported": len(values), "created_stocks": created_symbols}
+
+
+async def import_stock_transactions(
+    owner_id: int,
+    base_currency: str,
+    chunks: AsyncIterator[bytes],
+    statement_format: StatementFormat,
+) -> Dict[str, Any]:
+    # the body is read and the quotes fetched before the transaction opens,
+    # nothing is written unless every row is valid
+    transactions = await parse_imported_transactions(chunks, statement_format)
+    symbols = sorted({transaction.symbol for _, transaction in transactions})
+    quotes, rates = await fetch_new_stock_quotes(symbols, base_currency)
+    async with database.transaction():
+        return await insert_imported_transactions(
+            owner_id, base_currency, transactions, symbols, quotes, rates
+        )
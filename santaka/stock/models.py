@@ -49,8 +49,24 @@ class StockTransaction(NewStockTransaction):
     stock_transaction_id: int
 
 
+class StatementFormat(str, Enum):
+    # media types of the imported and exported transaction statements
+    CSV = "text/csv"
+    NDJSON = "application/x-ndjson"
+
+
+class ImportedStockTransaction(Transaction):
+    symbol: str
+
+
+class ImportedStockTransactions(BaseModel):
+    imported: int
+    created_stocks: List[str]
+
+
 class StockTransactionHistory(BaseModel):
     transactions: List[StockTransaction]
+    next_cursor: Optional[str] = None
 
 
 class TradedStock(NewStock):
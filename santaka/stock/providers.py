@@ -0,0 +1,188 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from enum import Enum
+from os import environ
+from random import Random
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientError
+
+from santaka.http_client import http_client
+
+YAHOO_QUOTE_URL = environ.get(
+    "YAHOO_QUOTE_URL", "https://query1.finance.yahoo.com/v7/finance/quote"
+)
+YAHOO_FIELD_PRICE = "regularMarketPrice"
+YAHOO_FIELD_FINANCIAL_CURRENCY = "financialCurrency"
+YAHOO_FIELD_MARKET = "fullExchangeName"
+YAHOO_FIELD_CURRENCY = "currency"
+YAHOO_FIELD_NAME = "shortName"
+
+QUOTE_PROVIDER = environ.get("QUOTE_PROVIDER", "yahoo")
+QUOTE_PROVIDER_FILE = environ.get("QUOTE_PROVIDER_FILE")
+QUOTE_PROVIDER_LATENCY = float(environ.get("QUOTE_PROVIDER_LATENCY", 0))
+QUOTE_PROVIDER_SEED = int(environ.get("QUOTE_PROVIDER_SEED", 0))
+
+Quotes = Dict[str, Dict[str, Any]]
+
+
+class YahooMarket(str, Enum):
+    ITALY = "Milan"
+    UK = "LSE"
+    EU = "XETRA"
+    USA_NASDAQ = "NasdaqGS"
+    USA_NYSE = "NYSE"
+    CANADA = "Toronto"
+
+
+class YahooError(Exception):
+    pass
+
+
+class QuoteProviderType(str, Enum):
+    YAHOO = "yahoo"
+    REPLAY = "replay"
+    RANDOM_WALK = "random_walk"
+
+
+def parse_yahoo_response(response: Dict[str, Any]) -> Quotes:
+    quotes = {}
+    for quote in response["quoteResponse"]["result"]:
+        if quote[YAHOO_FIELD_MARKET] == YahooMarket.UK.value:
+            quote[YAHOO_FIELD_PRICE] = quote[YAHOO_FIELD_PRICE] / 100
+        quotes[quote["symbol"]] = quote
+    return quotes
+
+
+class QuoteProvider(ABC):
+    @abstractmethod
+    async def get_quotes(self, symbols: List[str]) -> Quotes:
+        pass
+
+
+class YahooProvider(QuoteProvider):
+    def __init__(self, url: str = YAHOO_QUOTE_URL):
+        self.url = url
+
+    async def get_quotes(self, symbols: List[str]) -> Quotes:
+        # a timeout or a connection error is a provider failure like a bad status
+        try:
+            async with http_client.session.get(
+                self.url,
+                params={
+                    "symbols": ",".join(symbols),
+                    "fields": ",".join(
+                        [
+                            YAHOO_FIELD_PRICE,
+                            YAHOO_FIELD_CURRENCY,
+                            YAHOO_FIELD_MARKET,
+                            YAHOO_FIELD_NAME,
+                            YAHOO_FIELD_FINANCIAL_CURRENCY,
+                        ]
+                    ),
+                },
+            ) as resp:
+                if resp.status != 200:
+                    raise YahooError(f"yahoo answered with {resp.status} status")
+                response = await resp.json()
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise YahooError(f"yahoo request failed: {e!r}") from e
+        return parse_yahoo_response(response)
+
+
+class ReplayProvider(QuoteProvider):
+    # replays quotes recorded from the yahoo endpoint: the file holds one response
+    # or a list of responses, each symbol cycles through its recorded quotes
+    def __init__(self, path: str, latency: float = 0):
+        self.latency = latency
+        with open(path) as f:
+            recording = json.load(f)
+        if isinstance(recording, dict):
+            recording = [recording]
+        self._recorded_quotes: Dict[str, List[Dict[str, Any]]] = {}
+        for response in recording:
+            for symbol, quote in parse_yahoo_response(response).items():
+                self._recorded_quotes.setdefault(symbol, []).append(quote)
+        self._positions: Dict[str, int] = {}
+
+    async def get_quotes(self, symbols: List[str]) -> Quotes:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        quotes = {}
+        for symbol in symbols:
+            recorded_quotes = self._recorded_quotes.get(symbol)
+            if not recorded_quotes:
+                continue
+            position = self._positions.get(symbol, 0)
+            quotes[symbol] = dict(recorded_quotes[position % len(recorded_quotes)])
+            self._positions[symbol] = position + 1
+        return quotes
+
+
+SYMBOL_SUFFIX_MARKETS = {
+    ".MI": (YahooMarket.ITALY.value, "EUR"),
+    ".L": (YahooMarket.UK.value, "GBP"),
+    ".DE": (YahooMarket.EU.value, "EUR"),
+    ".TO": (YahooMarket.CANADA.value, "CAD"),
+}
+
+
+class RandomWalkProvider(QuoteProvider):
+    # every call moves each requested symbol one step along a seeded random walk
+    def __init__(self, seed: int = 0, latency: float = 0, volatility: float = 0.01):
+        self.seed = seed
+        self.latency = latency
+        self.volatility = volatility
+        self._walks: Dict[str, Random] = {}
+        self._prices: Dict[str, float] = {}
+
+    def next_price(self, symbol: str) -> float:
+        walk = self._walks.get(symbol)
+        if walk is None:
+            walk = self._walks[symbol] = Random(f"{self.seed}-{symbol}")
+            if symbol.endswith("=X"):
+                self._prices[symbol] = walk.uniform(0.5, 2)
+            else:
+                self._prices[symbol] = walk.uniform(5, 500)
+        price = self._prices[symbol] * (1 + walk.gauss(0, self.volatility))
+        self._prices[symbol] = price
+        return round(price, 4)
+
+    def create_quote(self, symbol: str) -> Dict[str, Any]:
+        if symbol.endswith("=X"):
+            market, iso_currency = "CCY", symbol[3:6]
+        else:
+            market, iso_currency = YahooMarket.USA_NASDAQ.value, "USD"
+            for suffix, suffix_market in SYMBOL_SUFFIX_MARKETS.items():
+                if symbol.endswith(suffix):
+                    market, iso_currency = suffix_market
+        return {
+            "symbol": symbol,
+            YAHOO_FIELD_PRICE: self.next_price(symbol),
+            YAHOO_FIELD_CURRENCY: iso_currency,
+            YAHOO_FIELD_FINANCIAL_CURRENCY: iso_currency,
+            YAHOO_FIELD_MARKET: market,
+            YAHOO_FIELD_NAME: symbol.split(".")[0].lower(),
+        }
+
+    async def get_quotes(self, symbols: List[str]) -> Quotes:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {symbol: self.create_quote(symbol) for symbol in symbols}
+
+
+def create_quote_provider(
+    provider_type: str = QUOTE_PROVIDER,
+    path: Optional[str] = QUOTE_PROVIDER_FILE,
+    latency: float = QUOTE_PROVIDER_LATENCY,
+    seed: int = QUOTE_PROVIDER_SEED,
+) -> QuoteProvider:
+    provider_type = QuoteProviderType(provider_type)
+    if provider_type == QuoteProviderType.REPLAY:
+        if path is None:
+            raise ValueError("the replay quote provider needs QUOTE_PROVIDER_FILE")
+        return ReplayProvider(path, latency)
+    if provider_type == QuoteProviderType.RANDOM_WALK:
+        return RandomWalkProvider(seed, latency)
+    return YahooProvider()
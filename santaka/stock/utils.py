@@ -1,18 +1,20 @@
+import asyncio
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from decimal import Decimal
-from typing import Any, Dict, List, Optional, Tuple
-from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple, Union
 from os import environ
 from logging import getLogger
+from time import perf_counter
 from datetime import datetime, timedelta
 
-from aiohttp import ClientSession
 from fastapi import status, HTTPException
 from pytz import timezone, utc
-from sqlalchemy import asc
-from sqlalchemy.sql import select
+from sqlalchemy.sql import and_, case, exists, func, literal, select, tuple_
+from sqlalchemy.sql.expression import Select
 
 from santaka.analytics import (
     calculate_fiscal_price,
+    calculate_position_change,
     calculate_profit_and_loss,
     calculate_invested,
     calculate_ctvs,
@@ -34,27 +36,41 @@ from santaka.db import (
     accounts,
     owners,
     stock_alerts,
+    stock_positions,
+)
+from santaka.cache import TTLCache
+from santaka.metrics import (
+    ROW_BUCKETS,
+    Counter,
+    Gauge,
+    Histogram,
+    add_cache_collector,
+    registry,
+)
+from santaka.coalesce import Coalescer
+from santaka.stock.providers import (  # noqa: F401
+    YAHOO_FIELD_CURRENCY,
+    YAHOO_FIELD_FINANCIAL_CURRENCY,
+    YAHOO_FIELD_MARKET,
+    YAHOO_FIELD_NAME,
+    YAHOO_FIELD_PRICE,
+    YahooError,
+    YahooMarket,
+    create_quote_provider,
 )
 
 logger = getLogger(__name__)
 
-YAHOO_QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
-YAHOO_FIELD_PRICE = "regularMarketPrice"
-YAHOO_FIELD_FINANCIAL_CURRENCY = "financialCurrency"
-YAHOO_FIELD_MARKET = "fullExchangeName"
-YAHOO_FIELD_CURRENCY = "currency"
-YAHOO_FIELD_NAME = "shortName"
-YAHOO_UPDATE_COOLDOWN = environ.get("YAHOO_UPDATE_COOLDOWN", 60 * 5)
+YAHOO_UPDATE_COOLDOWN = int(environ.get("YAHOO_UPDATE_COOLDOWN", 60 * 5))
 YAHOO_UPDATE_DELTA = 60 * 60
-
-
-class YahooMarket(str, Enum):
-    ITALY = "Milan"
-    UK = "LSE"
-    EU = "XETRA"
-    USA_NASDAQ = "NasdaqGS"
-    USA_NYSE = "NYSE"
-    CANADA = "Toronto"
+YAHOO_QUOTE_BATCH_SIZE = int(environ.get("YAHOO_QUOTE_BATCH_SIZE", 50))
+# each symbol binds three parameters, keep batches below sqlite variables limit
+BULK_UPDATE_BATCH_SIZE = 300
+YAHOO_QUOTE_CACHE_SIZE = int(environ.get("YAHOO_QUOTE_CACHE_SIZE", 1024))
+YAHOO_QUOTE_CACHE_TTL = int(environ.get("YAHOO_QUOTE_CACHE_TTL", 60))
+YAHOO_COALESCE_WINDOW = float(environ.get("YAHOO_COALESCE_WINDOW", 0.01))
+HISTORY_PAGE_SIZE = int(environ.get("HISTORY_PAGE_SIZE", 100))
+HISTORY_MAX_PAGE_SIZE = int(environ.get("HISTORY_MAX_PAGE_SIZE", 1000))
 
 
 ITALIAN_TAX = Decimal("0.26")
@@ -97,42 +113,151 @@ TransactionRecords = Tuple[
     Decimal,  # transaction_ex_rate 16
 ]
 
+PositionRecords = Tuple[
+    int,  # stock_id 0
+    str,  # iso_currency 1
+    Decimal,  # last_rate 2
+    str,  # symbol 3
+    Decimal,  # last_price 4
+    str,  # market 5
+    str,  # bank 6
+    int,  # owner_id 7
+    str,  # financial_currency 8
+    str,  # short_name 9
+    int,  # quantity 10
+    Decimal,  # invested 11
+    Decimal,  # invested_converted 12
+]
 
-class YahooError(Exception):
-    pass
-
-
-async def get_yahoo_quote(symbols: List[str]) -> Dict[str, Any]:
-    async with ClientSession() as session:
-        async with session.get(
-            YAHOO_QUOTE_URL,
-            params={
-                "symbols": ",".join(symbols),
-                "fields": ",".join(
-                    [
-                        YAHOO_FIELD_PRICE,
-                        YAHOO_FIELD_CURRENCY,
-                        YAHOO_FIELD_MARKET,
-                        YAHOO_FIELD_NAME,
-                        YAHOO_FIELD_FINANCIAL_CURRENCY,
-                    ]
-                ),
-            },
-        ) as resp:
-            if resp.status != 200:
-                raise YahooError(f"yahoo answered with {resp.status} status")
-            response = await resp.json()
+
+YAHOO_QUOTE_CALLS = registry.register(
+    Counter(
+        "santaka_quote_calls_total",
+        "Calls to get_yahoo_quote, by outcome",
+        ("outcome",),
+    )
+)
+YAHOO_QUOTE_LATENCY = registry.register(
+    Histogram(
+        "santaka_quote_duration_seconds",
+        "Time spent in get_yahoo_quote, by outcome",
+        ("outcome",),
+    )
+)
+POSITION_SUMMARY_LATENCY = registry.register(
+    Histogram(
+        "santaka_position_summary_duration_seconds",
+        "Time to summarize the stock positions into traded stocks",
+    )
+)
+POSITION_SUMMARY_ROWS = registry.register(
+    Histogram(
+        "santaka_position_summary_rows",
+        "Stock positions summarized into traded stocks at once",
+        buckets=ROW_BUCKETS,
+    )
+)
+STOCK_PRICE_AGE = registry.register(
+    Gauge(
+        "santaka_stock_price_age_seconds",
+        "Age of the oldest price of the traded stocks, by market",
+        ("market",),
+    )
+)
+CURRENCY_RATE_AGE = registry.register(
+    Gauge(
+        "santaka_currency_rate_age_seconds",
+        "Age of the oldest exchange rate",
+    )
+)
+QUOTE_FETCHES = registry.register(
+    Counter(
+        "santaka_quote_fetches_total",
+        "Batched quote requests sent by the coalescer",
+    )
+)
+QUOTE_COALESCED = registry.register(
+    Counter(
+        "santaka_quote_coalesced_total",
+        "Quote lookups that joined a pending or in flight request",
+    )
+)
+
+quote_provider = create_quote_provider()
+quote_cache = TTLCache(YAHOO_QUOTE_CACHE_SIZE, YAHOO_QUOTE_CACHE_TTL)
+
+
+def split_in_batches(symbols: List[str], size: int) -> List[List[str]]:
+    batches = []
+    for start in range(0, len(symbols), size):
+        end = start + size
+        batches.append(symbols[start:end])
+    return batches
+
+
+async def request_quotes_in_batches(symbols: List[str]) -> Dict[str, Any]:
+    # the quote endpoint accepts a comma joined list of symbols but caps its length
+    responses = await asyncio.gather(
+        *[
+            quote_provider.get_quotes(batch)
+            for batch in split_in_batches(symbols, YAHOO_QUOTE_BATCH_SIZE)
+        ]
+    )
     quotes = {}
-    for quote in response["quoteResponse"]["result"]:
-        if quote[YAHOO_FIELD_MARKET] == YahooMarket.UK.value:
-            quote[YAHOO_FIELD_PRICE] = quote[YAHOO_FIELD_PRICE] / 100
-        quotes[quote["symbol"]] = quote
+    for response in responses:
+        quotes.update(response)
     return quotes
 
 
-async def call_yahoo_from_view(symbol: str):
+quote_coalescer = Coalescer(request_quotes_in_batches, YAHOO_COALESCE_WINDOW)
+
+
+async def update_quote_coalescer_counters():
+    QUOTE_FETCHES.set(quote_coalescer.fetches)
+    QUOTE_COALESCED.set(quote_coalescer.coalesced)
+
+
+registry.add_collector(update_quote_coalescer_counters)
+add_cache_collector("quotes", quote_cache)
+
+
+async def get_yahoo_quote(
+    symbols: List[str], bypass_cache: bool = False
+) -> Dict[str, Any]:
+    # outcome is cached when no symbol is requested to the provider, partial
+    # when the provider doesn't know some of them
+    start = perf_counter()
+    outcome = "error"
+    try:
+        quotes = {}
+        missing_symbols = []
+        for symbol in symbols:
+            quote = None
+            if not bypass_cache:
+                quote = quote_cache.get(symbol)
+            if quote is None:
+                missing_symbols.append(symbol)
+            else:
+                quotes[symbol] = quote
+        outcome = "cached"
+        if missing_symbols:
+            outcome = "error"
+            requested_quotes = await quote_coalescer.get_many(missing_symbols)
+            outcome = "ok"
+            if len(requested_quotes) < len(set(missing_symbols)):
+                outcome = "partial"
+            for symbol, quote in requested_quotes.items():
+                quote_cache.set(symbol, quote)
+            quotes.update(requested_quotes)
+        return quotes
+    finally:
+        YAHOO_QUOTE_CALLS.inc(outcome)
+        YAHOO_QUOTE_LATENCY.observe(perf_counter() - start, outcome)
+
+
+async def call_yahoo_from_view(symbol: str, bypass_cache: bool = False):
     try:
-        quotes = await get_yahoo_quote([symbol])
+        quotes = await get_yahoo_quote([symbol], bypass_cache)
     except YahooError:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -296,102 +421,264 @@ def get_active_markets(dt: datetime) -> List[str]:
     return markets
 
 
-@database.transaction()
+async def update_stock_prices(prices: Dict[str, Decimal], now: datetime):
+    # one UPDATE ... CASE statement per batch instead of one statement per symbol
+    symbols = list(prices)
+    price_changes = {}
+    for batch in split_in_batches(symbols, BULK_UPDATE_BATCH_SIZE):
+        query = select([stocks.c.stock_id, stocks.c.symbol, stocks.c.last_price]).where(
+            stocks.c.symbol.in_(batch)
+        )
+        for stock_id, symbol, old_price in await database.fetch_all(query):
+            new_price = Decimal(str(prices[symbol]))
+            if new_price != old_price:
+                price_changes[stock_id] = (old_price, new_price)
+        last_price = case(
+            {
+                symbol: literal(prices[symbol], stocks.c.last_price.type)
+                for symbol in batch
+            },
+            value=stocks.c.symbol,
+            else_=stocks.c.last_price,
+        )
+        query = (
+            stocks.update()
+            .values(last_price=last_price, last_update=now)
+            .where(stocks.c.symbol.in_(batch))
+        )
+        await database.execute(query)
+    if price_changes:
+        await refresh_crossed_alerts(price_changes)
+
+
+async def update_currency_rates(rates: Dict[str, Decimal], now: datetime):
+    symbols = list(rates)
+    for batch in split_in_batches(symbols, BULK_UPDATE_BATCH_SIZE):
+        last_rate = case(
+            {
+                symbol: literal(rates[symbol], currency.c.last_rate.type)
+                for symbol in batch
+            },
+            value=currency.c.symbol,
+            else_=currency.c.last_rate,
+        )
+        query = (
+            currency.update()
+            .values(last_rate=last_rate, last_update=now)
+            .where(currency.c.symbol.in_(batch))
+        )
+        await database.execute(query)
+
+
+def build_stale_stocks_query(
+    active_markets: List[str], stale_before: datetime
+) -> Select:
+    # traded stocks of the active markets not updated since stale_before
+    return (
+        select(
+            [
+                stocks.c.symbol,
+                currency.c.symbol,
+                stocks.c.stock_id,
+                currency.c.currency_id,
+            ]
+        )
+        .select_from(
+            stocks.join(currency, stocks.c.currency_id == currency.c.currency_id)
+        )
+        .where(stocks.c.market.in_(active_markets))
+        .where(stocks.c.last_update < stale_before)
+        .where(exists().where(stock_transactions.c.stock_id == stocks.c.stock_id))
+    )
+
+
 async def update_stocks():
     now = datetime.utcnow()
-    one_hour_before = now + timedelta(seconds=YAHOO_UPDATE_DELTA)
+    stale_before = now - timedelta(seconds=YAHOO_UPDATE_DELTA)
     active_markets = get_active_markets(now)
-    if active_markets:
-        query = (
-            select(
-                [
-                    stocks.c.symbol,
-                    currency.c.symbol,
-                    stocks.c.stock_id,
-                    currency.c.currency_id,
-                ]
-            )
-            .select_from(
-                stocks.join(
-                    currency, stocks.c.currency_id == currency.c.currency_id
-                ).join(
-                    stock_transactions, stocks.stock_id == stock_transactions.stock_id
-                )
-            )
-            .where(
-                stocks.c.market.in_(active_markets),
-            )
-            .where(stocks.c.last_update < one_hour_before)
-            .order_by(asc(stocks.c.last_update))
-            .distinct()
-        )
-        oldest_stock = await database.fetch_one(query)
-        if oldest_stock:
-            (
-                stock_symbol,
-                currency_symbol,
-                stock_id,
-                currency_id,
-            ) = oldest_stock
-            logger.info(
-                "trying to update %s stock and %s currency", stock_id, currency_id
-            )
-            quotes = await get_yahoo_quote([stock_symbol, currency_symbol])
-            if len(quotes) != 2:
-                raise YahooError(
-                    f"yahoo returned less quotes than requested: {quotes.keys()}"
-                )
-            query = (
-                stocks.update()
-                .values(
-                    last_price=quotes[stock_symbol][YAHOO_FIELD_PRICE],
-                    last_update=now,
-                )
-                .where(stocks.c.stock_id == stock_id)
-            )
-            await database.execute(query)
-            query = (
-                currency.update()
-                .values(
-                    last_rate=quotes[currency_symbol][YAHOO_FIELD_PRICE],
-                    last_update=now,
-                )
-                .where(currency.c.currency_id == currency_id)
-            )
-            await database.execute(query)
+    if not active_markets:
+        return
+    query = build_stale_stocks_query(active_markets, stale_before)
+    stale_stocks = await database.fetch_all(query)
+    if not stale_stocks:
+        return
+    symbols = []
+    for stock_symbol, currency_symbol, _, _ in stale_stocks:
+        symbols.append(stock_symbol)
+        if currency_symbol is not None:
+            symbols.append(currency_symbol)
+    symbols = list(dict.fromkeys(symbols))
+    logger.info("trying to update %d stale stocks", len(stale_stocks))
+    quotes = await get_yahoo_quote(symbols, bypass_cache=True)
+    missing_symbols = [symbol for symbol in symbols if symbol not in quotes]
+    if missing_symbols:
+        logger.warning("yahoo didn't return quotes for %s", missing_symbols)
+    stock_prices = {}
+    currency_rates = {}
+    for stock_symbol, currency_symbol, _, _ in stale_stocks:
+        if stock_symbol in quotes:
+            stock_prices[stock_symbol] = quotes[stock_symbol][YAHOO_FIELD_PRICE]
+        if currency_symbol in quotes:
+            currency_rates[currency_symbol] = quotes[currency_symbol][YAHOO_FIELD_PRICE]
+    # quotes are fetched before opening the transaction so that the write lock
+    # is held only for the time needed by the updates
+    async with database.transaction():
+        await update_stock_prices(stock_prices, now)
+        await update_currency_rates(currency_rates, now)
 
 
-@database.transaction()
 async def update_currency():
     now = datetime.utcnow()
-    one_hour_before = now + timedelta(seconds=YAHOO_UPDATE_DELTA)
-    timezoned_now = now.astimezone(DEFAULT_TRADING_TIMEZONE)
+    stale_before = now - timedelta(seconds=YAHOO_UPDATE_DELTA)
+    timezoned_now = utc.localize(now).astimezone(DEFAULT_TRADING_TIMEZONE)
     if timezoned_now.weekday() in (5, 6):
         return
     query = (
-        currency.select()
-        .where(
-            currency.c.last_update < one_hour_before,
-        )
-        .order_by(asc(currency.c.last_update))
-    )
-    oldest_currency = await database.fetch_one(query)
-    if oldest_currency:
-        logger.info("trying to update %d currency", oldest_currency.currency_id)
-        quotes = await get_yahoo_quote([oldest_currency.symbol])
-        if currency.symbol not in quotes:
-            raise YahooError(
-                "yahoo failed to return the quote for %s", oldest_currency.symbol
-            )
-        query = (
-            currency.update()
-            .values(
-                last_rate=quotes[currency.symbol][YAHOO_FIELD_PRICE],
-                last_update=now,
-            )
-            .where(currency.c.currency_id == oldest_currency.currency_id)
+        select([currency.c.symbol])
+        .where(currency.c.symbol.isnot(None))
+        .where(currency.c.last_update < stale_before)
+    )
+    stale_currencies = await database.fetch_all(query)
+    if not stale_currencies:
+        return
+    symbols = [record.symbol for record in stale_currencies]
+    logger.info("trying to update %d stale currencies", len(symbols))
+    quotes = await get_yahoo_quote(symbols, bypass_cache=True)
+    missing_symbols = [symbol for symbol in symbols if symbol not in quotes]
+    if missing_symbols:
+        logger.warning("yahoo didn't return quotes for %s", missing_symbols)
+    currency_rates = {}
+    for symbol in quotes:
+        currency_rates[symbol] = quotes[symbol][YAHOO_FIELD_PRICE]
+    async with database.transaction():
+        await update_currency_rates(currency_rates, now)
+
+
+def build_price_age_queries() -> Tuple[Select, Select]:
+    # the same stocks and currencies that update_stocks and update_currency
+    # keep up to date
+    stock_query = (
+        select([stocks.c.market, func.min(stocks.c.last_update)])
+        .where(exists().where(stock_transactions.c.stock_id == stocks.c.stock_id))
+        .group_by(stocks.c.market)
+    )
+    currency_query = select([func.min(currency.c.last_update)]).where(
+        currency.c.symbol.isnot(None)
+    )
+    return stock_query, currency_query
+
+
+async def update_price_age_gauges():
+    now = datetime.utcnow()
+    stock_query, currency_query = build_price_age_queries()
+    STOCK_PRICE_AGE.clear()
+    for market, last_update in await database.fetch_all(stock_query):
+        STOCK_PRICE_AGE.set((now - last_update).total_seconds(), market)
+    last_update = await database.fetch_val(currency_query)
+    if last_update is not None:
+        CURRENCY_RATE_AGE.set((now - last_update).total_seconds())
+
+
+registry.add_collector(update_price_age_gauges)
+
+
+def summarize_traded_stock(
+    record: PositionRecords,
+    current_quantity: int,
+    fiscal_price: Decimal,
+    fiscal_price_converted: Decimal,
+) -> TradedStock:
+    # only the stock fields of the record (indexes 0 to 9) are used
+    bank = record[6]
+    market = record[5]
+    last_price = record[4]
+    financial_currency = record[8]
+    last_rate = record[2]
+    last_price_converted = last_price / last_rate
+    profit_and_loss = 0
+    invested = 0
+    current_ctv = 0
+    current_ctv_converted = 0
+    profit_and_loss_converted = 0
+    invested_converted = 0
+    if current_quantity > 0:  # FIXME use fiscal price split aware quantity
+        commission = calculate_commission(
+            bank,
+            market,
+            last_price,
+            current_quantity,
+            financial_currency,
         )
-        await database.execute(query)
+        commission_converted = commission / last_rate
+        sell_tax = calculate_sell_tax(
+            market,
+            fiscal_price,
+            last_price,
+            current_quantity,
+        )
+        sell_tax_converted = calculate_sell_tax(
+            market,
+            fiscal_price_converted,
+            last_price_converted,
+            current_quantity,
+        )
+        profit_and_loss = calculate_profit_and_loss(
+            fiscal_price,
+            last_price,
+            sell_tax,
+            commission,
+            current_quantity,
+        )
+        profit_and_loss_converted = calculate_profit_and_loss(
+            fiscal_price_converted,
+            last_price_converted,
+            sell_tax_converted,
+            commission_converted,
+            current_quantity,
+        )
+        current_ctv, current_ctv_converted = calculate_ctvs(
+            last_price,
+            last_rate,
+            current_quantity,
+        )
+        invested, invested_converted = calculate_invested(
+            fiscal_price,
+            fiscal_price_converted,
+            current_quantity,
+        )
+    return {
+        "stock_id": record[0],
+        "iso_currency": record[1],
+        "symbol": record[3],
+        "last_price": last_price,
+        "market": market,
+        "fiscal_price": fiscal_price,
+        "profit_and_loss": profit_and_loss,
+        "owner_id": record[7],
+        "current_quantity": current_quantity,
+        "invested": invested,
+        "current_ctv": current_ctv,
+        "current_ctv_converted": current_ctv_converted,
+        "short_name": record[9],
+        "fiscal_price_converted": fiscal_price_converted,
+        "profit_and_loss_converted": profit_and_loss_converted,
+        "invested_converted": invested_converted,
+    }
+
+
+def get_stock_fields(record: TransactionRecords) -> PositionRecords:
+    return (
+        record[0],
+        record[1],
+        record[2],
+        record[3],
+        record[4],
+        record[5],
+        record[12],
+        record[13],
+        record[14],
+        record[15],
+    )
 
 
 def prepare_traded_stocks(
@@ -409,88 +696,19 @@ def prepare_traded_stocks(
     for i, record in enumerate(transaction_records):
         if previous_stock_id != record[0]:
             previous_stock_id = record[0]
-            previous_record = transaction_records[i - 1]
-            bank = previous_record[12]
-            market = previous_record[5]
-            last_price = previous_record[4]
-            financial_currency = previous_record[14]
-            last_rate = previous_record[2]
-            last_price_converted = last_price / last_rate
             fiscal_price = 0
             fiscal_price_converted = 0
-            profit_and_loss = 0
-            invested = 0
-            current_ctv = 0
-            current_ctv_converted = 0
-            profit_and_loss_converted = 0
-            invested_converted = 0
-            if current_quantity > 0:  # FIXME use fiscal price split aware quantity
+            if current_quantity > 0:
                 fiscal_price, fiscal_price_converted = calculate_fiscal_price(
                     current_transactions
                 )
-                commission = calculate_commission(
-                    bank,
-                    market,
-                    last_price,
-                    current_quantity,
-                    financial_currency,
-                )
-                commission_converted = commission / last_rate
-                sell_tax = calculate_sell_tax(
-                    market,
-                    fiscal_price,
-                    last_price,
-                    current_quantity,
-                )
-                sell_tax_converted = calculate_sell_tax(
-                    market,
-                    fiscal_price_converted,
-                    last_price_converted,
-                    current_quantity,
-                )
-                profit_and_loss = calculate_profit_and_loss(
-                    fiscal_price,
-                    last_price,
-                    sell_tax,
-                    commission,
-                    current_quantity,
-                )
-                profit_and_loss_converted = calculate_profit_and_loss(
-                    fiscal_price_converted,
-                    last_price_converted,
-                    sell_tax_converted,
-                    commission_converted,
-                    current_quantity,
-                )
-                current_ctv, current_ctv_converted = calculate_ctvs(
-                    last_price,
-                    last_rate,
+            traded_stocks.append(
+                summarize_traded_stock(
+                    get_stock_fields(transaction_records[i - 1]),
                     current_quantity,
-                )
-                invested, invested_converted = calculate_invested(
                     fiscal_price,
                     fiscal_price_converted,
-                    current_quantity,
                 )
-            traded_stocks.append(
-                {
-                    "stock_id": previous_record[0],
-                    "iso_currency": previous_record[1],
-                    "symbol": previous_record[3],
-                    "last_price": last_price,
-                    "market": market,
-                    "fiscal_price": fiscal_price,
-                    "profit_and_loss": profit_and_loss,
-                    "owner_id": previous_record[13],
-                    "current_quantity": current_quantity,
-                    "invested": invested,
-                    "current_ctv": current_ctv,
-                    "current_ctv_converted": current_ctv_converted,
-                    "short_name": previous_record[15],
-                    "fiscal_price_converted": fiscal_price_converted,
-                    "profit_and_loss_converted": profit_and_loss_converted,
-                    "invested_converted": invested_converted,
-                }
             )
             # here we are resetting the tax and qty to zero
             # and transactions to empty list for the next group of transactions
@@ -514,10 +732,61 @@ def prepare_traded_stocks(
     return traded_stocks
 
 
-async def get_transaction_records(
+def encode_history_cursor(date: datetime, stock_transaction_id: int) -> str:
+    cursor = f"{date.isoformat()}|{stock_transaction_id}"
+    return urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        date, stock_transaction_id = urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(date), int(stock_transaction_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid cursor {cursor}",
+        )
+
+
+def build_transaction_history_query(
+    owner_id: int,
+    stock_id: int,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Select:
+    # newest first, after is the date and id of the last transaction of the
+    # previous page: every page is a range scan of the owner_id, stock_id,
+    # date, stock_transaction_id index however long the history is
+    query = (
+        stock_transactions.select()
+        .where(stock_transactions.c.owner_id == owner_id)
+        .where(stock_transactions.c.stock_id == stock_id)
+    )
+    if from_date is not None:
+        query = query.where(stock_transactions.c.date >= from_date)
+    if to_date is not None:
+        query = query.where(stock_transactions.c.date < to_date)
+    if after is not None:
+        query = query.where(
+            tuple_(stock_transactions.c.date, stock_transactions.c.stock_transaction_id)
+            < tuple_(
+                # typed like the columns, the tuple binds would skip NaiveDateTime
+                literal(after[0], stock_transactions.c.date.type),
+                literal(after[1], stock_transactions.c.stock_transaction_id.type),
+            )
+        )
+    return query.order_by(
+        stock_transactions.c.date.desc(),
+        stock_transactions.c.stock_transaction_id.desc(),
+    ).limit(limit)
+
+
+def build_transaction_records_query(
     owner_ids: List[int],
     stock_id: Optional[int] = None,
-) -> List[TransactionRecords]:
+) -> Select:
     query = (
         select(
             [
@@ -555,8 +824,294 @@ async def get_transaction_records(
         )
     )
     if stock_id is not None:
-        query = query.where(stocks.c.stock_id == stock_id)
-    return await database.fetch_all(query)
+        query = query.where(stock_transactions.c.stock_id == stock_id)
+    return query
+
+
+async def get_transaction_records(
+    owner_ids: List[int],
+    stock_id: Optional[int] = None,
+) -> List[TransactionRecords]:
+    return await database.fetch_all(
+        build_transaction_records_query(owner_ids, stock_id)
+    )
+
+
+@POSITION_SUMMARY_LATENCY.timed()
+def prepare_traded_stocks_from_positions(
+    position_records: List[PositionRecords],
+) -> List[TradedStock]:
+    POSITION_SUMMARY_ROWS.observe(len(position_records))
+    traded_stocks = []
+    for record in position_records:
+        quantity = record[10]
+        fiscal_price = 0
+        fiscal_price_converted = 0
+        if quantity > 0:
+            fiscal_price = record[11] / quantity
+            fiscal_price_converted = record[12] / quantity
+        traded_stocks.append(
+            summarize_traded_stock(
+                record, quantity, fiscal_price, fiscal_price_converted
+            )
+        )
+    return traded_stocks
+
+
+def build_position_records_query(
+    owner_ids: List[int],
+    stock_id: Optional[int] = None,
+) -> Select:
+    query = (
+        select(
+            [
+                stocks.c.stock_id,
+                currency.c.iso_currency,
+                currency.c.last_rate,
+                stocks.c.symbol,
+                stocks.c.last_price,
+                stocks.c.market,
+                accounts.c.bank,
+                owners.c.owner_id,
+                stocks.c.financial_currency,
+                stocks.c.short_name,
+                stock_positions.c.quantity,
+                stock_positions.c.invested,
+                stock_positions.c.invested_converted,
+            ]
+        )
+        .select_from(
+            stock_positions.join(
+                stocks, stock_positions.c.stock_id == stocks.c.stock_id
+            )
+            .join(currency, currency.c.currency_id == stocks.c.currency_id)
+            .join(owners, stock_positions.c.owner_id == owners.c.owner_id)
+            .join(accounts, owners.c.account_id == accounts.c.account_id)
+        )
+        .where(stock_positions.c.owner_id.in_(owner_ids))
+        .order_by(stocks.c.stock_id)
+    )
+    if stock_id is not None:
+        query = query.where(stock_positions.c.stock_id == stock_id)
+    return query
+
+
+async def get_position_records(
+    owner_ids: List[int],
+    stock_id: Optional[int] = None,
+) -> List[PositionRecords]:
+    return await database.fetch_all(build_position_records_query(owner_ids, stock_id))
+
+
+async def bump_owner_revisions(owner_ids: Union[List[int], Select]):
+    # a select is run as a subquery, a list is split in batches
+    batches = [owner_ids]
+    if not isinstance(owner_ids, Select):
+        batches = split_in_batches(owner_ids, BULK_UPDATE_BATCH_SIZE)
+    for batch in batches:
+        query = (
+            owners.update()
+            .where(owners.c.owner_id.in_(batch))
+            .values(revision=func.coalesce(owners.c.revision, 0) + 1)
+        )
+        await database.execute(query)
+
+
+def build_owners_version_query(owner_ids: List[int], now: datetime) -> Select:
+    # every change to the traded stocks, the alerts or the accounts summary of
+    # the owners changes one of these values: their revisions, the last update
+    # of the prices and of the rates of the stocks they hold and the alerts
+    # whose dividend date has passed, since those trigger without any write
+    held_stocks = stock_positions.join(
+        stocks, stock_positions.c.stock_id == stocks.c.stock_id
+    ).join(currency, currency.c.currency_id == stocks.c.currency_id)
+    return select(
+        [
+            select([func.sum(func.coalesce(owners.c.revision, 0))])
+            .where(owners.c.owner_id.in_(owner_ids))
+            .as_scalar(),
+            select([func.max(stocks.c.last_update)])
+            .select_from(held_stocks)
+            .where(stock_positions.c.owner_id.in_(owner_ids))
+            .as_scalar(),
+            select([func.max(currency.c.last_update)])
+            .select_from(held_stocks)
+            .where(stock_positions.c.owner_id.in_(owner_ids))
+            .as_scalar(),
+            select([func.count()])
+            .select_from(stock_alerts)
+            .where(stock_alerts.c.owner_id.in_(owner_ids))
+            .where(stock_alerts.c.dividend_date <= now)
+            .as_scalar(),
+        ]
+    )
+
+
+async def get_owners_version(owner_ids: List[int]) -> Tuple[Any, ...]:
+    record = await database.fetch_one(
+        build_owners_version_query(owner_ids, datetime.utcnow())
+    )
+    return tuple(record[i] for i in range(4))
+
+
+async def replay_stock_position(owner_id: int, stock_id: int):
+    query = (
+        select(
+            [
+                stock_transactions.c.transaction_type,
+                stock_transactions.c.quantity,
+                stock_transactions.c.price,
+                stock_transactions.c.commission,
+                stock_transactions.c.transaction_ex_rate,
+                stock_transactions.c.date,
+            ]
+        )
+        .where(stock_transactions.c.owner_id == owner_id)
+        .where(stock_transactions.c.stock_id == stock_id)
+        .order_by(stock_transactions.c.date)
+    )
+    records = await database.fetch_all(query)
+    query = (
+        stock_positions.delete()
+        .where(stock_positions.c.owner_id == owner_id)
+        .where(stock_positions.c.stock_id == stock_id)
+    )
+    await database.execute(query)
+    await bump_owner_revisions([owner_id])
+    if not records:
+        return
+    quantity, invested, invested_converted = 0, Decimal("0"), Decimal("0")
+    for record in records:
+        quantity, invested, invested_converted = calculate_position_change(
+            quantity, invested, invested_converted, *record[:5]
+        )
+    query = stock_positions.insert().values(
+        owner_id=owner_id,
+        stock_id=stock_id,
+        quantity=quantity,
+        invested=invested,
+        invested_converted=invested_converted,
+        last_transaction_date=records[-1].date,
+    )
+    await database.execute(query)
+    await refresh_stock_alerts(
+        stock_alerts.select()
+        .where(stock_alerts.c.owner_id == owner_id)
+        .where(stock_alerts.c.stock_id == stock_id)
+    )
+
+
+async def apply_stock_transaction(
+    owner_id: int, stock_id: int, transaction: Transaction
+):
+    # transactions appended in date order update the position incrementally,
+    # the ones inserted before the latest transaction need a full replay
+    query = (
+        stock_positions.select()
+        .where(stock_positions.c.owner_id == owner_id)
+        .where(stock_positions.c.stock_id == stock_id)
+    )
+    position = await database.fetch_one(query)
+    # the datetime column doesn't keep the timezone
+    date = transaction.date.replace(tzinfo=None)
+    if position is not None and date < position.last_transaction_date:
+        await replay_stock_position(owner_id, stock_id)
+        return
+    exchange_rate = 1
+    if transaction.transaction_ex_rate is not None:
+        exchange_rate = transaction.transaction_ex_rate
+    quantity, invested, invested_converted = 0, Decimal("0"), Decimal("0")
+    if position is not None:
+        quantity = position.quantity
+        invested = position.invested
+        invested_converted = position.invested_converted
+    quantity, invested, invested_converted = calculate_position_change(
+        quantity,
+        invested,
+        invested_converted,
+        transaction.transaction_type,
+        transaction.quantity,
+        transaction.price,
+        transaction.commission,
+        exchange_rate,
+    )
+    values = {
+        "quantity": quantity,
+        "invested": invested,
+        "invested_converted": invested_converted,
+        "last_transaction_date": date,
+    }
+    if position is None:
+        query = stock_positions.insert().values(
+            owner_id=owner_id, stock_id=stock_id, **values
+        )
+    else:
+        query = (
+            stock_positions.update()
+            .where(stock_positions.c.owner_id == owner_id)
+            .where(stock_positions.c.stock_id == stock_id)
+            .values(**values)
+        )
+    await database.execute(query)
+    await bump_owner_revisions([owner_id])
+    await refresh_stock_alerts(
+        stock_alerts.select()
+        .where(stock_alerts.c.owner_id == owner_id)
+        .where(stock_alerts.c.stock_id == stock_id)
+    )
+
+
+@database.transaction()
+async def rebuild_positions():
+    query = select(
+        [
+            stock_transactions.c.owner_id,
+            stock_transactions.c.stock_id,
+            stock_transactions.c.transaction_type,
+            stock_transactions.c.quantity,
+            stock_transactions.c.price,
+            stock_transactions.c.commission,
+            stock_transactions.c.transaction_ex_rate,
+            stock_transactions.c.date,
+        ]
+    ).order_by(
+        stock_transactions.c.owner_id,
+        stock_transactions.c.stock_id,
+        stock_transactions.c.date,
+    )
+    positions = {}
+    async for record in database.iterate(query):
+        key = (record[0], record[1])
+        position = positions.get(key, (0, Decimal("0"), Decimal("0"), None))
+        positions[key] = calculate_position_change(*position[:3], *record[2:7]) + (
+            record[7],
+        )
+    await database.execute(stock_positions.delete())
+    values = []
+    for (owner_id, stock_id), position in positions.items():
+        quantity, invested, invested_converted, last_transaction_date = position
+        values.append(
+            {
+                "owner_id": owner_id,
+                "stock_id": stock_id,
+                "quantity": quantity,
+                "invested": invested,
+                "invested_converted": invested_converted,
+                "last_transaction_date": last_transaction_date,
+            }
+        )
+    if values:
+        await database.execute_many(stock_positions.insert(), values)
+    await bump_owner_revisions(select([stock_positions.c.owner_id]))
+    await refresh_all_stock_alerts()
+    logger.info("rebuilt %d stock positions", len(values))
+
+
+async def initialize_positions():
+    # databases created before the stock_positions table need a first rebuild
+    query = select([stock_positions.c.owner_id]).limit(1)
+    if await database.fetch_one(query) is None:
+        await rebuild_positions()
 
 
 def check_dividend_date(dividend_date: datetime) -> bool:
@@ -587,77 +1142,245 @@ def check_profit_and_loss_lower_limit(limit: Decimal, profit_and_loss: Decimal)
     return profit_and_loss < limit
 
 
+def build_stock_alerts_query(
+    owner_ids: Optional[List[int]] = None,
+    stock_id: Optional[int] = None,
+) -> Select:
+    # only the alerts of traded stocks are shown
+    query = select([stock_alerts]).select_from(
+        stock_alerts.join(
+            stock_positions,
+            and_(
+                stock_alerts.c.owner_id == stock_positions.c.owner_id,
+                stock_alerts.c.stock_id == stock_positions.c.stock_id,
+            ),
+        )
+    )
+    if owner_ids is not None:
+        query = query.where(stock_alerts.c.owner_id.in_(owner_ids))
+    if stock_id is not None:
+        query = query.where(stock_alerts.c.stock_id == stock_id)
+    return query
+
+
+def parse_triggered_fields(triggered_fields: Optional[str]) -> List[AlertFields]:
+    if not triggered_fields:
+        return []
+    return [AlertFields(field) for field in triggered_fields.split(",")]
+
+
+def summarize_stock_alert(alert: Any) -> StockAlert:
+    # the triggered fields are evaluated when prices and positions change, the
+    # dividend date depends only on the current time so it's checked here
+    triggered_fields = parse_triggered_fields(alert.triggered_fields)
+    if alert.dividend_date is not None and check_dividend_date(alert.dividend_date):
+        triggered_fields.append(AlertFields.DIVIDEND_DATE)
+    # keep the fields in declaration order
+    triggered_fields = [field for field in AlertFields if field in triggered_fields]
+    return {
+        "stock_id": alert.stock_id,
+        "owner_id": alert.owner_id,
+        "lower_limit_price": alert.lower_limit_price,
+        "upper_limit_price": alert.upper_limit_price,
+        "dividend_date": alert.dividend_date,
+        "fiscal_price_lower_than": alert.fiscal_price_lower_than,
+        "fiscal_price_greater_than": alert.fiscal_price_greater_than,
+        "profit_and_loss_lower_limit": alert.profit_and_loss_lower_limit,
+        "profit_and_loss_upper_limit": alert.profit_and_loss_upper_limit,
+        "stock_alert_id": alert.stock_alert_id,
+        "triggered_fields": triggered_fields,
+    }
+
+
 async def check_stock_alerts(
     stock_id: Optional[int] = None,
     owner_id: Optional[int] = None,
 ) -> List[StockAlert]:
-    query = stock_alerts.select()
-    if stock_id is not None:
-        query = query.where(stock_alerts.c.stock_id == stock_id)
+    owner_ids = None
     if owner_id is not None:
-        query = query.where(stock_alerts.c.owner_id == owner_id)
-    alert_records = await database.fetch_all(query)
-    indexed_alerts = {}
-    owner_ids = []
+        owner_ids = [owner_id]
+    alert_records = await database.fetch_all(
+        build_stock_alerts_query(owner_ids, stock_id)
+    )
+    return [summarize_stock_alert(alert) for alert in alert_records]
+
+
+def evaluate_stock_alert(alert: Any, stock: TradedStock) -> List[AlertFields]:
+    # every condition but the dividend date, see summarize_stock_alert
+    triggered_fields = []
+    if alert.lower_limit_price is not None and check_lower_limit_price(
+        stock["last_price"], alert.lower_limit_price
+    ):
+        triggered_fields.append(AlertFields.LOWER_LIMIT_PRICE)
+    if alert.upper_limit_price is not None and check_upper_limit_price(
+        stock["last_price"], alert.upper_limit_price
+    ):
+        triggered_fields.append(AlertFields.UPPER_LIMIT_PRICE)
+    if alert.fiscal_price_lower_than and check_fiscal_price_lower_than(
+        stock["last_price"], stock["fiscal_price"]
+    ):
+        triggered_fields.append(AlertFields.FISCAL_PRICE_LOWER_THAN)
+    if alert.fiscal_price_greater_than and check_fiscal_price_greater_than(
+        stock["last_price"], stock["fiscal_price"]
+    ):
+        triggered_fields.append(AlertFields.FISCAL_PRICE_GREATER_THAN)
+    if (
+        alert.profit_and_loss_lower_limit is not None
+        and check_profit_and_loss_lower_limit(
+            alert.profit_and_loss_lower_limit, stock["profit_and_loss"]
+        )
+    ):
+        triggered_fields.append(AlertFields.PROFIT_AND_LOSS_LOWER_LIMIT)
+    if (
+        alert.profit_and_loss_upper_limit is not None
+        and check_profit_and_loss_upper_limit(
+            alert.profit_and_loss_upper_limit, stock["profit_and_loss"]
+        )
+    ):
+        triggered_fields.append(AlertFields.PROFIT_AND_LOSS_UPPER_LIMIT)
+    return triggered_fields
+
+
+async def refresh_stock_alerts(query: Select):
+    # evaluates the alerts selected by query and stores the triggered fields
+    # of the ones whose state changed
+    await evaluate_stock_alerts(await database.fetch_all(query))
+
+
+async def evaluate_stock_alerts(alert_records: List[Any]):
+    # the alerts are evaluated a batch of owners at a time, so that every query
+    # binds at most BULK_UPDATE_BATCH_SIZE owners
+    alerts_by_owner: Dict[int, List[Any]] = {}
     for alert in alert_records:
-        indexed_alerts[(alert.owner_id, alert.stock_id)] = alert
-        owner_ids.append(alert.owner_id)
-    transaction_records = await get_transaction_records(owner_ids, stock_id)
-    traded_stocks = prepare_traded_stocks(transaction_records)
-    alerts = []
-    for stock in traded_stocks:
-        alert = indexed_alerts.get((stock["owner_id"], stock["stock_id"]))
-        if alert is None:
-            continue
-        triggered_fields = []
-        if alert.lower_limit_price is not None and check_lower_limit_price(
-            stock["last_price"], alert.lower_limit_price
-        ):
-            triggered_fields.append(AlertFields.LOWER_LIMIT_PRICE)
-        if alert.upper_limit_price is not None and check_upper_limit_price(
-            stock["last_price"], alert.upper_limit_price
-        ):
-            triggered_fields.append(AlertFields.UPPER_LIMIT_PRICE)
-        if alert.dividend_date is not None and check_dividend_date(alert.dividend_date):
-            triggered_fields.append(AlertFields.DIVIDEND_DATE)
-        if alert.fiscal_price_lower_than and check_fiscal_price_lower_than(
-            stock["last_price"], stock["fiscal_price"]
-        ):
-            triggered_fields.append(AlertFields.FISCAL_PRICE_LOWER_THAN)
-        if alert.fiscal_price_greater_than and check_fiscal_price_greater_than(
-            stock["last_price"], stock["fiscal_price"]
-        ):
-            triggered_fields.append(AlertFields.FISCAL_PRICE_GREATER_THAN)
-        if (
-            alert.profit_and_loss_lower_limit is not None
-            and check_profit_and_loss_lower_limit(
-                alert.profit_and_loss_lower_limit, stock["profit_and_loss"]
-            )
-        ):
-            triggered_fields.append(AlertFields.PROFIT_AND_LOSS_LOWER_LIMIT)
-        if (
-            alert.profit_and_loss_upper_limit is not None
-            and check_profit_and_loss_upper_limit(
-                alert.profit_and_loss_upper_limit, stock["profit_and_loss"]
+        alerts_by_owner.setdefault(alert.owner_id, []).append(alert)
+    for owner_ids in split_in_batches(list(alerts_by_owner), BULK_UPDATE_BATCH_SIZE):
+        alerts = [
+            alert for owner_id in owner_ids for alert in alerts_by_owner[owner_id]
+        ]
+        query = build_position_records_query(owner_ids)
+        stock_ids = list({alert.stock_id for alert in alerts})
+        # a few stocks, like the ones of a single transaction, are looked up
+        # directly instead of reading every position of the owners
+        if len(stock_ids) <= BULK_UPDATE_BATCH_SIZE:
+            query = query.where(stock_positions.c.stock_id.in_(stock_ids))
+        traded_stocks = {
+            (stock["owner_id"], stock["stock_id"]): stock
+            for stock in prepare_traded_stocks_from_positions(
+                await database.fetch_all(query)
             )
-        ):
-            triggered_fields.append(AlertFields.PROFIT_AND_LOSS_UPPER_LIMIT)
-        alerts.append(
-            {
-                "stock_id": alert.stock_id,
-                "owner_id": alert.owner_id,
-                "lower_limit_price": alert.lower_limit_price,
-                "upper_limit_price": alert.upper_limit_price,
-                "dividend_date": alert.dividend_date,
-                "fiscal_price_lower_than": alert.fiscal_price_lower_than,
-                "fiscal_price_greater_than": alert.fiscal_price_greater_than,
-                "profit_and_loss_lower_limit": alert.profit_and_loss_lower_limit,
-                "profit_and_loss_upper_limit": alert.profit_and_loss_upper_limit,
-                "stock_alert_id": alert.stock_alert_id,
-                "triggered_fields": triggered_fields,
-            }
+        }
+        await store_triggered_fields(alerts, traded_stocks)
+
+
+async def store_triggered_fields(
+    alert_records: List[Any], traded_stocks: Dict[Tuple[int, int], TradedStock]
+):
+    changes = {}
+    changed_owner_ids = set()
+    for alert in alert_records:
+        stock = traded_stocks.get((alert.owner_id, alert.stock_id))
+        triggered_fields = []
+        if stock is not None:
+            triggered_fields = evaluate_stock_alert(alert, stock)
+        value = ",".join(field.value for field in triggered_fields)
+        if value != alert.triggered_fields:
+            changes[alert.stock_alert_id] = value
+            changed_owner_ids.add(alert.owner_id)
+    stock_alert_ids = list(changes)
+    for batch in split_in_batches(stock_alert_ids, BULK_UPDATE_BATCH_SIZE):
+        triggered_fields = case(
+            {stock_alert_id: changes[stock_alert_id] for stock_alert_id in batch},
+            value=stock_alerts.c.stock_alert_id,
+        )
+        query = (
+            stock_alerts.update()
+            .values(triggered_fields=triggered_fields)
+            .where(stock_alerts.c.stock_alert_id.in_(batch))
         )
-    return alerts
+        await database.execute(query)
+    if changed_owner_ids:
+        await bump_owner_revisions(list(changed_owner_ids))
+
+
+def build_alert_owners_query(after: Optional[int], *conditions: Any) -> Select:
+    # the next page of owners having alerts that match conditions
+    query = (
+        select([stock_alerts.c.owner_id])
+        .distinct()
+        .order_by(stock_alerts.c.owner_id)
+        .limit(BULK_UPDATE_BATCH_SIZE)
+    )
+    if after is not None:
+        query = query.where(stock_alerts.c.owner_id > after)
+    for condition in conditions:
+        query = query.where(condition)
+    return query
+
+
+async def refresh_all_stock_alerts(*conditions: Any):
+    # every alert matching conditions, a page of owners at a time: only the
+    # alerts and the positions of one page are in memory
+    after = None
+    while True:
+        query = build_alert_owners_query(after, *conditions)
+        owner_ids = [record[0] for record in await database.fetch_all(query)]
+        if not owner_ids:
+            return
+        query = stock_alerts.select().where(stock_alerts.c.owner_id.in_(owner_ids))
+        for condition in conditions:
+            query = query.where(condition)
+        await refresh_stock_alerts(query)
+        after = owner_ids[-1]
+
+
+def check_alert_crossed(alert: Any, old_price: Decimal, new_price: Decimal) -> bool:
+    # the lower limit triggers when price <= limit and the upper one when
+    # price > limit: both change state only for limits in [low, high). Alerts
+    # on fiscal price or profit and loss depend on the position too, every
+    # price move of their stock has to re-evaluate them
+    if (
+        alert.fiscal_price_lower_than
+        or alert.fiscal_price_greater_than
+        or alert.profit_and_loss_lower_limit is not None
+        or alert.profit_and_loss_upper_limit is not None
+    ):
+        return True
+    low, high = sorted((old_price, new_price))
+    return any(
+        limit is not None and low <= limit < high
+        for limit in (alert.lower_limit_price, alert.upper_limit_price)
+    )
+
+
+def build_stock_alerts_of_stocks_query(stock_ids: List[int]) -> Select:
+    return stock_alerts.select().where(stock_alerts.c.stock_id.in_(stock_ids))
+
+
+async def refresh_crossed_alerts(price_changes: Dict[int, Tuple[Decimal, Decimal]]):
+    # price_changes maps the stock ids to their old and new price. The alerts
+    # are written by every api worker, they are read at every price change
+    # so that the ones just created or edited by another process are included
+    crossed_alerts = []
+    for batch in split_in_batches(list(price_changes), BULK_UPDATE_BATCH_SIZE):
+        query = build_stock_alerts_of_stocks_query(batch)
+        for alert in await database.fetch_all(query):
+            if check_alert_crossed(alert, *price_changes[alert.stock_id]):
+                crossed_alerts.append(alert)
+    await evaluate_stock_alerts(crossed_alerts)
+
+
+async def sync_stock_alert(stock_alert_id: int):
+    # called after an alert is created or updated
+    query = stock_alerts.select().where(stock_alerts.c.stock_alert_id == stock_alert_id)
+    alert = await database.fetch_one(query)
+    await bump_owner_revisions([alert.owner_id])
+    await refresh_stock_alerts(query)
+
+
+async def initialize_alerts():
+    # alerts never evaluated, like the ones created before triggered_fields
+    # was persisted, are evaluated at startup
+    await refresh_all_stock_alerts(stock_alerts.c.triggered_fields.is_(None))
 
 
 async def get_stock_records(*symbols: str):
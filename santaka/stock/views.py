@@ -1,7 +1,18 @@
 from datetime import datetime
+from typing import Optional
 from santaka.analytics import calculate_stock_totals
 
-from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi import (
+    status,
+    HTTPException,
+    Depends,
+    APIRouter,
+    Header,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
 from sqlalchemy.sql import select
 
 from santaka.db import (
@@ -9,15 +20,21 @@ from santaka.db import (
     stocks,
     currency,
     stock_transactions,
-    create_random_id,
+    create_id,
     stock_alerts,
+    stock_positions,
     users,
     accounts,
     owners,
 )
+from santaka.responses import fast_response, get_not_modified_response, make_etag
 from santaka.user import User, get_current_user
 from santaka.account.utils import get_owner
+from santaka.stock.exports import iterate_statement
+from santaka.stock.imports import import_stock_transactions
 from santaka.stock.models import (
+    ImportedStockTransactions,
+    StatementFormat,
     NewStock,
     NewStockAlert,
     DetailedStock,
@@ -43,14 +60,26 @@ from santaka.stock.models import (
     Currencies,
 )
 from santaka.stock.utils import (
+    HISTORY_MAX_PAGE_SIZE,
+    HISTORY_PAGE_SIZE,
     YAHOO_FIELD_FINANCIAL_CURRENCY,
+    bump_owner_revisions,
+    build_transaction_history_query,
     call_yahoo_from_view,
+    decode_history_cursor,
+    encode_history_cursor,
     get_alert_or_raise,
+    get_owners_version,
     get_stock_records,
     get_yahoo_quote,
+    update_currency_rates,
+    update_stock_prices,
     validate_stock_transaction,
-    prepare_traded_stocks,
-    get_transaction_records,
+    prepare_traded_stocks_from_positions,
+    get_position_records,
+    apply_stock_transaction,
+    replay_stock_position,
+    sync_stock_alert,
     check_stock_alerts,
     YAHOO_FIELD_CURRENCY,
     YAHOO_FIELD_MARKET,
@@ -62,7 +91,6 @@ router = APIRouter(prefix="/stock", tags=["stock"])
 
 
 @router.put("/", response_model=DetailedStock)
-@database.transaction()
 async def create_stock(new_stock: NewStock, user: User = Depends(get_current_user)):
     # query the database to check if stock already exists
     stock_symbol = new_stock.symbol.upper()
@@ -73,56 +101,66 @@ async def create_stock(new_stock: NewStock, user: User = Depends(get_current_use
 
     if not stock_records:
         # stock not found in the database, calling yahoo to get stock info
+        # before the transaction opens, it holds the write lock
         stock_info = await call_yahoo_from_view(stock_symbol)
         iso_currency = stock_info[YAHOO_FIELD_CURRENCY]
 
         # check if currency already exists in database
-        query = currency.select().where(currency.c.iso_currency == iso_currency)
-        currency_record = await database.fetch_one(query)
-
-        if currency_record is None:
-            # handle if currency does not exist
-            # if stock currency is the default one use last rate of 1
-            last_rate = 1
-            symbol = None
-            if iso_currency != user.base_currency:
-                # if stock currency is not the default one call yahoo
-                #  to get currency info
-                symbol = f"{user.base_currency}{iso_currency}=X".upper()
-                currency_info = await call_yahoo_from_view(symbol)
-                last_rate = currency_info[YAHOO_FIELD_PRICE]
-            # save currency record in the database and get the record id
-            query = currency.insert().values(
-                currency_id=create_random_id(),
-                iso_currency=iso_currency,
-                last_rate=last_rate,
-                symbol=symbol,
-                last_update=datetime.utcnow(),
-            )
-            currency_id = await database.execute(query)
-        else:
-            # if currency exists just save the id (needed for stock creation)
-            currency_id = currency_record.currency_id
-
-        # create stock record
-        query = stocks.insert().values(
-            stock_id=create_random_id(),
-            short_name=stock_info[YAHOO_FIELD_NAME],
-            currency_id=currency_id,
-            market=stock_info[YAHOO_FIELD_MARKET],
-            symbol=stock_symbol,
-            last_price=stock_info[YAHOO_FIELD_PRICE],
-            last_update=datetime.utcnow(),
-            financial_currency=stock_info.get(YAHOO_FIELD_FINANCIAL_CURRENCY),
+        currency_query = currency.select().where(
+            currency.c.iso_currency == iso_currency
         )
-        stock_id = await database.execute(query)
-        stock["short_name"] = stock_info[YAHOO_FIELD_NAME]
-        stock["iso_currency"] = iso_currency
-        stock["currency_id"] = currency_id
-        stock["market"] = stock_info[YAHOO_FIELD_MARKET]
-        stock["symbol"] = stock_symbol
-        stock["last_price"] = stock_info[YAHOO_FIELD_PRICE]
-    else:
+        currency_record = await database.fetch_one(currency_query)
+
+        # if stock currency is the default one use last rate of 1
+        last_rate = 1
+        symbol = None
+        if currency_record is None and iso_currency != user.base_currency:
+            # if stock currency is not the default one call yahoo
+            #  to get currency info
+            symbol = f"{user.base_currency}{iso_currency}=X".upper()
+            currency_info = await call_yahoo_from_view(symbol)
+            last_rate = currency_info[YAHOO_FIELD_PRICE]
+
+        async with database.transaction():
+            # another request may have created them meanwhile
+            stock_records = await get_stock_records(stock_symbol)
+            if not stock_records:
+                currency_record = await database.fetch_one(currency_query)
+                if currency_record is None:
+                    # save currency record in the database and get the record id
+                    currency_id = create_id()
+                    query = currency.insert().values(
+                        currency_id=currency_id,
+                        iso_currency=iso_currency,
+                        last_rate=last_rate,
+                        symbol=symbol,
+                        last_update=datetime.utcnow(),
+                    )
+                    await database.execute(query)
+                else:
+                    # if currency exists just save the id (needed for stock creation)
+                    currency_id = currency_record.currency_id
+
+                # create stock record
+                stock_id = create_id()
+                query = stocks.insert().values(
+                    stock_id=stock_id,
+                    short_name=stock_info[YAHOO_FIELD_NAME],
+                    currency_id=currency_id,
+                    market=stock_info[YAHOO_FIELD_MARKET],
+                    symbol=stock_symbol,
+                    last_price=stock_info[YAHOO_FIELD_PRICE],
+                    last_update=datetime.utcnow(),
+                    financial_currency=stock_info.get(YAHOO_FIELD_FINANCIAL_CURRENCY),
+                )
+                await database.execute(query)
+                stock["short_name"] = stock_info[YAHOO_FIELD_NAME]
+                stock["iso_currency"] = iso_currency
+                stock["currency_id"] = currency_id
+                stock["market"] = stock_info[YAHOO_FIELD_MARKET]
+                stock["symbol"] = stock_symbol
+                stock["last_price"] = stock_info[YAHOO_FIELD_PRICE]
+    if stock_records:
         # if stock record exists already
         stock_record = stock_records[0]
         stock_id = stock_record[3]
@@ -150,8 +188,9 @@ async def get_currencies(_: User = Depends(get_current_user)):
 
 
 @router.post("/currency/{currency_id}", response_model=Currency)
-@database.transaction()
-async def update_currency(currency_id: int, user: User = Depends(get_current_user)):
+async def update_currency(
+    currency_id: int, force: bool = False, user: User = Depends(get_current_user)
+):
     query = currency.select().where(currency.c.currency_id == currency_id)
     currency_record = await database.fetch_one(query)
     if currency_record.iso_currency == user.base_currency:
@@ -159,11 +198,12 @@ async def update_currency(currency_id: int, user: User = Depends(get_current_use
             "iso_currency": currency_record.iso_currency,
             "last_rate": 1,
         }
-    currency_info = await call_yahoo_from_view(currency_record.symbol)
-    query = currency.update()
-    query = query.values(last_rate=currency_info[YAHOO_FIELD_PRICE])
-    query = query.where(currency.c.symbol == currency_record.symbol)
-    await database.execute(query)
+    currency_info = await call_yahoo_from_view(currency_record.symbol, force)
+    async with database.transaction():
+        await update_currency_rates(
+            {currency_record.symbol: currency_info[YAHOO_FIELD_PRICE]},
+            datetime.utcnow(),
+        )
     return {
         "iso_currency": currency_record.iso_currency,
         "last_rate": currency_info[YAHOO_FIELD_PRICE],
@@ -171,34 +211,40 @@ async def update_currency(currency_id: int, user: User = Depends(get_current_use
 
 
 @router.post("/currency/", response_model=Currencies)
-async def update_currencies(user: User = Depends(get_current_user)):
-    query = currency.select().where(currency.c.iso_currency != user.base_currency)
+async def update_currencies(
+    force: bool = False, user: User = Depends(get_current_user)
+):
+    query = (
+        currency.select()
+        .where(currency.c.iso_currency != user.base_currency)
+        .where(currency.c.symbol.isnot(None))
+    )
     symbol_records = await database.fetch_all(query)
     symbols = []
     for record in symbol_records:
         symbols.append(record.symbol)
-    currencies_to_update = await get_yahoo_quote(symbols)
+    currencies_to_update = await get_yahoo_quote(symbols, force)
     updated_currencies = []
+    rates = {}
     for symbol in currencies_to_update:
         last_rate = currencies_to_update[symbol][YAHOO_FIELD_PRICE]
-        query = (
-            currency.update()
-            .values(last_rate=last_rate)
-            .where(currency.c.symbol == symbol)
-        )
-        await database.execute(query)
+        rates[symbol] = last_rate
         updated_currencies.append(
             {
                 "iso_currency": currencies_to_update[symbol][YAHOO_FIELD_CURRENCY],
                 "last_rate": last_rate,
             }
         )
+    # the quotes are fetched before opening the transaction, like the updater
+    async with database.transaction():
+        await update_currency_rates(rates, datetime.utcnow())
     return {"currencies": updated_currencies}
 
 
 @router.post("/{stock_id}", response_model=UpdatedStock)
-@database.transaction()
-async def update_stock_quote(stock_id: int, user: User = Depends(get_current_user)):
+async def update_stock_quote(
+    stock_id: int, force: bool = False, user: User = Depends(get_current_user)
+):
     query = stocks.select().where(stocks.c.stock_id == stock_id)
     record = await database.fetch_one(query)
     if not record:
@@ -206,20 +252,16 @@ async def update_stock_quote(stock_id: int, user: User = Depends(get_current_use
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=f"Stock{stocks.symbol} doesn't exist",
         )
-    quote = await call_yahoo_from_view(record.symbol)
-    query = stocks.update()
-    query = query.values(
-        last_price=quote[YAHOO_FIELD_PRICE],
-        last_update=datetime.utcnow(),
-    )
-    query = query.where(stocks.c.symbol == record.symbol)
-    await database.execute(query)
+    quote = await call_yahoo_from_view(record.symbol, force)
+    async with database.transaction():
+        await update_stock_prices(
+            {record.symbol: quote[YAHOO_FIELD_PRICE]}, datetime.utcnow()
+        )
     return {"symbol": record.symbol, "last_price": quote[YAHOO_FIELD_PRICE]}
 
 
 @router.post("/", response_model=UpdatedStocks)
-@database.transaction()
-async def update_stocks(user: User = Depends(get_current_user)):
+async def update_stocks(force: bool = False, user: User = Depends(get_current_user)):
     query = select([stocks.c.symbol])
     join_clause = users.join(accounts, accounts.c.user_id == users.c.user_id)
     join_clause = join_clause.join(owners, owners.c.account_id == accounts.c.account_id)
@@ -237,19 +279,16 @@ async def update_stocks(user: User = Depends(get_current_user)):
     symbols = []
     for record in symbol_records:
         symbols.append(record[0])
-    quotes = await get_yahoo_quote(symbols)
+    quotes = await get_yahoo_quote(symbols, force)
     updated_stocks = []
+    prices = {}
     for symbol in quotes:
-        query = stocks.update()
-        query = query.values(
-            last_price=quotes[symbol][YAHOO_FIELD_PRICE],
-            last_update=datetime.utcnow(),
-        )
-        query = query.where(stocks.c.symbol == symbol)
-        await database.execute(query)
+        prices[symbol] = quotes[symbol][YAHOO_FIELD_PRICE]
         updated_stocks.append(
             {"symbol": symbol, "last_price": quotes[symbol][YAHOO_FIELD_PRICE]}
         )
+    async with database.transaction():
+        await update_stock_prices(prices, datetime.utcnow())
     return {"stocks": updated_stocks}
 
 
@@ -269,7 +308,7 @@ async def get_stocks(_: User = Depends(get_current_user)):
                 "iso_currency": record[6],
             }
         )
-    return stocks_entered
+    return fast_response(stocks_entered)
 
 
 @router.patch("/")
@@ -298,6 +337,12 @@ async def update_stock(
         .values(**values)
     )
     await database.execute(query)
+    # the names are shown in the traded stocks of the owners holding it
+    await bump_owner_revisions(
+        select([stock_positions.c.owner_id]).where(
+            stock_positions.c.stock_id == stock_to_update.stock_id
+        )
+    )
 
 
 @router.delete("/")
@@ -355,8 +400,9 @@ async def create_stock_transaction(
     exchange_rate = 1
     if new_stock_transaction.transaction_ex_rate is not None:
         exchange_rate = new_stock_transaction.transaction_ex_rate
+    stock_transaction_id = create_id()
     query = stock_transactions.insert().values(
-        stock_transaction_id=create_random_id(),
+        stock_transaction_id=stock_transaction_id,
         stock_id=new_stock_transaction.stock_id,
         price=new_stock_transaction.price,
         quantity=new_stock_transaction.quantity,
@@ -368,12 +414,64 @@ async def create_stock_transaction(
         transaction_note=new_stock_transaction.transaction_note,
         transaction_ex_rate=exchange_rate,
     )
-    stock_transaction_id = await database.execute(query)
+    await database.execute(query)
+    await apply_stock_transaction(
+        owner_id, new_stock_transaction.stock_id, new_stock_transaction
+    )
     stock_transaction = new_stock_transaction.dict()
     stock_transaction["stock_transaction_id"] = stock_transaction_id
     return stock_transaction
 
 
+@router.post(
+    "/transaction/{owner_id}/import",
+    response_model=ImportedStockTransactions,
+)
+async def import_stock_transaction_statement(
+    owner_id: int,
+    request: Request,
+    user: User = Depends(get_current_user),
+):
+    # the body is a csv file with a header or one json object per line, the
+    # rows are parsed while they are received, before the transaction opens
+    await get_owner(user.user_id, owner_id)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        statement_format = StatementFormat(content_type)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content type must be one of {', '.join(StatementFormat)}",
+        )
+    return await import_stock_transactions(
+        owner_id, user.base_currency, request.stream(), statement_format
+    )
+
+
+@router.get("/transaction/{owner_id}/export")
+async def export_stock_transactions(
+    owner_id: int,
+    accept: str = Header("*/*"),
+    user: User = Depends(get_current_user),
+):
+    # the whole history of the owner, csv when asked with the accept header,
+    # ndjson otherwise
+    await get_owner(user.user_id, owner_id)
+    statement_format = StatementFormat.NDJSON
+    if StatementFormat.CSV.value in accept:
+        statement_format = StatementFormat.CSV
+    extension = "csv" if statement_format == StatementFormat.CSV else "ndjson"
+    return StreamingResponse(
+        iterate_statement(owner_id, statement_format),
+        media_type=statement_format.value,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="transactions-{owner_id}.{extension}"'
+            )
+        },
+    )
+
+
 @router.get(
     "/transaction/{owner_id}/history/{stock_id}",
     response_model=StockTransactionHistory,
@@ -381,17 +479,28 @@ async def create_stock_transaction(
 async def get_stock_transaction_history(
     owner_id: int,
     stock_id: int,
+    limit: int = Query(HISTORY_PAGE_SIZE, gt=0, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
     user: User = Depends(get_current_user),
 ):
+    # newest transactions first, next_cursor is set when there are more pages
     await get_owner(user.user_id, owner_id)
-
-    query = (
-        stock_transactions.select()
-        .where(stock_transactions.c.owner_id == owner_id)
-        .where(stock_transactions.c.stock_id == stock_id)
+    after = None
+    if cursor is not None:
+        after = decode_history_cursor(cursor)
+    query = build_transaction_history_query(
+        owner_id, stock_id, limit + 1, after, from_date, to_date
     )
     records = await database.fetch_all(query)
-    history = {"transactions": []}
+    history = {"transactions": [], "next_cursor": None}
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        history["next_cursor"] = encode_history_cursor(
+            last.date, last.stock_transaction_id
+        )
     for transaction in records:
         history["transactions"].append(
             {
@@ -407,7 +516,7 @@ async def get_stock_transaction_history(
                 "transaction_ex_rate": transaction.transaction_ex_rate,
             }
         )
-    return history
+    return fast_response(history)
 
 
 @router.get("/traded/{owner_id}/{stock_id}/", response_model=TradedStock)
@@ -415,13 +524,13 @@ async def get_traded_stock_summary(
     owner_id: int, stock_id: int, user: User = Depends(get_current_user)
 ):
     await get_owner(user.user_id, owner_id)
-    records = await get_transaction_records([owner_id], stock_id)
+    records = await get_position_records([owner_id], stock_id)
     if len(records) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Stock id {stock_id} doesn't exist for this owner",
         )
-    traded_stocks = prepare_traded_stocks(records)
+    traded_stocks = prepare_traded_stocks_from_positions(records)
     return traded_stocks[0]
 
 
@@ -431,22 +540,34 @@ async def get_traded_stock_summary(
 )
 async def get_traded_stocks(
     owner_id: int,
+    request: Request,
+    response: Response,
     user: User = Depends(get_current_user),
 ):
+    # polled by the dashboards, the positions are summarized again only when
+    # the etag of the client is stale
     await get_owner(user.user_id, owner_id)
-    records = await get_transaction_records([owner_id])
-    traded_stocks = prepare_traded_stocks(records)
+    etag = make_etag(await get_owners_version([owner_id]))
+    not_modified = get_not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = etag
+    records = await get_position_records([owner_id])
+    traded_stocks = prepare_traded_stocks_from_positions(records)
     (
         invested_converted,
         profit_and_loss_converted,
         current_ctv_converted,
     ) = calculate_stock_totals(traded_stocks)
-    return {
-        "stocks": traded_stocks,
-        "invested_converted": invested_converted,
-        "profit_and_loss_converted": profit_and_loss_converted,
-        "current_ctv_converted": current_ctv_converted,
-    }
+    return fast_response(
+        {
+            "stocks": traded_stocks,
+            "invested_converted": invested_converted,
+            "profit_and_loss_converted": profit_and_loss_converted,
+            "current_ctv_converted": current_ctv_converted,
+        },
+        response,
+    )
 
 
 @router.delete("/transaction")
@@ -468,6 +589,7 @@ async def delete_stock_transaction(
         stock_transactions.c.stock_transaction_id == transaction.stock_transaction_id
     )
     await database.execute(query)
+    await replay_stock_position(record.owner_id, record.stock_id)
 
 
 @router.patch("/transaction")
@@ -501,6 +623,7 @@ async def update_stock_transaction(
         .values(**values)
     )
     await database.execute(query)
+    await replay_stock_position(record.owner_id, record.stock_id)
 
 
 @router.post("/{stock_id}/move/{owner_id}", response_model=StockTransactionsToMove)
@@ -539,6 +662,9 @@ async def move_stock_transaction(
         )
     )
     await database.execute(query)
+    for previous_owner_id in {record.owner_id for record in records}:
+        await replay_stock_position(previous_owner_id, stock_id)
+    await replay_stock_position(owner_id, stock_id)
     return stock_transaction_to_move
 
 
@@ -585,8 +711,9 @@ async def create_stock_alert(
                 detail="Stock alert for stock "
                 "{new_stock_alert.stock_id} already exists",
             )
+    stock_alert_id = create_id()
     query = stock_alerts.insert().values(
-        stock_alert_id=create_random_id(),
+        stock_alert_id=stock_alert_id,
         stock_id=new_stock_alert.stock_id,
         owner_id=new_stock_alert.owner_id,
         lower_limit_price=new_stock_alert.lower_limit_price,
@@ -598,6 +725,7 @@ async def create_stock_alert(
         profit_and_loss_upper_limit=new_stock_alert.profit_and_loss_upper_limit,
     )
     await database.execute(query)
+    await sync_stock_alert(stock_alert_id)
 
     return await get_alert_or_raise(new_stock_alert.stock_id, new_stock_alert.owner_id)
 
@@ -605,9 +733,16 @@ async def create_stock_alert(
 @router.get("/alert/{owner_id}/", response_model=StockAlerts)
 async def get_stock_alerts(
     owner_id: int,
+    request: Request,
+    response: Response,
     user: User = Depends(get_current_user),
 ):
     await get_owner(user.user_id, owner_id)
+    etag = make_etag(await get_owners_version([owner_id]))
+    not_modified = get_not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = etag
     alerts = {"alerts": await check_stock_alerts(owner_id=owner_id)}
     return alerts
 
@@ -640,6 +775,7 @@ async def delete_stock_alert(
         stock_alerts.c.stock_alert_id == alert.stock_alert_id
     )
     await database.execute(query)
+    await bump_owner_revisions([record.owner_id])
 
 
 @router.patch("/alert")
@@ -668,6 +804,7 @@ async def update_stock_alert(
             .values(**values)
         )
         await database.execute(query)
+        await sync_stock_alert(alert.stock_alert_id)
     return await get_alert_or_raise(record.stock_id, record.owner_id)
 
 
@@ -1,16 +1,44 @@
 import asyncio
 import logging
+from os import environ
+from time import perf_counter, time
 
+from santaka.db import create_schema, database
+from santaka.http_client import http_client
+from santaka.metrics import Gauge, Histogram, registry, serve_metrics
+from santaka.slow_queries import slow_query_log
 from santaka.stock.utils import update_stocks, update_currency, YAHOO_UPDATE_COOLDOWN
 
 logger = logging.getLogger(__name__)
 
+TASK_METRICS_HOST = environ.get("TASK_METRICS_HOST", "0.0.0.0")
+TASK_METRICS_PORT = int(environ.get("TASK_METRICS_PORT", 8001))
+
+TASK_LATENCY = registry.register(
+    Histogram(
+        "santaka_task_duration_seconds",
+        "Time of a periodic task run, by task and outcome",
+        ("task", "outcome"),
+    )
+)
+TASK_LAST_SUCCESS = registry.register(
+    Gauge(
+        "santaka_task_last_success_timestamp_seconds",
+        "Unix time of the last successful run of a periodic task",
+        ("task",),
+    )
+)
+
 
 async def run_periodic_task(name, update_func, cooldown):
     while True:
+        start = perf_counter()
         try:
             await update_func()
+            TASK_LATENCY.observe(perf_counter() - start, name, "ok")
+            TASK_LAST_SUCCESS.set(time(), name)
         except Exception as e:
+            TASK_LATENCY.observe(perf_counter() - start, name, "error")
             logger.error(
                 "periodic task %s error: %s, retrying in %d seconds",
                 name,
@@ -21,13 +49,24 @@ async def run_periodic_task(name, update_func, cooldown):
 
 
 async def run_tasks():
-    asyncio.create_task(
-        run_periodic_task("stocks", update_stocks, YAHOO_UPDATE_COOLDOWN)
-    )
-    asyncio.create_task(
-        run_periodic_task("currency", update_currency, YAHOO_UPDATE_COOLDOWN)
-    )
-    await asyncio.Event().wait()
+    # the updates only change existing rows, this process leases no worker id
+    create_schema()
+    await database.connect()
+    await http_client.connect()
+    metrics_server = await serve_metrics(TASK_METRICS_HOST, TASK_METRICS_PORT)
+    try:
+        asyncio.create_task(
+            run_periodic_task("stocks", update_stocks, YAHOO_UPDATE_COOLDOWN)
+        )
+        asyncio.create_task(
+            run_periodic_task("currency", update_currency, YAHOO_UPDATE_COOLDOWN)
+        )
+        await asyncio.Event().wait()
+    finally:
+        metrics_server.close()
+        slow_query_log.log_summary()
+        await http_client.disconnect()
+        await database.disconnect()
 
 
 if __name__ == "__main__":
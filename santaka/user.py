@@ -1,27 +1,117 @@
 from os import environ
 from datetime import datetime, timedelta
-from typing import Tuple
+from time import monotonic, time
+from typing import Dict, Optional, Tuple
 
 from fastapi import status, HTTPException, Depends, APIRouter
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from sqlalchemy.sql import select
 
-from santaka.db import database, users, create_random_id
+from santaka.cache import TTLCache
+from santaka.db import create_id, database, users
+from santaka.ids import get_first_id
+from santaka.metrics import Counter, Gauge, add_cache_collector, registry
+from santaka.password import PasswordHasher
 
 # the default value for SECRET_KEY and ACCESS_TOKEN_EXPIRE_MINUTES are only for dev,
 # export valid ones in prod
 SECRET_KEY = environ.get("SECRET_KEY", "secret")
 ACCESS_TOKEN_EXPIRE_MINUTES = environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 24 * 60)
 ALGORITHM = "HS256"
+USER_CACHE_SIZE = int(environ.get("USER_CACHE_SIZE", 4096))
+USER_CACHE_TTL = float(environ.get("USER_CACHE_TTL", 60))
+USER_REVISION_POLL_INTERVAL = float(environ.get("USER_REVISION_POLL_INTERVAL", 1))
+PASSWORD_HASH_CONCURRENCY = int(environ.get("PASSWORD_HASH_CONCURRENCY", 4))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/token")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_CONCURRENCY)
+
+PASSWORD_HASH_QUEUED = registry.register(
+    Gauge(
+        "santaka_password_hash_queued",
+        "Password hashes and checks waiting for a thread",
+    )
+)
+PASSWORD_HASH_MAX_QUEUED = registry.register(
+    Gauge(
+        "santaka_password_hash_max_queued",
+        "Most password hashes and checks waiting at once since the start",
+    )
+)
+PASSWORD_HASH_RUNNING = registry.register(
+    Gauge(
+        "santaka_password_hash_running",
+        "Password hashes and checks running in the thread pool",
+    )
+)
+PASSWORD_HASH_COMPLETED = registry.register(
+    Counter(
+        "santaka_password_hashes_total",
+        "Password hashes and checks completed",
+    )
+)
+PASSWORD_HASH_WAIT = registry.register(
+    Counter(
+        "santaka_password_hash_wait_seconds_total",
+        "Time the password hashes and checks waited for a thread",
+    )
+)
+PASSWORD_HASH_AVERAGE_WAIT = registry.register(
+    Gauge(
+        "santaka_password_hash_wait_seconds_average",
+        "Average time a password hash or check waited for a thread",
+    )
+)
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 
+class UserRevisions:
+    # the revisions of the users updated by any process (the update_user command
+    # included) in the last ttl seconds, older updates predate every cached entry;
+    # polled at most once per interval, which bounds how stale a cached user is
+    def __init__(self, ttl: float, interval: float):
+        self.ttl = ttl
+        self.interval = interval
+        self.revisions: Dict[str, int] = {}
+        self.polled_at: Optional[float] = None
+
+    async def poll(self):
+        now = monotonic()
+        if self.polled_at is not None and now - self.polled_at < self.interval:
+            return
+        # set before the query, the concurrent requests don't poll again
+        self.polled_at = now
+        query = build_user_revisions_query(int((time() - self.ttl) * 1000))
+        records = await database.fetch_all(query)
+        self.revisions = {record.username: record.revision for record in records}
+
+    def is_current(self, username: str, revision: Optional[int]) -> bool:
+        return self.revisions.get(username, revision) == revision
+
+
+# decoded tokens to users with their revision
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_revisions = UserRevisions(USER_CACHE_TTL, USER_REVISION_POLL_INTERVAL)
+
+
+async def update_password_hasher_metrics():
+    PASSWORD_HASH_QUEUED.set(password_hasher.queued)
+    PASSWORD_HASH_MAX_QUEUED.set(password_hasher.max_queued)
+    PASSWORD_HASH_RUNNING.set(password_hasher.running)
+    PASSWORD_HASH_COMPLETED.set(password_hasher.completed)
+    PASSWORD_HASH_WAIT.set(password_hasher.total_wait)
+    PASSWORD_HASH_AVERAGE_WAIT.set(password_hasher.average_wait)
+
+
+registry.add_collector(update_password_hasher_metrics)
+add_cache_collector("users", user_cache)
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -33,43 +123,74 @@ class User(BaseModel):
     base_currency: str
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
 @database.transaction()
 async def create_user(username: str, password: str, base_currency: str):
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await password_hasher.hash(password)
+    user_id = create_id()
     query = users.insert().values(
-        user_id=create_random_id(),
+        user_id=user_id,
         username=username,
         password=hashed_password,
         base_currency=base_currency,
     )
-    user_id = await database.execute(query)
+    await database.execute(query)
     print(f"created user {username} with {user_id} id")
 
 
-async def get_user(username: str) -> Tuple[User, str]:
+@database.transaction()
+async def update_user(
+    username: str,
+    password: Optional[str] = None,
+    base_currency: Optional[str] = None,
+):
+    values = {}
+    if password is not None:
+        values["password"] = await password_hasher.hash(password)
+    if base_currency is not None:
+        values["base_currency"] = base_currency
+    if not values:
+        return
+    values["revision"] = create_id()
+    query = users.update().where(users.c.username == username).values(**values)
+    await database.execute(query)
+    print(f"updated user {username}")
+
+
+def build_user_revisions_query(since_millis: int):
+    return select([users.c.username, users.c.revision]).where(
+        users.c.revision >= get_first_id(since_millis)
+    )
+
+
+async def get_user_record(username: str):
     query = users.select().where(users.c.username == username)
-    record = await database.fetch_one(query)
+    return await database.fetch_one(query)
+
+
+def to_user(record) -> User:
+    return User(
+        username=record.username,
+        user_id=record.user_id,
+        base_currency=record.base_currency,
+    )
+
+
+async def get_user(username: str) -> Tuple[User, str]:
+    record = await get_user_record(username)
     if record is None:
         return None, None
-    return (
-        User(
-            username=username,
-            user_id=record.user_id,
-            base_currency=record.base_currency,
-        ),
-        record.password,
-    )
+    return to_user(record), record.password
 
 
 async def authenticate_user(username: str, password: str) -> User:
     user, hashed_password = await get_user(username)
     if not hashed_password:
         return None
-    if not verify_password(password, hashed_password):
+    if not await verify_password(password, hashed_password):
         return None
     return user
 
@@ -97,6 +218,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = user_cache.get(token)
+    if cached is not None:
+        await user_revisions.poll()
+        user, revision = cached
+        if user_revisions.is_current(user.username, revision):
+            return user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -104,9 +231,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user, _ = await get_user(username)
-    if user is None:
+    record = await get_user_record(username)
+    if record is None:
         raise credentials_exception
+    user = to_user(record)
+    ttl = user_cache.ttl
+    if "exp" in payload:
+        # a cached token must not outlive its expiration
+        ttl = min(ttl, payload["exp"] - time())
+    user_cache.set(token, (user, record.revision), ttl)
     return user
 
 
@@ -0,0 +1,152 @@
+from datetime import datetime
+
+from fastapi import Response
+from pytest import mark
+
+from santaka.account.models import Bank
+from santaka.account.views import get_accounts
+from santaka.db import (
+    accounts,
+    currency,
+    database,
+    owners,
+    stock_alerts,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock.providers import YahooMarket
+from santaka.stock.utils import rebuild_positions
+from santaka.user import User
+from tests.helpers import make_request
+
+USER = User(username="user", user_id=1, base_currency="EUR")
+
+
+def seed_accounts(owner_count: int):
+    now = datetime.utcnow()
+    database.engine.execute(
+        users.insert(),
+        [{"user_id": 1, "username": "user", "password": "", "base_currency": "EUR"}],
+    )
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": account_id,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": str(account_id),
+            }
+            for account_id in (1, 2, 3)
+        ],
+    )
+    database.engine.execute(
+        owners.insert(),
+        [
+            {
+                "owner_id": owner_id,
+                "account_id": owner_id % 2 + 1,
+                "fullname": f"owner {owner_id}",
+            }
+            for owner_id in range(1, owner_count + 1)
+        ],
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": stock_id,
+                "market": YahooMarket.ITALY.value,
+                "symbol": f"SYM{stock_id}.MI",
+                "short_name": f"stock {stock_id}",
+                "last_price": 10,
+                "last_update": now,
+                "currency_id": 1,
+            }
+            for stock_id in (1, 2)
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": owner_id * 10 + stock_id,
+                "stock_id": stock_id,
+                "owner_id": owner_id,
+                "price": 5,
+                "quantity": owner_id,
+                "date": now,
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+            for owner_id in range(1, owner_count + 1)
+            for stock_id in (1, 2)
+        ],
+    )
+    # only the odd owners have a triggered alert
+    database.engine.execute(
+        stock_alerts.insert(),
+        [
+            {
+                "stock_alert_id": owner_id,
+                "stock_id": 1,
+                "owner_id": owner_id,
+                "lower_limit_price": 20 if owner_id % 2 else 1,
+            }
+            for owner_id in range(1, owner_count + 1)
+        ],
+    )
+
+
+@mark.asyncio
+@mark.parametrize("owner_count", (1, 8))
+async def test_get_accounts_query_count(owner_count, clean_database, query_counter):
+    seed_accounts(owner_count)
+    async with database:
+        await rebuild_positions()
+        query_counter["queries"] = 0
+        response = await get_accounts(make_request(), Response(), USER)
+    # accounts, owners version, positions and alerts: it doesn't grow with the
+    # owners
+    assert query_counter["queries"] == 4
+    account_models = {a["account_id"]: a for a in response["accounts"]}
+    assert set(account_models) == {1, 2, 3}
+    assert account_models[3]["owners"] == []
+    owner_models = [o for a in response["accounts"] for o in a["owners"]]
+    assert len(owner_models) == owner_count
+    for owner in owner_models:
+        assert owner["has_triggered_alerts"] == bool(owner["owner_id"] % 2)
+    for account_id in (1, 2):
+        expected_ctv = sum(
+            2 * 10 * owner_id
+            for owner_id in range(1, owner_count + 1)
+            if owner_id % 2 + 1 == account_id
+        )
+        assert account_models[account_id]["current_stock_ctv"] == expected_ctv
+
+
+@mark.asyncio
+async def test_get_accounts_not_modified(clean_database, query_counter):
+    seed_accounts(2)
+    async with database:
+        await rebuild_positions()
+        response = Response()
+        await get_accounts(make_request(), response, USER)
+        etag = response.headers["etag"]
+        query_counter["queries"] = 0
+        request = make_request({"If-None-Match": etag})
+        not_modified = await get_accounts(request, Response(), USER)
+        assert not_modified.status_code == 304
+        # the owners are not summarized
+        assert query_counter["queries"] == 2
+        await database.execute(
+            owners.insert().values(owner_id=3, account_id=3, fullname="owner 3")
+        )
+        response = Response()
+        await get_accounts(request, response, USER)
+        assert response.headers["etag"] != etag
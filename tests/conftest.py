@@ -0,0 +1,108 @@
+import socket
+import subprocess
+from os import environ, path
+from shutil import which
+from tempfile import TemporaryDirectory
+
+from pytest import fixture
+
+from santaka.db import create_id, create_schema, database, metadata
+
+# tests touching the database share a temporary sqlite file emptied after
+# every test
+TMP_DIR = TemporaryDirectory()
+# TEST_DATABASE_BACKEND=postgresql runs the suite against a throwaway cluster,
+# the postgres binaries are looked up in PG_BIN or in the PATH
+TEST_DATABASE_BACKEND = environ.get("TEST_DATABASE_BACKEND", "sqlite")
+PG_BIN = environ.get("PG_BIN", "")
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def pg_command(name: str) -> str:
+    command = path.join(PG_BIN, name) if PG_BIN else which(name)
+    if command is None:
+        raise RuntimeError(f"{name} not found, set PG_BIN to the postgres binaries")
+    return command
+
+
+def start_postgres(data_dir: str) -> str:
+    port = get_free_port()
+    subprocess.run(
+        [pg_command("initdb"), "-D", data_dir, "-U", "postgres", "-A", "trust"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        [
+            pg_command("pg_ctl"),
+            "start",
+            "-w",
+            "-D",
+            data_dir,
+            "-l",
+            path.join(data_dir, "server.log"),
+            "-o",
+            f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c fsync=off",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return f"postgresql://postgres@127.0.0.1:{port}/postgres"
+
+
+def stop_postgres(data_dir: str):
+    subprocess.run(
+        [pg_command("pg_ctl"), "stop", "-m", "fast", "-D", data_dir],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def pytest_configure(config):
+    if TEST_DATABASE_BACKEND == "postgresql":
+        url = start_postgres(path.join(TMP_DIR.name, "postgres"))
+    else:
+        url = f"sqlite:///{TMP_DIR.name}/test.db"
+    database.configure(url)
+    create_schema()
+    # the only process writing to the test database
+    create_id.set_worker_id(0)
+
+
+def pytest_unconfigure(config):
+    if TEST_DATABASE_BACKEND == "postgresql":
+        database.engine.dispose()
+        stop_postgres(path.join(TMP_DIR.name, "postgres"))
+
+
+@fixture
+def query_counter(monkeypatch):
+    counter = {"queries": 0}
+    for method_name in (
+        "execute",
+        "execute_many",
+        "fetch_all",
+        "fetch_one",
+        "fetch_val",
+    ):
+        method = getattr(database, method_name)
+
+        def counted(*args, method=method, **kwargs):
+            counter["queries"] += 1
+            return method(*args, **kwargs)
+
+        monkeypatch.setattr(database, method_name, counted)
+    return counter
+
+
+@fixture
+def clean_database():
+    yield
+    with database.engine.begin() as connection:
+        for table in reversed(metadata.sorted_tables):
+            connection.execute(table.delete())
@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from random import Random
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from santaka.account.models import Bank
+from santaka.analytics import calculate_stock_totals
+from santaka.db import (
+    accounts,
+    currency,
+    database,
+    owners,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock.models import TransactionType
+from santaka.stock.providers import YahooMarket
+from santaka.stock.utils import prepare_traded_stocks
+from santaka.stock.views import get_traded_stocks, router
+
+# data builders shared by the tests and the benchmarks
+
+
+def seed_owner():
+    now = datetime.utcnow()
+    database.engine.execute(
+        users.insert(),
+        [{"user_id": 1, "username": "user", "password": "", "base_currency": "EUR"}],
+    )
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": 1,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": "1",
+            }
+        ],
+    )
+    database.engine.execute(
+        owners.insert(), [{"owner_id": 1, "account_id": 1, "fullname": "owner"}]
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": 1,
+                "market": YahooMarket.ITALY.value,
+                "symbol": "SYM.MI",
+                "short_name": "sym",
+                "last_price": 15,
+                "last_update": now,
+                "currency_id": 1,
+            }
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": 1,
+                "stock_id": 1,
+                "owner_id": 1,
+                "price": 12,
+                "quantity": 10,
+                "date": datetime(2021, 1, 4),
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+        ],
+    )
+
+
+async def iterate_chunks(body: str, size: int = 7):
+    encoded = body.encode()
+    for start in range(0, len(encoded), size):
+        end = start + size
+        yield encoded[start:end]
+
+
+def make_request(headers: Optional[Dict[str, str]] = None) -> Request:
+    raw_headers = [
+        (name.lower().encode(), value.encode())
+        for name, value in (headers or {}).items()
+    ]
+    return Request({"type": "http", "headers": raw_headers})
+
+
+def generate_transaction_records(seed: int, stock_count: int, transaction_count: int):
+    random = Random(seed)
+    markets = [market.value for market in YahooMarket]
+    banks = [bank.value for bank in Bank]
+    records = []
+    for stock_id in range(1, stock_count + 1):
+        market = random.choice(markets)
+        bank = random.choice(banks)
+        last_price = Decimal(str(round(random.uniform(1, 500), 3)))
+        last_rate = Decimal(str(round(random.uniform(0.5, 1.5), 5)))
+        date = datetime(2015, 1, 1)
+        quantity = 0
+        for _ in range(transaction_count):
+            date += timedelta(days=random.randint(1, 30))
+            transaction_type = TransactionType.buy.value
+            transaction_quantity = random.randint(1, 500)
+            if quantity > 0 and random.random() < 0.4:
+                transaction_type = TransactionType.sell.value
+                # sometimes close the whole position
+                transaction_quantity = min(quantity, transaction_quantity)
+                quantity -= transaction_quantity
+            else:
+                quantity += transaction_quantity
+            records.append(
+                (
+                    stock_id,
+                    "USD",
+                    last_rate,
+                    f"SYM{stock_id}",
+                    last_price,
+                    market,
+                    transaction_type,
+                    transaction_quantity,
+                    Decimal(str(round(random.uniform(1, 500), 3))),
+                    Decimal(str(round(random.uniform(0, 20), 2))),
+                    date,
+                    Decimal("0"),
+                    bank,
+                    1,
+                    "USD",
+                    f"synthetic {stock_id}",
+                    Decimal(str(round(random.uniform(0.5, 1.5), 5))),
+                )
+            )
+    return records
+
+
+def build_traded_stocks(stock_count: int, transaction_count: int = 5) -> dict:
+    traded_stocks = prepare_traded_stocks(
+        generate_transaction_records(0, stock_count, transaction_count)
+    )
+    (
+        invested_converted,
+        profit_and_loss_converted,
+        current_ctv_converted,
+    ) = calculate_stock_totals(traded_stocks)
+    return {
+        "stocks": traded_stocks,
+        "invested_converted": invested_converted,
+        "profit_and_loss_converted": profit_and_loss_converted,
+        "current_ctv_converted": current_ctv_converted,
+    }
+
+
+async def render_with_response_model(content: dict) -> bytes:
+    # what fastapi does with the content returned by get_traded_stocks
+    route = next(
+        route for route in router.routes if route.endpoint == get_traded_stocks
+    )
+    serialized = await serialize_response(
+        field=route.secure_cloned_response_field, response_content=content
+    )
+    return JSONResponse(serialized).body
+
+
+class FakeClock:
+    def __init__(self, millis: int):
+        self.millis = millis
+        self.calls = 0
+
+    def __call__(self) -> int:
+        self.calls += 1
+        return self.millis
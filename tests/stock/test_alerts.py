@@ -0,0 +1,248 @@
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pytest import mark
+from sqlalchemy.sql import select
+
+from santaka.account.models import Bank
+from santaka.db import (
+    accounts,
+    currency,
+    database,
+    owners,
+    stock_alerts,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock import utils
+from santaka.stock.models import AlertFields
+from santaka.stock.providers import YahooMarket
+
+
+def create_alert(stock_alert_id, stock_id=1, lower=None, upper=None, **kwargs):
+    fields = {
+        "fiscal_price_lower_than": None,
+        "fiscal_price_greater_than": None,
+        "profit_and_loss_lower_limit": None,
+        "profit_and_loss_upper_limit": None,
+    }
+    fields.update(kwargs)
+    return SimpleNamespace(
+        stock_alert_id=stock_alert_id,
+        stock_id=stock_id,
+        lower_limit_price=None if lower is None else Decimal(lower),
+        upper_limit_price=None if upper is None else Decimal(upper),
+        **fields,
+    )
+
+
+def get_crossed(alerts, old_price, new_price, stock_id=1):
+    return {
+        alert.stock_alert_id
+        for alert in alerts
+        if alert.stock_id == stock_id
+        and utils.check_alert_crossed(alert, Decimal(old_price), Decimal(new_price))
+    }
+
+
+def test_check_alert_crossed():
+    alerts = [
+        create_alert(1, lower="10"),
+        create_alert(2, lower="20"),
+        create_alert(3, upper="30"),
+        create_alert(4, upper="50"),
+        create_alert(5, stock_id=2, lower="25"),
+        create_alert(6, fiscal_price_lower_than=True),
+        create_alert(7, lower="10", upper="40"),
+    ]
+    assert get_crossed(alerts, "25", "26") == {6}
+    assert get_crossed(alerts, "25", "15") == {2, 6}
+    assert get_crossed(alerts, "15", "45") == {2, 3, 6, 7}
+    assert get_crossed(alerts, "40", "5") == {1, 2, 3, 6, 7}
+    # the lower limit triggers at the limit, the upper one above it
+    assert get_crossed(alerts, "20", "21") == {2, 6}
+    assert get_crossed(alerts, "29", "30") == {6}
+    assert get_crossed(alerts, "30", "31") == {3, 6}
+    assert get_crossed(alerts, "30", "20", stock_id=2) == {5}
+
+
+def seed_portfolio():
+    now = datetime.utcnow()
+    database.engine.execute(
+        users.insert(),
+        [{"user_id": 1, "username": "user", "password": "", "base_currency": "EUR"}],
+    )
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": 1,
+                "user_id": 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": "1",
+            }
+        ],
+    )
+    database.engine.execute(
+        owners.insert(), [{"owner_id": 1, "account_id": 1, "fullname": "owner"}]
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": 1,
+                "market": YahooMarket.ITALY.value,
+                "symbol": "SYM.MI",
+                "short_name": "sym",
+                "last_price": 15,
+                "last_update": now,
+                "currency_id": 1,
+            }
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": 1,
+                "stock_id": 1,
+                "owner_id": 1,
+                "price": 12,
+                "quantity": 10,
+                "date": now,
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+        ],
+    )
+    database.engine.execute(
+        stock_alerts.insert(),
+        [
+            {
+                "stock_alert_id": 1,
+                "stock_id": 1,
+                "owner_id": 1,
+                "lower_limit_price": 10,
+                "fiscal_price_greater_than": None,
+            },
+            {
+                "stock_alert_id": 2,
+                "stock_id": 1,
+                "owner_id": 1,
+                "lower_limit_price": None,
+                "fiscal_price_greater_than": True,
+            },
+        ],
+    )
+
+
+@mark.asyncio
+async def test_price_updates_refresh_triggered_alerts(clean_database):
+    seed_portfolio()
+    async with database:
+        await utils.rebuild_positions()
+        await utils.initialize_alerts()
+        alerts = await utils.check_stock_alerts(owner_id=1)
+        assert [a["triggered_fields"] for a in alerts] == [[], []]
+
+        await utils.update_stock_prices({"SYM.MI": 9.5}, datetime.utcnow())
+        alerts = await utils.check_stock_alerts(owner_id=1)
+        assert [a["triggered_fields"] for a in alerts] == [
+            [AlertFields.LOWER_LIMIT_PRICE],
+            [AlertFields.FISCAL_PRICE_GREATER_THAN],
+        ]
+
+        await utils.update_stock_prices({"SYM.MI": 11}, datetime.utcnow())
+        alerts = await utils.check_stock_alerts(owner_id=1)
+        assert [a["triggered_fields"] for a in alerts] == [
+            [],
+            [AlertFields.FISCAL_PRICE_GREATER_THAN],
+        ]
+
+
+@mark.asyncio
+async def test_price_updates_see_alerts_written_by_other_processes(clean_database):
+    seed_portfolio()
+    async with database:
+        await utils.rebuild_positions()
+        await utils.update_stock_prices({"SYM.MI": 20}, datetime.utcnow())
+        # written by another api worker, this process never saw it
+        await database.execute(
+            stock_alerts.insert().values(
+                stock_alert_id=3, stock_id=1, owner_id=1, upper_limit_price=25
+            )
+        )
+        await utils.update_stock_prices({"SYM.MI": 30}, datetime.utcnow())
+        alerts = await utils.check_stock_alerts(owner_id=1)
+        assert alerts[2]["triggered_fields"] == [AlertFields.UPPER_LIMIT_PRICE]
+
+
+@mark.asyncio
+async def test_alerts_are_refreshed_in_batches_of_owners(clean_database, monkeypatch):
+    monkeypatch.setattr(utils, "BULK_UPDATE_BATCH_SIZE", 2)
+    seed_portfolio()
+    # five owners holding the same stock, each with a triggered alert
+    database.engine.execute(
+        owners.insert(),
+        [
+            {"owner_id": owner_id, "account_id": 1, "fullname": "owner"}
+            for owner_id in range(2, 6)
+        ],
+    )
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": owner_id,
+                "stock_id": 1,
+                "owner_id": owner_id,
+                "price": 12,
+                "quantity": 10,
+                "date": datetime.utcnow(),
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+            for owner_id in range(2, 6)
+        ],
+    )
+    database.engine.execute(
+        stock_alerts.insert(),
+        [
+            {
+                "stock_alert_id": owner_id + 10,
+                "stock_id": 1,
+                "owner_id": owner_id,
+                "upper_limit_price": 14,
+            }
+            for owner_id in range(2, 6)
+        ],
+    )
+    async with database:
+        await utils.rebuild_positions()
+        records = await database.fetch_all(
+            stock_alerts.select().order_by(stock_alerts.c.stock_alert_id)
+        )
+        assert [record.triggered_fields for record in records] == [
+            "",
+            "",
+            "upper_limit_price",
+            "upper_limit_price",
+            "upper_limit_price",
+            "upper_limit_price",
+        ]
+        revisions = await database.fetch_all(
+            select([owners.c.revision]).order_by(owners.c.owner_id)
+        )
+        assert [record.revision for record in revisions] == [2, 2, 2, 2, 2]
+
+        await utils.update_stock_prices({"SYM.MI": 13}, datetime.utcnow())
+        records = await database.fetch_all(
+            stock_alerts.select().where(stock_alerts.c.owner_id > 1)
+        )
+        assert {record.triggered_fields for record in records} == {""}
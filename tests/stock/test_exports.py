@@ -0,0 +1,56 @@
+import json
+from decimal import Decimal
+
+from pytest import mark
+
+from santaka.db import database, owners, stock_transactions
+from santaka.stock import exports
+from santaka.stock.exports import EXPORT_FIELDS, iterate_statement
+from santaka.stock.imports import import_stock_transactions
+from santaka.stock.models import StatementFormat
+from tests.helpers import iterate_chunks, seed_owner
+
+
+async def read_statement(owner_id: int, statement_format: StatementFormat) -> str:
+    chunks = []
+    async for chunk in iterate_statement(owner_id, statement_format):
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+@mark.asyncio
+async def test_export_can_be_imported_again(clean_database, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+    seed_owner()
+    database.engine.execute(
+        owners.insert(), [{"owner_id": 2, "account_id": 1, "fullname": "other"}]
+    )
+    body = (
+        "symbol,price,quantity,commission,date,transaction_type,transaction_note\n"
+        "SYM.MI,10.5,5,1.25,2021-01-02T10:00:00,buy,first\n"
+        "SYM.MI,14,12,0,2021-02-01T10:00:00,sell,\n"
+        'SYM.MI,9,1,0,2021-03-01T10:00:00,buy,"a, b"\n'
+    )
+    async with database:
+        await import_stock_transactions(
+            1, "EUR", iterate_chunks(body), StatementFormat.CSV
+        )
+        csv_statement = await read_statement(1, StatementFormat.CSV)
+        ndjson_statement = await read_statement(1, StatementFormat.NDJSON)
+
+        lines = csv_statement.splitlines()
+        assert lines[0] == ",".join(EXPORT_FIELDS)
+        assert len(lines) == 5
+        rows = [json.loads(line) for line in ndjson_statement.splitlines()]
+        assert [row["quantity"] for row in rows] == [5, 10, 12, 1]
+        assert Decimal(rows[0]["price"]) == Decimal("10.5")
+        assert rows[0]["date"] == "2021-01-02T10:00:00"
+        assert rows[3]["transaction_note"] == "a, b"
+
+        result = await import_stock_transactions(
+            2, "EUR", iterate_chunks(csv_statement), StatementFormat.CSV
+        )
+        assert result["imported"] == 4
+        query = stock_transactions.select().where(stock_transactions.c.owner_id == 2)
+        imported = await database.fetch_all(query)
+        assert sorted(record.commission for record in imported) == [0, 0, 0, 1.25]
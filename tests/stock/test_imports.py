@@ -0,0 +1,108 @@
+import asyncio
+
+from fastapi import HTTPException
+from pytest import mark, raises
+
+from santaka.db import database, stock_positions, stock_transactions
+from santaka.stock import imports
+from santaka.stock.imports import import_stock_transactions
+from santaka.stock.models import StatementFormat
+from tests.helpers import iterate_chunks, seed_owner
+
+QUOTES = {
+    "NEW.MI": {
+        "regularMarketPrice": 20,
+        "currency": "EUR",
+        "fullExchangeName": "Milan",
+        "shortName": "new",
+    },
+    "NEW": {
+        "regularMarketPrice": 30,
+        "currency": "USD",
+        "fullExchangeName": "NasdaqGS",
+        "shortName": "new us",
+    },
+    "EURUSD=X": {"regularMarketPrice": 1.2},
+}
+
+
+@mark.asyncio
+async def test_import_csv(clean_database, monkeypatch):
+    quote_calls = []
+
+    async def write():
+        async with database.transaction():
+            pass
+
+    async def get_yahoo_quote(symbols):
+        quote_calls.append(symbols)
+        # the import doesn't hold the write lock while it waits for the quotes
+        await asyncio.wait_for(asyncio.create_task(write()), 1)
+        return {symbol: QUOTES[symbol] for symbol in symbols if symbol in QUOTES}
+
+    monkeypatch.setattr(imports, "get_yahoo_quote", get_yahoo_quote)
+    seed_owner()
+    body = (
+        "\ufeffsymbol,price,quantity,date,transaction_type,transaction_note\r\n"
+        "sym.mi,10,5,2021-01-02T10:00:00,buy,\r\n"
+        'SYM.MI,14,12,2021-02-01T10:00:00,sell,"sold, all"\r\n'
+        "new.mi,20,3,2021-03-01T10:00:00,buy,\r\n"
+        "NEW,30,1,2021-03-01T10:00:00+02:00,buy,\r\n"
+    )
+    async with database:
+        result = await import_stock_transactions(
+            1, "EUR", iterate_chunks(body), StatementFormat.CSV
+        )
+        assert result == {"imported": 4, "created_stocks": ["NEW", "NEW.MI"]}
+        assert quote_calls == [["NEW", "NEW.MI"], ["EURUSD=X"]]
+        positions = {
+            record.stock_id: record.quantity
+            for record in await database.fetch_all(stock_positions.select())
+        }
+        assert len(positions) == 3
+        assert positions[1] == 3
+        records = await database.fetch_all(
+            stock_transactions.select().where(
+                stock_transactions.c.transaction_note.isnot(None)
+            )
+        )
+        assert [record.transaction_note for record in records] == ["sold, all"]
+
+
+@mark.asyncio
+async def test_import_ndjson_reports_invalid_rows(clean_database):
+    seed_owner()
+    body = "\n".join(
+        [
+            '{"symbol": "SYM.MI", "price": 12, "quantity": 10, '
+            '"date": "2021-01-04T00:00:00", "transaction_type": "buy"}',
+            '{"symbol": "SYM.MI", "price": 12, "quantity": 25, '
+            '"date": "2021-01-05T00:00:00", "transaction_type": "sell"}',
+            '{"symbol": "SYM.MI", "price": 12, "quantity": 5, '
+            '"date": "2021-01-03T00:00:00", "transaction_type": "sell"}',
+        ]
+    )
+    async with database:
+        with raises(HTTPException) as e:
+            await import_stock_transactions(
+                1, "EUR", iterate_chunks(body), StatementFormat.NDJSON
+            )
+        assert e.value.detail == [
+            "line 1: You cannot duplicate a transaction",
+            "line 2: Cannot sell more than 15 stocks",
+            "line 3: Cannot sell more than 0 stocks",
+        ]
+
+        with raises(HTTPException) as e:
+            await import_stock_transactions(
+                1,
+                "EUR",
+                iterate_chunks('{"symbol": "SYM.MI"}\nnot json'),
+                StatementFormat.NDJSON,
+            )
+        assert e.value.detail[0].startswith("line 1: price")
+        assert e.value.detail[-1] == "line 2: malformed row"
+        count = await database.fetch_val(
+            stock_transactions.count().where(stock_transactions.c.owner_id == 1)
+        )
+        assert count == 1
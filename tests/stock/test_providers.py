@@ -0,0 +1,104 @@
+import asyncio
+import json
+import socket
+
+from aiohttp import web
+from pytest import mark, raises
+
+from santaka.http_client import HTTPClient
+from santaka.stock import providers
+from santaka.stock.providers import (
+    YAHOO_FIELD_CURRENCY,
+    YAHOO_FIELD_MARKET,
+    YAHOO_FIELD_PRICE,
+    QuoteProvider,
+    RandomWalkProvider,
+    ReplayProvider,
+    YahooError,
+    YahooMarket,
+    YahooProvider,
+    create_quote_provider,
+)
+
+
+@mark.asyncio
+async def test_random_walk_provider_is_deterministic():
+    first = RandomWalkProvider(seed=42)
+    second = RandomWalkProvider(seed=42)
+    for _ in range(3):
+        assert await first.get_quotes(["AAPL", "ENI.MI"]) == await second.get_quotes(
+            ["AAPL", "ENI.MI"]
+        )
+    quotes = await first.get_quotes(["ENI.MI", "EURUSD=X"])
+    assert quotes["ENI.MI"][YAHOO_FIELD_MARKET] == YahooMarket.ITALY.value
+    assert quotes["EURUSD=X"][YAHOO_FIELD_CURRENCY] == "USD"
+
+
+@mark.asyncio
+async def test_replay_provider_cycles_recorded_quotes(tmp_path):
+    def response(price):
+        return {
+            "quoteResponse": {
+                "result": [
+                    {
+                        "symbol": "VOD.L",
+                        YAHOO_FIELD_PRICE: price,
+                        YAHOO_FIELD_MARKET: YahooMarket.UK.value,
+                    }
+                ]
+            }
+        }
+
+    path = tmp_path / "quotes.json"
+    path.write_text(json.dumps([response(100), response(200)]))
+    provider = ReplayProvider(str(path))
+    prices = []
+    for _ in range(3):
+        quotes = await provider.get_quotes(["VOD.L", "MISSING"])
+        prices.append(quotes["VOD.L"][YAHOO_FIELD_PRICE])
+    assert prices == [1, 2, 1]
+
+
+def test_create_quote_provider():
+    assert isinstance(create_quote_provider("yahoo"), YahooProvider)
+    assert isinstance(create_quote_provider("random_walk"), RandomWalkProvider)
+
+
+def test_quote_provider_requires_get_quotes():
+    class IncompleteProvider(QuoteProvider):
+        pass
+
+    with raises(TypeError):
+        IncompleteProvider()
+
+
+@mark.asyncio
+async def test_yahoo_provider_raises_yahoo_error(monkeypatch):
+    async def slow_quote(request):
+        await asyncio.sleep(1)
+        return web.json_response({"quoteResponse": {"result": []}})
+
+    app = web.Application()
+    app.router.add_get("/quote", slow_quote)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    # a port nobody listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_port = sock.getsockname()[1]
+    client = HTTPClient(total_timeout=0.1)
+    monkeypatch.setattr(providers, "http_client", client)
+    await client.connect()
+    try:
+        for url in (
+            f"http://127.0.0.1:{port}/quote",
+            f"http://127.0.0.1:{closed_port}/quote",
+        ):
+            with raises(YahooError):
+                await YahooProvider(url).get_quotes(["AAPL"])
+    finally:
+        await client.disconnect()
+        await runner.cleanup()
@@ -4,6 +4,10 @@ from datetime import datetime
 
 from pytest import mark, approx
 
+from santaka.analytics import calculate_position_change
+from santaka.cache import TTLCache
+from santaka.db import currency, database, stocks
+from santaka.stock import utils
 from santaka.stock.utils import YahooMarket, prepare_traded_stocks, TransactionRecords
 from santaka.stock.models import TransactionType
 from santaka.account.models import Bank
@@ -15,7 +19,11 @@ from santaka.stock.utils import (
     check_profit_and_loss_upper_limit,
     check_lower_limit_price,
     check_upper_limit_price,
+    get_stock_fields,
+    prepare_traded_stocks_from_positions,
+    split_in_batches,
 )
+from tests.helpers import generate_transaction_records
 
 
 @mark.parametrize(
@@ -192,3 +200,163 @@ def test_check_lower_limit_price(last_price, lower_limit_price, expected_boolean
 def test_check_upper_limit_price(last_price, upper_limit_price, expected_boolean):
     answer = check_upper_limit_price(last_price, upper_limit_price)
     assert answer is expected_boolean
+
+
+@mark.parametrize(
+    "symbols,size,expected_batches",
+    (
+        ([], 2, []),
+        (["AAPL"], 2, [["AAPL"]]),
+        (["AAPL", "MDLZ", "LMT"], 2, [["AAPL", "MDLZ"], ["LMT"]]),
+        (
+            ["AAPL", "MDLZ", "LMT", "EURUSD=X"],
+            2,
+            [["AAPL", "MDLZ"], ["LMT", "EURUSD=X"]],
+        ),
+    ),
+)
+def test_split_in_batches(symbols, size, expected_batches):
+    assert split_in_batches(symbols, size) == expected_batches
+
+
+@mark.asyncio
+async def test_get_yahoo_quote_uses_cache(monkeypatch):
+    requested = []
+
+    class FakeProvider:
+        async def get_quotes(self, symbols):
+            requested.append(symbols)
+            return {symbol: {"symbol": symbol} for symbol in symbols}
+
+    monkeypatch.setattr(utils, "quote_provider", FakeProvider())
+    monkeypatch.setattr(utils, "quote_cache", TTLCache(maxsize=10, ttl=60))
+
+    await utils.get_yahoo_quote(["AAPL"])
+    quotes = await utils.get_yahoo_quote(["AAPL", "MDLZ"])
+    assert set(quotes) == {"AAPL", "MDLZ"}
+    await utils.get_yahoo_quote(["AAPL"], bypass_cache=True)
+    assert requested == [["AAPL"], ["MDLZ"], ["AAPL"]]
+
+
+def seed_quotes(stock_count: int, currency_count: int, last_update: datetime):
+    database.engine.execute(
+        currency.insert(),
+        [
+            {
+                "currency_id": currency_id,
+                "iso_currency": f"C{currency_id}",
+                "symbol": None if currency_id == 1 else f"EURC{currency_id}=X",
+                "last_rate": 1,
+                "last_update": last_update,
+            }
+            for currency_id in range(1, currency_count + 1)
+        ],
+    )
+    if not stock_count:
+        return
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": stock_id,
+                "market": YahooMarket.ITALY.value,
+                "symbol": f"SYM{stock_id}.MI",
+                "short_name": f"sym {stock_id}",
+                "last_price": 10,
+                "last_update": last_update,
+                "currency_id": 1,
+            }
+            for stock_id in range(1, stock_count + 1)
+        ],
+    )
+
+
+@mark.asyncio
+@mark.parametrize("batch_size", (1, 2, 4, 300))
+async def test_update_stock_prices(batch_size, clean_database, monkeypatch):
+    monkeypatch.setattr(utils, "BULK_UPDATE_BATCH_SIZE", batch_size)
+    last_update = datetime(2021, 1, 1)
+    now = datetime(2021, 1, 2)
+    seed_quotes(5, 1, last_update)
+    # the last stock is left as it is, the unknown symbol is ignored
+    prices = {
+        f"SYM{stock_id}.MI": Decimal(f"{stock_id}.25") for stock_id in range(1, 5)
+    }
+    prices["UNKNOWN.MI"] = Decimal("1")
+    async with database:
+        await utils.update_stock_prices(prices, now)
+        records = await database.fetch_all(stocks.select().order_by(stocks.c.stock_id))
+    assert [(r.symbol, r.last_price, r.last_update) for r in records] == [
+        ("SYM1.MI", Decimal("1.25"), now),
+        ("SYM2.MI", Decimal("2.25"), now),
+        ("SYM3.MI", Decimal("3.25"), now),
+        ("SYM4.MI", Decimal("4.25"), now),
+        ("SYM5.MI", Decimal("10"), last_update),
+    ]
+
+
+@mark.asyncio
+@mark.parametrize("batch_size", (1, 2, 3, 300))
+async def test_update_currency_rates(batch_size, clean_database, monkeypatch):
+    monkeypatch.setattr(utils, "BULK_UPDATE_BATCH_SIZE", batch_size)
+    last_update = datetime(2021, 1, 1)
+    now = datetime(2021, 1, 2)
+    seed_quotes(0, 4, last_update)
+    # a float rate is bound as the numeric column, under asyncpg too
+    rates = {"EURC2=X": Decimal("1.5"), "EURC3=X": 0.75, "UNKNOWN=X": 2}
+    async with database:
+        await utils.update_currency_rates(rates, now)
+        records = await database.fetch_all(
+            currency.select().order_by(currency.c.currency_id)
+        )
+    assert [(r.symbol, r.last_rate, r.last_update) for r in records] == [
+        (None, Decimal("1"), last_update),
+        ("EURC2=X", Decimal("1.5"), now),
+        ("EURC3=X", Decimal("0.75"), now),
+        ("EURC4=X", Decimal("1"), last_update),
+    ]
+
+
+CENT = Decimal("0.01")
+NUMERIC_FIELDS = (
+    "fiscal_price",
+    "fiscal_price_converted",
+    "profit_and_loss",
+    "profit_and_loss_converted",
+    "invested",
+    "invested_converted",
+    "current_ctv",
+    "current_ctv_converted",
+)
+
+
+@mark.parametrize("seed", (1, 2, 3))
+def test_positions_match_transactions(seed):
+    records = generate_transaction_records(seed, stock_count=30, transaction_count=60)
+    positions = {}
+    for record in records:
+        quantity, invested, invested_converted = positions.get(
+            record[0], (0, Decimal("0"), Decimal("0"))
+        )[-3:]
+        positions[record[0]] = (get_stock_fields(record),) + calculate_position_change(
+            quantity,
+            invested,
+            invested_converted,
+            record[6],
+            record[7],
+            record[8],
+            record[9],
+            record[16],
+        )
+    position_records = [
+        stock_fields + (quantity, invested, invested_converted)
+        for stock_fields, quantity, invested, invested_converted in positions.values()
+    ]
+    expected_stocks = prepare_traded_stocks(list(records))
+    traded_stocks = prepare_traded_stocks_from_positions(position_records)
+    assert len(traded_stocks) == len(expected_stocks)
+    for stock, expected_stock in zip(traded_stocks, expected_stocks):
+        assert stock["stock_id"] == expected_stock["stock_id"]
+        assert stock["current_quantity"] == expected_stock["current_quantity"]
+        for field in NUMERIC_FIELDS:
+            assert abs(stock[field] - expected_stock[field]) < CENT, field
@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fastapi import HTTPException, Response
+from pytest import mark, raises
+
+from santaka.db import currency, database, stock_transactions, stocks
+from santaka.stock import views
+from santaka.stock.models import NewStock, NewStockTransaction
+from santaka.stock.utils import (
+    encode_history_cursor,
+    rebuild_positions,
+    update_stock_prices,
+)
+from santaka.stock.views import (
+    create_stock,
+    create_stock_transaction,
+    get_stock_transaction_history,
+    get_traded_stocks,
+)
+from santaka.user import User
+from tests.helpers import make_request, seed_owner
+
+USER = User(username="user", user_id=1, base_currency="EUR")
+
+
+async def get_history(limit=2, cursor=None, from_date=None, to_date=None):
+    return await get_stock_transaction_history(
+        1, 1, limit, cursor, from_date, to_date, USER
+    )
+
+
+@mark.asyncio
+async def test_transaction_history_pages(clean_database):
+    seed_owner()
+    # two transactions share a date, the id breaks the tie
+    database.engine.execute(
+        stock_transactions.insert(),
+        [
+            {
+                "stock_transaction_id": i,
+                "stock_id": 1,
+                "owner_id": 1,
+                "price": 12,
+                "quantity": 1,
+                "date": datetime(2021, 1, 5) + timedelta(days=min(i, 4)),
+                "transaction_type": "buy",
+                "transaction_ex_rate": 1,
+            }
+            for i in range(2, 6)
+        ],
+    )
+    async with database:
+        ids = []
+        cursor = None
+        while True:
+            history = await get_history(cursor=cursor)
+            ids.extend(
+                transaction["stock_transaction_id"]
+                for transaction in history["transactions"]
+            )
+            cursor = history["next_cursor"]
+            if cursor is None:
+                break
+        assert ids == [5, 4, 3, 2, 1]
+
+        history = await get_history(
+            limit=10, from_date=datetime(2021, 1, 7), to_date=datetime(2021, 1, 9)
+        )
+        assert [
+            transaction["stock_transaction_id"]
+            for transaction in history["transactions"]
+        ] == [3, 2]
+        assert history["next_cursor"] is None
+
+        # the date of an aware cursor is bound like the naive column
+        cursor = encode_history_cursor(datetime(2021, 1, 8, tzinfo=timezone.utc), 3)
+        history = await get_history(limit=10, cursor=cursor)
+        assert [
+            transaction["stock_transaction_id"]
+            for transaction in history["transactions"]
+        ] == [2, 1]
+
+        with raises(HTTPException) as e:
+            await get_history(cursor="not a cursor")
+        assert e.value.status_code == 422
+
+
+@mark.asyncio
+async def test_traded_stocks_etag(clean_database):
+    seed_owner()
+    async with database:
+        await rebuild_positions()
+        response = Response()
+        content = await get_traded_stocks(1, make_request(), response, USER)
+        assert content["stocks"][0]["current_quantity"] == 10
+        etag = response.headers["etag"]
+
+        request = make_request({"If-None-Match": etag})
+        not_modified = await get_traded_stocks(1, request, Response(), USER)
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == etag
+
+        # a new transaction and a new price both change the etag
+        transaction = NewStockTransaction(
+            stock_id=1,
+            price=13,
+            quantity=2,
+            date=datetime(2021, 1, 6),
+            transaction_type="buy",
+        )
+        await create_stock_transaction(1, transaction, USER)
+        response = Response()
+        content = await get_traded_stocks(1, request, response, USER)
+        assert content["stocks"][0]["current_quantity"] == 12
+        etag = response.headers["etag"]
+
+        await update_stock_prices({"SYM.MI": 16}, datetime.utcnow())
+        request = make_request({"If-None-Match": etag})
+        response = Response()
+        content = await get_traded_stocks(1, request, response, USER)
+        assert content["stocks"][0]["last_price"] == 16
+        assert response.headers["etag"] != etag
+
+
+@mark.asyncio
+async def test_create_stock_calls_yahoo_outside_of_the_transaction(
+    clean_database, monkeypatch
+):
+    quotes = {
+        "NEW": {
+            "regularMarketPrice": 30,
+            "currency": "USD",
+            "fullExchangeName": "NasdaqGS",
+            "shortName": "new",
+        },
+        "EURUSD=X": {"regularMarketPrice": 1.2},
+    }
+
+    async def call_yahoo_from_view(symbol):
+        # a write of another request doesn't wait for the quote
+        async def write():
+            async with database.transaction():
+                pass
+
+        await asyncio.wait_for(asyncio.create_task(write()), 1)
+        return quotes[symbol]
+
+    monkeypatch.setattr(views, "call_yahoo_from_view", call_yahoo_from_view)
+    seed_owner()
+    async with database:
+        stock = await create_stock(NewStock(symbol="new"), USER)
+        assert stock["symbol"] == "NEW"
+        assert stock["iso_currency"] == "USD"
+        assert stock["last_price"] == 30
+        rate = await database.fetch_val(
+            currency.select().where(currency.c.iso_currency == "USD"),
+            column="last_rate",
+        )
+        assert rate == Decimal("1.2")
+        assert (await create_stock(NewStock(symbol="NEW"), USER))["stock_id"] == (
+            await database.fetch_val(
+                stocks.select().where(stocks.c.symbol == "NEW"), column="stock_id"
+            )
+        )
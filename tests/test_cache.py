@@ -0,0 +1,52 @@
+from santaka.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_expires_entries():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set("AAPL", 1)
+    timer.now = 59
+    assert cache.get("AAPL") == 1
+    timer.now = 60
+    assert cache.get("AAPL") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_entry_ttl_overrides_default():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set("AAPL", 1, ttl=5)
+    timer.now = 5
+    assert cache.get("AAPL") is None
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("AAPL", 1)
+    cache.set("MDLZ", 2)
+    cache.get("AAPL")
+    cache.set("LMT", 3)
+    assert cache.get("MDLZ") is None
+    assert cache.get("AAPL") == 1
+    assert cache.get("LMT") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_counters():
+    cache = TTLCache(maxsize=2, ttl=60)
+    assert cache.hit_rate == 0
+    cache.set("AAPL", 1)
+    cache.get("AAPL")
+    cache.get("AAPL")
+    cache.get("MDLZ")
+    assert cache.hits == 2
+    assert cache.misses == 1
+    assert cache.hit_rate == 2 / 3
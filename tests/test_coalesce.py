@@ -0,0 +1,64 @@
+import asyncio
+
+from pytest import mark, raises
+
+from santaka.coalesce import Coalescer
+
+
+class FakeFetch:
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+
+    async def __call__(self, keys):
+        self.calls.append(sorted(keys))
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return {key: key.lower() for key in keys if key != "MISSING"}
+
+
+@mark.asyncio
+async def test_coalescer_merges_concurrent_lookups():
+    fetch = FakeFetch()
+    coalescer = Coalescer(fetch, window=0.01)
+    results = await asyncio.gather(
+        coalescer.get_many(["AAPL"]),
+        coalescer.get_many(["AAPL"]),
+        coalescer.get_many(["MDLZ", "AAPL"]),
+        coalescer.get_many(["MISSING"]),
+    )
+    assert fetch.calls == [["AAPL", "MDLZ", "MISSING"]]
+    assert results == [
+        {"AAPL": "aapl"},
+        {"AAPL": "aapl"},
+        {"MDLZ": "mdlz", "AAPL": "aapl"},
+        {},
+    ]
+    assert coalescer.coalesced == 2
+
+
+@mark.asyncio
+async def test_coalescer_joins_in_flight_lookup():
+    fetch = FakeFetch()
+    coalescer = Coalescer(fetch, window=0)
+    first = asyncio.ensure_future(coalescer.get_many(["AAPL"]))
+    await asyncio.sleep(0.005)
+    second = await coalescer.get_many(["AAPL"])
+    assert await first == second == {"AAPL": "aapl"}
+    assert fetch.calls == [["AAPL"]]
+    await coalescer.get_many(["AAPL"])
+    assert fetch.calls == [["AAPL"], ["AAPL"]]
+
+
+@mark.asyncio
+async def test_coalescer_propagates_errors():
+    coalescer = Coalescer(FakeFetch(ValueError("boom")), window=0)
+    results = await asyncio.gather(
+        coalescer.get_many(["AAPL"]),
+        coalescer.get_many(["AAPL"]),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    with raises(ValueError):
+        await coalescer.get_many(["AAPL"])
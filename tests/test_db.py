@@ -0,0 +1,146 @@
+import asyncio
+
+import sqlalchemy
+from pytest import mark, raises
+
+from santaka.db import (
+    LazyDatabase,
+    StorageProfile,
+    WorkerIdLease,
+    create_schema,
+    entered_transactions,
+    metadata,
+    users,
+)
+from santaka.ids import ID_EPOCH, ID_MAX_WORKER, IdGenerator
+from tests.helpers import FakeClock
+
+
+@mark.asyncio
+async def test_lazy_database_connects_on_first_use(tmp_path):
+    url = f"sqlite:///{tmp_path}/lazy.db"
+    lazy_database = LazyDatabase(url, StorageProfile.TUNED)
+    transaction = lazy_database.transaction()
+    assert not (tmp_path / "lazy.db").exists()
+
+    create_schema(lazy_database.engine)
+    async with lazy_database:
+        async with transaction:
+            await lazy_database.execute(
+                users.insert().values(
+                    user_id=1, username="user", password="", base_currency="EUR"
+                )
+            )
+        assert await lazy_database.fetch_val(sqlalchemy.select([users.c.username]))
+        with raises(RuntimeError):
+            lazy_database.configure(f"sqlite:///{tmp_path}/other.db")
+    lazy_database.configure(f"sqlite:///{tmp_path}/other.db")
+    assert not (tmp_path / "other.db").exists()
+
+
+@mark.asyncio
+async def test_nested_lazy_transactions(tmp_path):
+    url = f"sqlite:///{tmp_path}/nested.db"
+    lazy_database = LazyDatabase(url, StorageProfile.DEFAULT)
+    create_schema(lazy_database.engine)
+    outer = lazy_database.transaction()
+    inner = lazy_database.transaction()
+
+    def insert_user(user_id: int):
+        return lazy_database.execute(
+            users.insert().values(
+                user_id=user_id, username=str(user_id), password="", base_currency="EUR"
+            )
+        )
+
+    async with lazy_database:
+        async with outer:
+            await insert_user(1)
+            with raises(ValueError):
+                async with inner:
+                    await insert_user(2)
+                    async with outer:
+                        await insert_user(3)
+                    assert len(entered_transactions.get()) == 2
+                    raise ValueError()
+            assert [owner for owner, _ in entered_transactions.get()] == [outer]
+        assert entered_transactions.get() == ()
+        # the inner savepoint was rolled back with the one nested in it
+        user_ids = await lazy_database.fetch_all(sqlalchemy.select([users.c.user_id]))
+        assert [user_id for user_id, in user_ids] == [1]
+
+
+@mark.asyncio
+async def test_concurrent_calls_of_a_transaction_decorator(tmp_path):
+    url = f"sqlite:///{tmp_path}/concurrent.db"
+    lazy_database = LazyDatabase(url, StorageProfile.TUNED)
+    create_schema(lazy_database.engine)
+
+    @lazy_database.transaction()
+    async def create_user(user_id: int):
+        await lazy_database.execute(
+            users.insert().values(
+                user_id=user_id, username=str(user_id), password="", base_currency="EUR"
+            )
+        )
+        # the other calls start their transaction meanwhile
+        await asyncio.sleep(0.01)
+        if user_id % 2:
+            raise ValueError(user_id)
+
+    async with lazy_database:
+        results = await asyncio.gather(
+            *[create_user(user_id) for user_id in range(8)], return_exceptions=True
+        )
+        assert [type(result) for result in results] == [type(None), ValueError] * 4
+        # the odd calls were rolled back, the even ones committed
+        user_ids = await lazy_database.fetch_all(
+            sqlalchemy.select([users.c.user_id]).order_by(users.c.user_id)
+        )
+        assert [user_id for user_id, in user_ids] == [0, 2, 4, 6]
+
+
+def test_create_schema_is_idempotent(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path}/schema.db")
+    create_schema(engine)
+    create_schema(engine)
+    assert "ix_stock_transactions_stock_id" in {
+        index["name"]
+        for index in sqlalchemy.inspect(engine).get_indexes("stock_transactions")
+    }
+
+
+def test_sqlite_ids_are_rowids(tmp_path):
+    # a primary key other than the rowid has its own sqlite_autoindex
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path}/rowids.db")
+    create_schema(engine)
+    for table in metadata.sorted_tables:
+        if len(table.primary_key.columns) == 1:
+            index_count = engine.execute(
+                "SELECT count(*) FROM pragma_index_list(?) WHERE origin = 'pk'",
+                table.name,
+            ).scalar()
+            assert index_count == 0, table.name
+
+
+def test_processes_lease_different_worker_ids(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path}/workers.db")
+    create_schema(engine)
+    clock = FakeClock(ID_EPOCH)
+    leases = [
+        WorkerIdLease(IdGenerator(clock=clock), 1) for _ in range(ID_MAX_WORKER + 2)
+    ]
+    worker_ids = [lease.acquire(engine) for lease in leases[:-1]]
+    assert sorted(worker_ids) == list(range(ID_MAX_WORKER + 1))
+    with raises(RuntimeError):
+        leases[-1].acquire(engine)
+
+    # a renewal keeps the worker id, a released or expired one is leased again
+    clock.millis += 500
+    assert leases[0].acquire(engine) == worker_ids[0]
+    leases[1].release(engine)
+    assert leases[-1].acquire(engine) == worker_ids[1]
+    clock.millis += 500
+    assert leases[1].acquire(engine) not in (worker_ids[0], worker_ids[1])
+    with raises(RuntimeError):
+        leases[2].generator()
@@ -0,0 +1,68 @@
+from pytest import raises
+
+from santaka.ids import (
+    ID_EPOCH,
+    ID_MAX_SEQUENCE,
+    ID_MAX_WORKER,
+    IdGenerator,
+    get_first_id,
+    get_id_millis,
+)
+from tests.helpers import FakeClock
+
+
+def test_ids_are_time_ordered_and_unique():
+    clock = FakeClock(ID_EPOCH + 1000)
+    create_id = IdGenerator(3, clock)
+    ids = [create_id() for _ in range(10)]
+    clock.millis += 1
+    ids.append(create_id())
+    # a clock moving backwards doesn't break the ordering
+    clock.millis -= 500
+    ids.append(create_id())
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert get_id_millis(ids[0]) == ID_EPOCH + 1000
+    assert get_id_millis(ids[-1]) == ID_EPOCH + 1001
+    assert all(id_ < 2**53 for id_ in ids)
+
+
+def test_sequence_exhaustion_waits_for_next_millisecond():
+    clock = FakeClock(ID_EPOCH)
+
+    def tick():
+        # the clock only moves once the generator starts waiting
+        if clock.calls > ID_MAX_SEQUENCE + 5:
+            clock.millis = ID_EPOCH + 1
+        return clock()
+
+    create_id = IdGenerator(0, tick)
+    ids = [create_id() for _ in range(ID_MAX_SEQUENCE + 2)]
+    assert len(set(ids)) == len(ids)
+    assert get_id_millis(ids[-1]) == ID_EPOCH + 1
+
+
+def test_ids_of_different_workers_differ():
+    first = IdGenerator(1, FakeClock(ID_EPOCH))
+    second = IdGenerator(2, FakeClock(ID_EPOCH))
+    assert first() != second()
+    with raises(ValueError):
+        IdGenerator(16)
+
+
+def test_first_id_of_a_millisecond():
+    create_id = IdGenerator(ID_MAX_WORKER, FakeClock(ID_EPOCH + 1000))
+    id_ = create_id()
+    assert get_first_id(ID_EPOCH + 1000) <= id_ < get_first_id(ID_EPOCH + 1001)
+
+
+def test_ids_need_a_worker_id_until_the_lease_expires():
+    clock = FakeClock(ID_EPOCH)
+    create_id = IdGenerator(clock=clock)
+    with raises(RuntimeError):
+        create_id()
+    create_id.set_worker_id(1, ID_EPOCH + 10)
+    create_id()
+    clock.millis += 10
+    with raises(RuntimeError):
+        create_id()
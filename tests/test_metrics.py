@@ -0,0 +1,186 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from pytest import mark, raises
+from starlette.testclient import TestClient
+
+from santaka.cache import TTLCache
+from santaka.db import currency, database, stocks
+from santaka.metrics import (
+    Counter,
+    Histogram,
+    Metric,
+    MetricsMiddleware,
+    REQUEST_LATENCY,
+    Registry,
+    add_cache_collector,
+    registry,
+    serve_metrics,
+)
+from santaka.stock.utils import CURRENCY_RATE_AGE, STOCK_PRICE_AGE, quote_coalescer
+from santaka.stock.utils import POSITION_SUMMARY_ROWS
+from santaka.stock.utils import prepare_traded_stocks_from_positions
+from santaka.stock.utils import update_price_age_gauges
+from santaka.user import password_hasher
+from tests.helpers import seed_owner
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency", "latency", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, "/a")
+    assert histogram.render().splitlines() == [
+        "# HELP latency latency",
+        "# TYPE latency histogram",
+        'latency_bucket{route="/a",le="0.1"} 2',
+        'latency_bucket{route="/a",le="1.0"} 3',
+        'latency_bucket{route="/a",le="+Inf"} 4',
+        'latency_sum{route="/a"} 3.65',
+        'latency_count{route="/a"} 4',
+    ]
+
+
+def test_metrics_must_render_their_samples():
+    with raises(TypeError):
+        Metric("latency", "latency")
+
+
+@mark.asyncio
+async def test_registry_rejects_duplicates_and_runs_collectors():
+    registry = Registry()
+    counter = registry.register(Counter("calls_total", "calls", ("outcome",)))
+    with raises(ValueError):
+        registry.register(Counter("calls_total", "calls"))
+
+    async def collect():
+        counter.inc('say "hi"')
+
+    registry.add_collector(collect)
+    assert 'calls_total{outcome="say \\"hi\\""} 1.0' in await registry.collect()
+
+
+def test_middleware_labels_requests_with_the_route():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"item_id": item_id}
+
+    app.add_middleware(MetricsMiddleware, routes=app.routes)
+    client = TestClient(app)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/x").status_code == 422
+    assert client.get("/missing").status_code == 404
+    for labels in (
+        ("GET", "/items/{item_id}", "200"),
+        ("GET", "/items/{item_id}", "422"),
+        ("GET", "unmatched", "404"),
+    ):
+        assert labels in REQUEST_LATENCY.values
+
+
+@mark.asyncio
+async def test_serve_metrics():
+    # the collectors read the price ages from the database
+    async with database:
+        server = await serve_metrics("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        server.close()
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"# TYPE santaka_db_query_duration_seconds histogram" in response
+
+
+@mark.asyncio
+async def test_cache_collector(monkeypatch):
+    monkeypatch.setattr(registry, "collectors", [])
+    cache = TTLCache(1, 60)
+    add_cache_collector("test", cache)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("b")
+    text = await registry.collect()
+    assert 'santaka_cache_hits_total{cache="test"} 2.0' in text
+    assert 'santaka_cache_misses_total{cache="test"} 1.0' in text
+    assert 'santaka_cache_evictions_total{cache="test"} 1.0' in text
+    assert 'santaka_cache_entries{cache="test"} 1.0' in text
+    assert 'santaka_cache_hit_ratio{cache="test"} 0.6666666666666666' in text
+
+
+@mark.asyncio
+async def test_in_process_stats_are_collected(monkeypatch):
+    # the stats kept by the hasher and the coalescer are only read on scrape
+    monkeypatch.setattr(password_hasher, "completed", 4)
+    monkeypatch.setattr(password_hasher, "total_wait", 2.0)
+    monkeypatch.setattr(password_hasher, "max_queued", 3)
+    monkeypatch.setattr(quote_coalescer, "fetches", 5)
+    monkeypatch.setattr(quote_coalescer, "coalesced", 7)
+    # without the collector that reads the database
+    collectors = [c for c in registry.collectors if c is not update_price_age_gauges]
+    monkeypatch.setattr(registry, "collectors", collectors)
+    text = await registry.collect()
+    assert "santaka_password_hashes_total 4.0" in text
+    assert "santaka_password_hash_wait_seconds_total 2.0" in text
+    assert "santaka_password_hash_wait_seconds_average 0.5" in text
+    assert "santaka_password_hash_max_queued 3.0" in text
+    assert "santaka_quote_fetches_total 5.0" in text
+    assert "santaka_quote_coalesced_total 7.0" in text
+    assert 'santaka_cache_hits_total{cache="users"}' in text
+    assert 'santaka_cache_hits_total{cache="quotes"}' in text
+
+
+def test_position_summary_metrics():
+    count = sum(POSITION_SUMMARY_ROWS.values.get((), ([0], [0.0]))[0])
+    prepare_traded_stocks_from_positions([])
+    assert sum(POSITION_SUMMARY_ROWS.values[()][0]) == count + 1
+    text = POSITION_SUMMARY_ROWS.render()
+    assert 'santaka_position_summary_rows_bucket{le="1.0"}' in text
+
+
+@mark.asyncio
+async def test_price_age_gauges(clean_database):
+    seed_owner()
+    now = datetime.utcnow()
+    database.engine.execute(
+        currency.insert(),
+        [
+            {
+                "currency_id": 2,
+                "iso_currency": "USD",
+                "symbol": "EURUSD=X",
+                "last_rate": 1.2,
+                "last_update": now - timedelta(hours=2),
+            }
+        ],
+    )
+    # never traded, it's not kept up to date
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": 2,
+                "market": "NasdaqGS",
+                "symbol": "OLD",
+                "short_name": "old",
+                "last_price": 1,
+                "last_update": now - timedelta(days=30),
+                "currency_id": 2,
+            }
+        ],
+    )
+    database.engine.execute(
+        stocks.update()
+        .where(stocks.c.stock_id == 1)
+        .values(last_update=now - timedelta(hours=1))
+    )
+    async with database:
+        await update_price_age_gauges()
+    assert list(STOCK_PRICE_AGE.values) == [("Milan",)]
+    assert 3600 <= STOCK_PRICE_AGE.values[("Milan",)] < 3660
+    assert 7200 <= CURRENCY_RATE_AGE.values[()] < 7260
@@ -0,0 +1,51 @@
+import asyncio
+from time import sleep
+
+from pytest import mark
+
+from santaka.password import PasswordHasher
+
+
+class SlowContext:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    def hash(self, password):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        sleep(0.05)
+        self.running -= 1
+        return f"hashed-{password}"
+
+    def verify(self, password, hashed_password):
+        return self.hash(password) == hashed_password
+
+
+@mark.asyncio
+async def test_password_hasher_does_not_block_the_loop():
+    context = SlowContext()
+    hasher = PasswordHasher(context, concurrency=2)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    try:
+        hashes = await asyncio.gather(*[hasher.hash(str(i)) for i in range(6)])
+        assert await hasher.verify("1", hashes[1])
+    finally:
+        ticker.cancel()
+        hasher.shutdown()
+    assert hashes == [f"hashed-{i}" for i in range(6)]
+    # 7 hashes of 50ms two at a time: the loop kept ticking meanwhile
+    assert ticks > 20
+    assert context.max_running == 2
+    assert hasher.completed == 7
+    assert hasher.max_queued == 4
+    assert hasher.queued == 0 and hasher.running == 0
+    assert hasher.average_wait > 0
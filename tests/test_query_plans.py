@@ -0,0 +1,224 @@
+import re
+from datetime import datetime, timedelta
+from random import Random
+
+from pytest import fixture, mark
+
+from santaka.account.models import Bank
+from santaka.account.utils import build_accounts_query
+from santaka.db import (
+    accounts,
+    currency,
+    database,
+    owners,
+    stock_alerts,
+    stock_positions,
+    stock_transactions,
+    stocks,
+    users,
+)
+from santaka.stock.exports import build_export_query
+from santaka.stock.providers import YahooMarket
+from santaka.stock.utils import (
+    build_alert_owners_query,
+    build_owners_version_query,
+    build_position_records_query,
+    build_stale_stocks_query,
+    build_stock_alerts_of_stocks_query,
+    build_stock_alerts_query,
+    build_transaction_history_query,
+    build_transaction_records_query,
+)
+
+OWNER_COUNT = 100
+STOCK_COUNT = 500
+TRANSACTIONS_PER_OWNER = 200
+# small lookup tables like currency and users can be scanned, the ones growing
+# with the data can't
+GROWING_TABLES = (
+    "accounts",
+    "owners",
+    "stocks",
+    "stock_transactions",
+    "stock_positions",
+    "stock_alerts",
+)
+pytestmark = mark.skipif(
+    database.engine.dialect.name != "sqlite", reason="EXPLAIN QUERY PLAN is sqlite only"
+)
+FULL_SCAN = re.compile(
+    rf"\bSCAN (TABLE )?({'|'.join(GROWING_TABLES)})\b(?! USING (COVERING )?INDEX)"
+)
+
+
+@fixture(scope="module")
+def realistic_database():
+    random = Random(0)
+    now = datetime.utcnow()
+    markets = [market.value for market in YahooMarket]
+    database.engine.execute(
+        users.insert(),
+        [
+            {
+                "user_id": user_id,
+                "username": str(user_id),
+                "password": "",
+                "base_currency": "EUR",
+            }
+            for user_id in range(1, 11)
+        ],
+    )
+    database.engine.execute(
+        accounts.insert(),
+        [
+            {
+                "account_id": account_id,
+                "user_id": account_id % 10 + 1,
+                "bank": Bank.FINECOBANK.value,
+                "account_number": str(account_id),
+            }
+            for account_id in range(1, OWNER_COUNT + 1)
+        ],
+    )
+    database.engine.execute(
+        owners.insert(),
+        [
+            {"owner_id": owner_id, "account_id": owner_id, "fullname": str(owner_id)}
+            for owner_id in range(1, OWNER_COUNT + 1)
+        ],
+    )
+    database.engine.execute(
+        currency.insert(),
+        [{"currency_id": 1, "iso_currency": "EUR", "last_rate": 1, "last_update": now}],
+    )
+    database.engine.execute(
+        stocks.insert(),
+        [
+            {
+                "stock_id": stock_id,
+                "market": markets[stock_id % len(markets)],
+                "symbol": f"SYM{stock_id}",
+                "short_name": str(stock_id),
+                "last_price": 10,
+                "last_update": now - timedelta(minutes=random.randint(0, 600)),
+                "currency_id": 1,
+            }
+            for stock_id in range(1, STOCK_COUNT + 1)
+        ],
+    )
+    transactions = []
+    positions = {}
+    alerts = []
+    for owner_id in range(1, OWNER_COUNT + 1):
+        for i in range(TRANSACTIONS_PER_OWNER):
+            stock_id = random.randint(1, STOCK_COUNT)
+            date = now - timedelta(days=random.randint(1, 3000))
+            transactions.append(
+                {
+                    "stock_transaction_id": owner_id * TRANSACTIONS_PER_OWNER + i,
+                    "stock_id": stock_id,
+                    "owner_id": owner_id,
+                    "price": 5,
+                    "quantity": 1,
+                    "date": date,
+                    "transaction_type": "buy",
+                    "transaction_ex_rate": 1,
+                }
+            )
+            positions[(owner_id, stock_id)] = {
+                "owner_id": owner_id,
+                "stock_id": stock_id,
+                "quantity": 1,
+                "invested": 5,
+                "invested_converted": 5,
+                "last_transaction_date": date,
+            }
+            if i % 10 == 0:
+                alerts.append(
+                    {
+                        "stock_alert_id": len(alerts) + 1,
+                        "stock_id": stock_id,
+                        "owner_id": owner_id,
+                        "lower_limit_price": 1,
+                    }
+                )
+    database.engine.execute(stock_transactions.insert(), transactions)
+    database.engine.execute(stock_positions.insert(), list(positions.values()))
+    database.engine.execute(stock_alerts.insert(), alerts)
+    database.engine.execute("ANALYZE")
+    yield
+    with database.engine.begin() as connection:
+        for table in (
+            stock_alerts,
+            stock_positions,
+            stock_transactions,
+            stocks,
+            currency,
+            owners,
+            accounts,
+            users,
+        ):
+            connection.execute(table.delete())
+
+
+def explain(query) -> str:
+    compiled = query.compile(database.engine)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    rows = database.engine.execute(f"EXPLAIN QUERY PLAN {compiled}", *params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+@mark.parametrize(
+    "query",
+    [
+        build_transaction_records_query([1, 2, 3]),
+        build_transaction_records_query([1], 1),
+        build_position_records_query([1, 2, 3]),
+        build_position_records_query([1], 1),
+        build_stock_alerts_query([1, 2, 3]),
+        build_stock_alerts_query([1], 1),
+        build_stale_stocks_query(
+            [YahooMarket.ITALY.value, YahooMarket.EU.value],
+            datetime.utcnow() - timedelta(minutes=30),
+        ),
+        build_accounts_query(1),
+        build_export_query(1),
+        build_transaction_history_query(
+            1, 1, 100, (datetime(2021, 6, 1), 1), datetime(2021, 1, 1)
+        ),
+        build_owners_version_query([1, 2, 3], datetime.utcnow()),
+        build_stock_alerts_of_stocks_query([1, 2, 3]),
+        build_alert_owners_query(10),
+    ],
+    ids=[
+        "transaction_records",
+        "transaction_records_of_stock",
+        "position_records",
+        "position_records_of_stock",
+        "stock_alerts",
+        "stock_alerts_of_stock",
+        "stale_stocks",
+        "accounts",
+        "export",
+        "transaction_history",
+        "owners_version",
+        "stock_alerts_of_stocks",
+        "alert_owners",
+    ],
+)
+def test_query_plan_uses_indexes(query, realistic_database):
+    plan = explain(query)
+    assert FULL_SCAN.search(plan) is None, plan
+
+
+def test_export_query_plan_streams_without_sorting(realistic_database):
+    # the first rows of the export are sent before the whole history is read
+    plan = explain(build_export_query(1))
+    assert "USE TEMP B-TREE" not in plan, plan
+
+
+def test_transaction_history_query_plan_reads_pages_in_index_order(realistic_database):
+    plan = explain(
+        build_transaction_history_query(1, 1, 100, (datetime(2021, 6, 1), 1))
+    )
+    assert "USE TEMP B-TREE" not in plan, plan
@@ -0,0 +1,34 @@
+import json
+from decimal import Decimal
+
+from pytest import mark, raises
+
+from santaka import responses
+from santaka.responses import DecimalORJSONResponse, encode_decimal, fast_response
+from tests.helpers import build_traded_stocks, render_with_response_model
+
+requires_orjson = mark.skipif(
+    responses.orjson is None, reason="orjson is not installed"
+)
+
+
+@requires_orjson
+@mark.asyncio
+async def test_fast_response_matches_response_model():
+    content = build_traded_stocks(20)
+    expected = json.loads(await render_with_response_model(content))
+    assert json.loads(DecimalORJSONResponse(content).body) == expected
+
+
+def test_encode_decimal():
+    assert encode_decimal(Decimal("1.5")) == 1.5
+    with raises(TypeError):
+        encode_decimal(object())
+
+
+@requires_orjson
+def test_fast_response_is_opt_in(monkeypatch):
+    content = {"stocks": []}
+    assert fast_response(content) is content
+    monkeypatch.setattr(responses, "FAST_RESPONSES", True)
+    assert isinstance(fast_response(content), DecimalORJSONResponse)
@@ -0,0 +1,57 @@
+from logging import WARNING
+
+from pytest import mark
+
+from santaka import db
+from santaka.db import database, stock_transactions, stocks
+from santaka.metrics import DB_QUERY_LATENCY
+from santaka.slow_queries import SlowQueryLog, get_statement_shape
+
+
+def test_statement_shape_collapses_parameter_lists():
+    dialect = database.database._backend._dialect
+    first = stock_transactions.select().where(
+        stock_transactions.c.stock_id.in_([1, 2, 3])
+    )
+    second = stock_transactions.select().where(stock_transactions.c.stock_id.in_([4]))
+    shape = get_statement_shape(first, dialect)
+    assert shape == get_statement_shape(second, dialect)
+    assert "stock_transactions.stock_id IN (...)" in shape
+    assert "\n" not in shape
+
+
+@mark.asyncio
+async def test_slow_queries_are_logged_with_their_plan(
+    clean_database, monkeypatch, caplog
+):
+    slow_query_log = SlowQueryLog(threshold=0)
+    monkeypatch.setattr(db, "slow_query_log", slow_query_log)
+    caplog.set_level(WARNING, logger="santaka.slow_queries")
+    async with database:
+        for owner_id in (1, 2):
+            await database.fetch_all(
+                stock_transactions.select()
+                .where(stock_transactions.c.owner_id == owner_id)
+                .where(stock_transactions.c.transaction_note == "secret note")
+            )
+        await database.fetch_val(
+            "SELECT count(*) FROM stocks WHERE symbol = :s", {"s": "X"}
+        )
+        await database.execute_many(
+            stocks.delete().where(stocks.c.stock_id == 1), [{}, {}]
+        )
+        iterated = DB_QUERY_LATENCY.values.get(("iterate",), ([0], [0.0]))[0][:]
+        async for record in database.iterate(stocks.select()):
+            pass
+    summary = slow_query_log.summary()
+    assert len(summary) == 4
+    assert any(q.shape.startswith("SELECT stocks") for q in summary)
+    assert sum(DB_QUERY_LATENCY.values[("iterate",)][0]) == sum(iterated) + 1
+    selects = [q for q in summary if q.shape.startswith("SELECT stock_transactions")]
+    assert selects[0].count == 2
+    # sqlite and postgres wording
+    assert any(
+        "USING INDEX" in line or "Index Scan" in line for line in selects[0].plan
+    )
+    assert "secret note" not in caplog.text
+    assert "'transaction_note_1': 'str'" in caplog.text
@@ -0,0 +1,148 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+import sqlalchemy
+from databases import Database
+from pytest import mark, raises
+
+from santaka.db import TUNED_PRAGMAS, StorageProfile, get_connect_args
+from santaka.sqlite import (
+    SQLiteConnectionPool,
+    SQLiteDatabase,
+    create_connection_factory,
+)
+
+metadata = sqlalchemy.MetaData()
+rows = sqlalchemy.Table(
+    "rows",
+    metadata,
+    sqlalchemy.Column("row_id", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("price", sqlalchemy.Numeric(12, 4)),
+    sqlalchemy.Column("date", sqlalchemy.DateTime),
+    sqlalchemy.Column("name", sqlalchemy.String, nullable=True),
+)
+
+
+def create_pool(tmp_path, max_idle: int) -> SQLiteConnectionPool:
+    url = f"sqlite:///{tmp_path}/pool.db"
+    return SQLiteConnectionPool(Database(url).url, max_idle)
+
+
+@mark.asyncio
+async def test_pool_reuses_released_connections(tmp_path):
+    pool = create_pool(tmp_path, 1)
+    connection = await pool.acquire()
+    await pool.release(connection)
+    assert await pool.acquire() is connection
+    await pool.release(connection)
+    await pool.close()
+
+
+@mark.asyncio
+async def test_pool_closes_connections_beyond_max_idle(tmp_path):
+    pool = create_pool(tmp_path, 1)
+    first = await pool.acquire()
+    second = await pool.acquire()
+    await pool.release(first)
+    await pool.release(second)
+    with raises(ValueError):
+        await second.execute("SELECT 1")
+
+    await pool.close()
+    with raises(ValueError):
+        await first.execute("SELECT 1")
+    third = await pool.acquire()
+    assert third not in (first, second)
+    await third.close()
+
+
+@mark.asyncio
+async def test_pragmas_are_set_on_every_connection(tmp_path):
+    url = f"sqlite:///{tmp_path}/pragmas.db"
+    database = SQLiteDatabase(url, 0, **get_connect_args(url, StorageProfile.TUNED))
+    ready = asyncio.Event()
+
+    async def get_cache_size():
+        # the connections are task local, both tasks hold one at the same time
+        async with database.connection():
+            cache_size = await database.fetch_val("PRAGMA cache_size")
+            if ready.is_set():
+                return cache_size
+            ready.set()
+            await asyncio.sleep(0.01)
+            return cache_size
+
+    async with database:
+        assert (
+            await asyncio.gather(get_cache_size(), get_cache_size())
+            == [TUNED_PRAGMAS["cache_size"]] * 2
+        )
+
+
+@mark.asyncio
+async def test_execute_many_matches_databases(tmp_path):
+    values = [
+        {
+            "row_id": i,
+            "price": Decimal("1.2345") * i,
+            "date": datetime(2021, 1, 1, i),
+            "name": None if i % 2 else str(i),
+        }
+        for i in range(10)
+    ]
+    results = []
+    for database_class, args in ((Database, ()), (SQLiteDatabase, (10,))):
+        url = f"sqlite:///{tmp_path}/{database_class.__name__}.db"
+        engine = sqlalchemy.create_engine(url)
+        metadata.create_all(engine)
+        async with database_class(url, *args) as database:
+            await database.execute_many(rows.insert(), values)
+            # rows with different keys fall back to one statement per row
+            await database.execute_many(
+                rows.insert(), [{"row_id": 10}, {"row_id": 11, "name": "11"}]
+            )
+            results.append(await database.fetch_all(rows.select()))
+        engine.dispose()
+    assert [tuple(row) for row in results[0]] == [tuple(row) for row in results[1]]
+    assert len(results[0]) == 12
+
+
+@mark.asyncio
+async def test_transactions_take_the_write_lock_at_begin(tmp_path):
+    url = f"sqlite:///{tmp_path}/immediate.db"
+    database = SQLiteDatabase(url, 0, **get_connect_args(url, StorageProfile.TUNED))
+    other = sqlite3.connect(f"{tmp_path}/immediate.db", timeout=0)
+    async with database:
+        async with database.transaction():
+            with raises(sqlite3.OperationalError, match="locked"):
+                other.execute("BEGIN IMMEDIATE")
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("ROLLBACK")
+    other.close()
+
+
+@mark.asyncio
+async def test_writers_of_a_process_queue_for_the_write_lock(tmp_path):
+    url = f"sqlite:///{tmp_path}/writers.db"
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    engine.dispose()
+    # without waiting in the busy handler, a second BEGIN IMMEDIATE would fail
+    factory = create_connection_factory({"journal_mode": "wal", "busy_timeout": 0})
+    database = SQLiteDatabase(url, 10, check_same_thread=False, factory=factory)
+
+    async def insert(row_id: int):
+        async with database.transaction():
+            await database.execute(rows.insert().values(row_id=row_id))
+            await asyncio.sleep(0.01)
+            if row_id % 2:
+                raise ValueError(row_id)
+
+    async with database:
+        results = await asyncio.gather(
+            *[insert(row_id) for row_id in range(8)], return_exceptions=True
+        )
+        assert [type(result) for result in results] == [type(None), ValueError] * 4
+        assert await database.fetch_val("SELECT count(*) FROM rows") == 4
@@ -0,0 +1,82 @@
+from time import time
+
+from fastapi import HTTPException
+from pytest import mark, raises
+
+from santaka import user
+from santaka.cache import TTLCache
+from santaka.db import create_id, database, users
+from santaka.ids import get_first_id
+
+
+@mark.asyncio
+async def test_get_current_user_is_cached(clean_database, query_counter, monkeypatch):
+    monkeypatch.setattr(user, "user_cache", TTLCache(16, 60))
+    monkeypatch.setattr(user, "user_revisions", user.UserRevisions(60, 60))
+    database.engine.execute(
+        users.insert(),
+        [{"user_id": 1, "username": "user", "password": "", "base_currency": "EUR"}],
+    )
+    token = user.create_access_token("user")
+    async with database:
+        for _ in range(5):
+            current_user = await user.get_current_user(token)
+            assert current_user.base_currency == "EUR"
+        # the revisions poll and the user lookup
+        assert query_counter["queries"] == 2
+        assert user.user_cache.hits == 4
+        assert user.user_cache.hit_rate == 0.8
+
+        # like the update_user command, another process only writes the row
+        await user.update_user("user", base_currency="USD")
+        current_user = await user.get_current_user(token)
+        assert current_user.base_currency == "EUR"
+        # the next poll sees the new revision
+        user.user_revisions.polled_at = None
+        current_user = await user.get_current_user(token)
+        assert current_user.base_currency == "USD"
+        assert query_counter["queries"] == 5
+
+
+@mark.asyncio
+async def test_user_revisions_skip_old_updates(clean_database):
+    database.engine.execute(
+        users.insert(),
+        [
+            {
+                "user_id": 1,
+                "username": "old",
+                "password": "",
+                "base_currency": "EUR",
+                "revision": get_first_id(int((time() - 120) * 1000)),
+            },
+            {
+                "user_id": 2,
+                "username": "new",
+                "password": "",
+                "base_currency": "EUR",
+                "revision": create_id(),
+            },
+            {
+                "user_id": 3,
+                "username": "never",
+                "password": "",
+                "base_currency": "EUR",
+                "revision": None,
+            },
+        ],
+    )
+    revisions = user.UserRevisions(60, 1)
+    async with database:
+        await revisions.poll()
+    assert list(revisions.revisions) == ["new"]
+    assert not revisions.is_current("new", None)
+    assert revisions.is_current("old", None)
+
+
+@mark.asyncio
+async def test_get_current_user_invalid_token(monkeypatch):
+    monkeypatch.setattr(user, "user_cache", TTLCache(16, 60))
+    with raises(HTTPException):
+        await user.get_current_user("invalid")
+    assert len(user.user_cache) == 0